@@ -3,6 +3,7 @@
 #define LSST_MEAS_ASTROM_H
 
 #include "lsst/meas/astrom/matchOptimisticB.h"
+#include "lsst/meas/astrom/PessimisticPatternSearch.h"
 #include "lsst/meas/astrom/PolynomialTransform.h"
 #include "lsst/meas/astrom/SipTransform.h"
 #include "lsst/meas/astrom/ScaledPolynomialTransformFitter.h"
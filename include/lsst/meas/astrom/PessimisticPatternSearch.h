@@ -0,0 +1,158 @@
+// -*- LSST-C++ -*-
+
+/*
+ * LSST Data Management System
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ * See the COPYRIGHT file
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <https://www.lsstcorp.org/LegalNotices/>.
+ */
+#ifndef LSST_MEAS_ASTROM_PessimisticPatternSearch_INCLUDED
+#define LSST_MEAS_ASTROM_PessimisticPatternSearch_INCLUDED
+
+#include <cstdint>
+#include <vector>
+
+#include "Eigen/Core"
+#include "ndarray.h"
+
+namespace lsst {
+namespace meas {
+namespace astrom {
+
+/**
+ *  Compiled pattern search for the pessimistic pattern matcher.
+ *
+ *  This is a port of the candidate search in
+ *  `PessimisticPatternMatcherB._construct_pattern_and_shift_rot_matrix`
+ *  (the shift, rotation and spoke tests), which remains the reference
+ *  implementation.  The search runs over the reference pair index built by
+ *  the Python matcher, which is referenced rather than copied.
+ *
+ *  The search is resumable: start() sets up the search for one source
+ *  pattern and each call to next() advances to the next reference pattern
+ *  that passes the shift, rotation and spoke tests.  The caller then runs the
+ *  intermediate verify step and calls next() again if it fails.
+ *
+ *  @tparam IdT  Integer type of the reference ids in the pair index.
+ */
+template <typename IdT>
+class PessimisticPatternSearch {
+public:
+    /**
+     *  Construct a search over a reference pair index.
+     *
+     *  @param[in] referenceArray  (N, 3) unit vectors of the reference objects.
+     *  @param[in] distArray  Distances of all reference pairs, sorted.
+     *  @param[in] idArray  (M, 2) ids of the reference pairs in distArray.
+     *  @param[in] pairDistArray  Per reference object pair distances, flattened.
+     *  @param[in] pairIdArray  Per reference object paired ids, flattened.
+     *  @param[in] pairIndptrArray  (N + 1) offsets of the pairs of each
+     *                              reference object in pairDistArray and
+     *                              pairIdArray.
+     *
+     *  @throws lsst::pex::exceptions::LengthError if the array sizes do not agree.
+     */
+    PessimisticPatternSearch(ndarray::Array<double const, 2, 2> const& referenceArray,
+                             ndarray::Array<float const, 1, 1> const& distArray,
+                             ndarray::Array<IdT const, 2, 2> const& idArray,
+                             ndarray::Array<float const, 1, 1> const& pairDistArray,
+                             ndarray::Array<IdT const, 1, 1> const& pairIdArray,
+                             ndarray::Array<std::int64_t const, 1, 1> const& pairIndptrArray);
+
+    /**
+     *  Start the search for a source pattern.
+     *
+     *  @param[in] srcPatternArray  (K, 3) unit vectors of the source pattern,
+     *                              the first being the pattern center.
+     *  @param[in] nMatch  Number of points in a matched pattern.
+     *  @param[in] maxCosThetaShift  Minimum cosine of the shift between the
+     *                               pattern centers.
+     *  @param[in] maxCosRotSq  Minimum squared cosine of the rotation between
+     *                          the first spokes.
+     *  @param[in] maxDistRad  Tolerance on the spoke lengths in radians.
+     *
+     *  @throws lsst::pex::exceptions::LengthError if the pattern has less
+     *          than two points.
+     */
+    void start(ndarray::Array<double const, 2, 2> const& srcPatternArray, int nMatch,
+               double maxCosThetaShift, double maxCosRotSq, double maxDistRad);
+
+    /**
+     *  Advance to the next candidate reference pattern.
+     *
+     *  @returns false when there are no candidates left.
+     */
+    bool next();
+
+    /// Ids into the reference array of the current candidate pattern.
+    std::vector<int> const& getRefCandidates() const { return _refCandidates; }
+
+    /// Indices into the source pattern of the current candidate pattern.
+    std::vector<int> const& getSrcCandidates() const { return _srcCandidates; }
+
+    /// Matrix rotating the source pattern onto the current candidate.
+    Eigen::Matrix3d const& getShiftRotMatrix() const { return _shiftRotMatrix; }
+
+    /// Cosine of the shift between the pattern centers of the current candidate.
+    double getCosShift() const { return _cosShift; }
+
+    /// Sine of the rotation between the patterns of the current candidate.
+    double getSinRot() const { return _sinRot; }
+
+private:
+    bool _testCandidate(std::size_t refDistIdx, int pairIdx);
+
+    bool _createPatternSpokes(IdT refCtrId, Eigen::Vector3d const& refCtr,
+                              Eigen::Vector3d const& projRefCtrDelta);
+
+    // Reference pair index.
+    ndarray::Array<double const, 2, 2> _referenceArray;
+    ndarray::Array<float const, 1, 1> _distArray;
+    ndarray::Array<IdT const, 2, 2> _idArray;
+    ndarray::Array<float const, 1, 1> _pairDistArray;
+    ndarray::Array<IdT const, 1, 1> _pairIdArray;
+    ndarray::Array<std::int64_t const, 1, 1> _pairIndptrArray;
+
+    // Current source pattern and tolerances.
+    std::vector<Eigen::Vector3d> _srcPattern;
+    std::vector<Eigen::Vector3d> _srcDelta;
+    std::vector<double> _srcDist;
+    int _nMatch;
+    double _maxCosThetaShift;
+    double _maxCosRotSq;
+    double _maxDistRad;
+
+    // Candidate first spokes sorted by their difference in length to the
+    // first source spoke, and the position of the search in them.
+    std::vector<std::size_t> _candidates;
+    std::size_t _candidateIdx;
+    int _pairIdx;
+
+    // Current candidate pattern.
+    std::vector<int> _refCandidates;
+    std::vector<int> _srcCandidates;
+    Eigen::Matrix3d _shiftRotMatrix;
+    double _cosShift;
+    double _sinRot;
+};
+
+}  // namespace astrom
+}  // namespace meas
+}  // namespace lsst
+
+#endif  // !LSST_MEAS_ASTROM_PessimisticPatternSearch_INCLUDED
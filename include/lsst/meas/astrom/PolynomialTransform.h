@@ -40,7 +40,7 @@ class ScaledPolynomialTransform;
  *  A 2-d coordinate transform represented by a pair of standard polynomials
  *  (one for each coordinate).
  *
- *  PolynomialTransform instances should be confined to a single thread.
+ *  Const member functions may be called from several threads at once.
  */
 class PolynomialTransform {
 public:
@@ -144,15 +144,13 @@ private:
 
     ndarray::Array<double, 2, 2> _xCoeffs;
     ndarray::Array<double, 2, 2> _yCoeffs;
-    mutable Eigen::VectorXd _u;  // workspace for operator() and linearize
-    mutable Eigen::VectorXd _v;
 };
 
 /**
  *  A 2-d coordinate transform represented by a lazy composition of an AffineTransform,
  *  a PolynomialTransform, and another AffineTransform.
  *
- *  ScaledPolynomialTransform instances should be confined to a single thread.
+ *  Const member functions may be called from several threads at once.
  */
 class ScaledPolynomialTransform {
 public:
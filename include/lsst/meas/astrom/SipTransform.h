@@ -131,7 +131,7 @@ protected:
  *  this class does not attempt to null low-order polynomial terms at all
  *  when converting from other transforms.
  *
- *  SipForwardTransform instances should be confined to a single thread.
+ *  Const member functions may be called from several threads at once.
  */
 class SipForwardTransform : public SipTransformBase {
 public:
@@ -241,7 +241,7 @@ public:
  *   - @f$\mathrm{AP}@f$, @f$\mathrm{BP}@f$ are the polynomial coefficients of
  *     the reverse transform.
  *
- *  SipForwardTransform instances should be confined to a single thread.
+ *  Const member functions may be called from several threads at once.
  */
 class SipReverseTransform : public SipTransformBase {
 public:
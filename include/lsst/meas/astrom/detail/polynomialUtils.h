@@ -55,7 +55,7 @@ inline int computePackedSize(int order) { return computePackedOffset(order + 1);
  *  When multiple powers are needed, this should be signficantly faster than
  *  repeated calls to std::pow().
  */
-void computePowers(Eigen::VectorXd& r, double x);
+void computePowers(Eigen::Ref<Eigen::VectorXd> r, double x);
 
 /**
  *  Return an array with integer powers of x, so @f$$r[n] == r^n@f$.
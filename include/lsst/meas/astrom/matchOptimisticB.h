@@ -4,6 +4,7 @@
 
 #include <cmath>
 #include <string>
+#include <unordered_map>
 #include <vector>
 
 #include "lsst/pex/config.h"
@@ -104,6 +105,75 @@ struct MatchOptimisticBControl {
     ~MatchOptimisticBControl(){};
 };
 
+/**
+Match sources to stars in a position reference catalog using optimistic pattern matching B,
+preparing the catalogs once for matching with several sets of tolerances
+
+The constructor projects the catalogs, selects the brightest sources and reference objects and builds
+their lists of pairs. These depend only on the catalogs, the WCS, posRefBegInd and the refFluxField,
+sourceFluxField and numBrightStars fields of the control object. Each call to match then runs the
+pattern search with the tolerances of a control object. match does not modify the matcher, so it may
+be called from several threads at once.
+
+Optimistic Pattern Matching is described in V. Tabur 2007, PASA, 24, 189-198
+"Fast Algorithms for Matching CCD Images to a Stellar Catalogue"
+*/
+class OptimisticPatternMatcherB {
+public:
+    /// Indices of the pairs in a list of pairs sorted by decreasing distance, grouped by the first
+    /// object of the pair. The indices of each object are in the order of the list.
+    typedef std::unordered_map<afw::table::SimpleRecord const*, std::vector<std::size_t>> PairIndexMap;
+
+    /**
+    Prepare the catalogs for matching
+
+    @param[in] posRefCat  catalog of position reference stars; fields read:
+        - "coord"
+        - control.refFluxField
+    @param[in] sourceCat  catalog of detected sources; fields read:
+        - "Centroid_x"
+        - "Centroid_y"
+        - control.refFluxField
+    @param[in] control  control object; only refFluxField, sourceFluxField and numBrightStars are used
+    @param[in] wcs  estimated WCS
+    @param[in] posRefBegInd  index of first start to use in posRefCat
+    @param[in] verbose  true to print diagnostic information to std::cout
+
+    @throws lsst::pex::exceptions::InvalidParameterError if the control object is invalid, a catalog is
+        empty or posRefBegInd is out of range.
+    */
+    OptimisticPatternMatcherB(afw::table::SimpleCatalog const& posRefCat,
+                              afw::table::SourceCatalog const& sourceCat,
+                              MatchOptimisticBControl const& control, afw::geom::SkyWcs const& wcs,
+                              int posRefBegInd = 0, bool verbose = false);
+
+    /**
+    Match the catalogs with the tolerances of a control object
+
+    @param[in] control  control object; refFluxField, sourceFluxField and numBrightStars must be those
+        the matcher was constructed with
+    @return a list of matches; the d field may be set, but you should not rely on it
+
+    @throws lsst::pex::exceptions::InvalidParameterError if the control object is invalid or does not
+        agree with the one the matcher was constructed with.
+    */
+    afw::table::ReferenceMatchVector match(MatchOptimisticBControl const& control) const;
+
+private:
+    std::string _refFluxField;
+    std::string _sourceFluxField;
+    int _numBrightStars;
+    bool _verbose;
+
+    ProxyVector _posRefProxyCat;
+    ProxyVector _sourceProxyCat;
+    ProxyVector _sourceSubCat;               // brightest sources, sorted by decreasing flux
+    ProxyVector _posRefSubCat;               // brightest reference objects, sorted by decreasing flux
+    std::vector<ProxyPair> _posRefPairList;  // pairs of _posRefSubCat, sorted by decreasing distance
+    std::vector<ProxyPair> _sourcePairList;  // pairs of _sourceSubCat, sorted by decreasing distance
+    PairIndexMap _posRefPairIndexMap;        // index of _posRefPairList by first object
+};
+
 /**
 Match sources to stars in a position reference catalog using optimistic pattern matching B
 
@@ -122,6 +192,8 @@ Optimistic Pattern Matching is described in V. Tabur 2007, PASA, 24, 189-198
 @param[in] posRefBegInd  index of first start to use in posRefCat
 @param[in] verbose  true to print diagnostic information to std::cout
 @return a list of matches; the d field may be set, but you should not rely on it
+
+To match the same catalogs with several sets of tolerances use OptimisticPatternMatcherB.
 */
 afw::table::ReferenceMatchVector matchOptimisticB(afw::table::SimpleCatalog const& posRefCat,
                                                   afw::table::SourceCatalog const& sourceCat,
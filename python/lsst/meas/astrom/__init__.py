@@ -22,6 +22,7 @@
 
 from .makeMatchStatistics import *
 from .matchOptimisticBTask import *
+from .pessimisticPatternSearch import *
 from .polynomialTransform import *
 from .scaledPolynomialTransformFitter import *
 from .sipTransform import *
@@ -32,6 +33,7 @@ from .ref_match import *
 from .astrometry import *
 from .approximateWcs import *
 from .matchPessimisticB import *
+from .matchSet import *
 from .setMatchDistance import *
 from .display import *
 from .approximateWcs import *
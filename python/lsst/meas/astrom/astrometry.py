@@ -23,11 +23,141 @@
 __all__ = ["AstrometryConfig", "AstrometryTask"]
 
 
+import functools
+import itertools
+import multiprocessing
+import threading
+import traceback
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import lsst.geom
+import lsst.sphgeom
+import lsst.afw.table as afwTable
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 from .ref_match import RefMatchTask, RefMatchConfig
 from .fitTanSipWcs import FitTanSipWcsTask
 from .display import displayAstrometry
+from .matchSet import MatchSet, findCatalogRows, readCatalogColumn
+
+
+def _toArray(vector):
+    """Convert a `lsst.sphgeom.Vector3d` to a `numpy.ndarray`.
+    """
+    return np.array([vector.x(), vector.y(), vector.z()])
+
+
+def _computeMaxShift(wcs1, wcs2, bbox, numPoints=5):
+    """Compute the maximum shift in pixels between two WCSs over a bounding
+    box.
+
+    Parameters
+    ----------
+    wcs1, wcs2 : `lsst.afw.geom.SkyWcs`
+        WCSs to compare.
+    bbox : `lsst.geom.Box2I`
+        Bounding box over which to compare them.
+    numPoints : `int`, optional
+        Number of points of the comparison grid along each axis.
+
+    Returns
+    -------
+    shift : `float`
+        Maximum distance between a point of a grid over ``bbox`` and the
+        pixel position ``wcs2`` gives to the sky position ``wcs1`` gives it.
+    """
+    bbox = lsst.geom.Box2D(bbox)
+    x, y = np.meshgrid(np.linspace(bbox.getMinX(), bbox.getMaxX(), numPoints),
+                       np.linspace(bbox.getMinY(), bbox.getMaxY(), numPoints))
+    pixels = np.array([x.ravel(), y.ravel()])
+    sky = wcs1.getTransform().getMapping().applyForward(pixels)
+    newPixels = wcs2.getTransform().getMapping().applyInverse(sky)
+    return np.hypot(*(newPixels - pixels)).max()
+
+
+def _toUnitVectors(ra, dec):
+    """Convert arrays of sky positions in radians to an array of unit
+    vectors, one per row.
+    """
+    cosDec = np.cos(dec)
+    return np.array([cosDec*np.cos(ra), cosDec*np.sin(ra), np.sin(dec)]).T
+
+
+def _getMatchIdPairs(matches):
+    """Return the set of (reference object ID, source ID) pairs of a list of
+    matches or a `MatchSet`.
+    """
+    if isinstance(matches, MatchSet):
+        refIds, sourceIds = matches.getIds()
+        return set(zip(refIds.tolist(), sourceIds.tolist()))
+    return {(match.first.getId(), match.second.getId()) for match in matches}
+
+
+# Arguments of the calls of AstrometryTask.solveVisit that use worker
+# processes, keyed by call; the forked workers inherit them
+_visitStates = {}
+_visitStateIds = itertools.count()
+_visitStateLock = threading.Lock()
+
+
+def _solveVisitExposureInWorker(stateId, index):
+    """Solve one exposure of a visit in ``_visitStates`` in a worker process
+    of `AstrometryTask.solveVisit`.
+
+    Parameters
+    ----------
+    stateId : `int`
+        Key of the visit in ``_visitStates``.
+    index : `int`
+        Index of the exposure.
+
+    Returns
+    -------
+    result : `lsst.pipe.base.Struct`
+        Picklable result struct with components:
+
+        - ``wcs`` : the fit WCS (`lsst.afw.geom.SkyWcs`)
+        - ``refIds``, ``sourceIds`` : IDs of the reference object and source
+          of each match (`numpy.ndarray` of `int`)
+        - ``distances`` : distance of each match (`numpy.ndarray` of `float`)
+        - ``scatterOnSky`` : median on-sky separation between reference
+          objects and sources in the matches, in radians (`float`)
+        - ``error`` : type, message and traceback of the exception raised if
+          the exposure could not be solved, else `None` (`str`)
+    """
+    state = _visitStates[stateId]
+    exposure = state.exposures[index]
+    try:
+        res = state.task._solve(
+            exposure=exposure,
+            expMd=state.expMdList[index],
+            sourceCat=state.sourceCats[index],
+            goodSourceCat=state.goodSourceCats[index],
+            refCat=state.refCats[index],
+            refFluxField=state.visitRefs.fluxField,
+            matchMeta=state.visitRefs.matchMeta,
+            match_tolerance=state.matchTolerances[index],
+        )
+    except Exception as e:
+        return pipeBase.Struct(error="%s: %s\n%s" % (type(e).__name__, e, traceback.format_exc()))
+    if isinstance(res.matches, MatchSet):
+        refIds, sourceIds = res.matches.getIds()
+        distances = res.matches.distances
+    else:
+        columns = np.array([(match.first.getId(), match.second.getId(), match.distance)
+                            for match in res.matches],
+                           dtype=[("refId", np.int64), ("sourceId", np.int64), ("distance", float)])
+        refIds, sourceIds, distances = columns["refId"], columns["sourceId"], columns["distance"]
+    return pipeBase.Struct(
+        wcs=exposure.getWcs(),
+        refIds=refIds,
+        sourceIds=sourceIds,
+        distances=distances,
+        scatterOnSky=res.scatterOnSky.asRadians(),
+        error=None,
+    )
 
 
 class AstrometryConfig(RefMatchConfig):
@@ -57,6 +187,65 @@ class AstrometryConfig(RefMatchConfig):
         default=0.001,
         min=0,
     )
+    useMatchSet = pexConfig.Field(
+        doc="Convert the matches found by the matcher to a columnar MatchSet, so the fit, outlier "
+            "rejection and match statistics work on arrays instead of match records; the matches "
+            "returned by solve are then a MatchSet. Ignored if not fitting a WCS",
+        dtype=bool,
+        default=False,
+    )
+    refineMatches = pexConfig.Field(
+        doc="on iterations after the first, match each good source to the nearest reference object "
+            "within the match distance of the previous iteration under its fit WCS, instead of running "
+            "the matcher again. Ignored if not fitting a WCS",
+        dtype=bool,
+        default=False,
+    )
+    stopWhenConverged = pexConfig.Field(
+        doc="stop iterating once an iteration's fit moves positions in the exposure by less than "
+            "convergedMaxShiftPix from the WCS used for its matching and the set of matches is stable: "
+            "on the first iteration, re-scoring the matches under the fit WCS drops at most "
+            "convergedMaxMatchFraction of them as farther apart than the maximum match distance the "
+            "next iteration would use, and the re-scored matches are kept instead of matching again; "
+            "after the first iteration, the matches change by at most convergedMaxMatchFraction from "
+            "the previous iteration. Ignored if not fitting a WCS",
+        dtype=bool,
+        default=False,
+    )
+    convergedMaxShiftPix = pexConfig.RangeField(
+        doc="maximum shift of positions in the exposure between the WCS used for matching and the fit "
+            "WCS for the fit to have converged (pixels); see stopWhenConverged",
+        dtype=float,
+        default=0.05,
+        min=0,
+    )
+    convergedMaxMatchFraction = pexConfig.RangeField(
+        doc="maximum fraction of matches that may be gained or lost between iterations, or dropped by "
+            "re-scoring the matches of the first iteration, for the match set to have converged; see "
+            "stopWhenConverged",
+        dtype=float,
+        default=0.0,
+        min=0,
+        max=1,
+    )
+    numVisitProcesses = pexConfig.RangeField(
+        doc="number of processes solveVisit uses to solve the exposures of a visit; if more than one, "
+            "worker processes are forked after the visit reference catalog is loaded and, if the matcher "
+            "supports it, the pattern matcher of each exposure is built, so they share those instead of "
+            "being sent pickled copies. Requires the fork start method of multiprocessing and may not "
+            "be combined with matcher threads",
+        dtype=int,
+        default=1,
+        min=1,
+    )
+
+    def validate(self):
+        RefMatchConfig.validate(self)
+        if self.numVisitProcesses > 1:
+            # forking a process while other threads run may deadlock it
+            for name in ("numToleranceWorkers", "numPatternWorkers"):
+                if getattr(self.matcher, name, 1) > 1:
+                    raise ValueError("numVisitProcesses > 1 may not be combined with matcher.%s > 1" % name)
 
     def setDefaults(self):
         # Override the default source selector for astrometry tasks
@@ -165,7 +354,8 @@ class AstrometryTask(RefMatchTask):
             - ``refCat`` : reference object catalog of objects that overlap the
               exposure (with some margin) (`lsst::afw::table::SimpleCatalog`).
             - ``matches`` :  astrometric matches
-              (`list` of `lsst.afw.table.ReferenceMatch`).
+              (`list` of `lsst.afw.table.ReferenceMatch`, or `MatchSet` if
+              config.useMatchSet).
             - ``scatterOnSky`` :  median on-sky separation between reference
               objects and sources in "matches" (`lsst.geom.Angle`)
             - ``matchMeta`` :  metadata needed to unpersist matches
@@ -177,9 +367,6 @@ class AstrometryTask(RefMatchTask):
         """
         if self.refObjLoader is None:
             raise RuntimeError("Running matcher task with no refObjLoader set in __init__ or setRefObjLoader")
-        import lsstDebug
-        debug = lsstDebug.Info(__name__)
-
         expMd = self._getExposureMetadata(exposure)
 
         sourceSelection = self.sourceSelector.run(sourceCat)
@@ -206,32 +393,397 @@ class AstrometryTask(RefMatchTask):
             epoch=expMd.epoch,
         )
 
+        return self._solve(
+            exposure=exposure,
+            expMd=expMd,
+            sourceCat=sourceCat,
+            goodSourceCat=sourceSelection.sourceCat,
+            refCat=refSelection.sourceCat,
+            refFluxField=loadRes.fluxField,
+            matchMeta=matchMeta,
+        )
+
+    @pipeBase.timeMethod
+    def solveVisit(self, exposures, sourceCats):
+        """Load reference objects overlapping all the exposures of a visit
+        once, then match to the sources of each exposure and fit its WCS.
+
+        The reference catalog is loaded for a circle enclosing the bounding
+        boxes of all the exposures and the reference selector is run on it
+        once. Each exposure is then solved as by `solve`, with the selected
+        reference objects that overlap it.
+
+        Parameters
+        ----------
+        exposures : `list` of `lsst.afw.image.Exposure`
+            exposures of the detectors of a visit, whose WCSs are to be fit;
+            as for `solve`
+        sourceCats : `list` of `lsst.afw.table.SourceCatalog`
+            catalog of sources detected on each exposure
+
+        Returns
+        -------
+        results : `list` of `lsst.pipe.base.Struct`
+            Result of each exposure, in the order of ``exposures``, with
+            components as for `solve`. Each ``refCat`` is a copy of the
+            reference objects of a single visit catalog that overlap the
+            exposure, with centroids computed with its fit WCS, and the
+            ``matchMeta`` describes the visit circle.
+
+        Notes
+        -----
+        ignores config.forceKnownWcs
+
+        If config.numVisitProcesses is more than one the exposures are
+        solved in forked worker processes, which inherit the visit reference
+        catalog and the pattern matchers built before forking instead of
+        receiving pickled copies. The workers return the fit WCSs and the IDs
+        of the matched records; the WCSs, source coordinates, reference
+        centroids, used flags and matches are then set here, in detector
+        order. If an exposure cannot be solved a `RuntimeError` with the
+        traceback of each failure is raised once all have been tried.
+        """
+        if self.refObjLoader is None:
+            raise RuntimeError("Running matcher task with no refObjLoader set in __init__ or setRefObjLoader")
+        if len(exposures) != len(sourceCats):
+            raise RuntimeError("Got %d exposures but %d source catalogs" % (len(exposures), len(sourceCats)))
+        if len(exposures) == 0:
+            return []
+
+        expMdList = [self._getExposureMetadata(exposure) for exposure in exposures]
+        visitRefs = self.loadVisitReferences(expMdList)
+
+        if self.config.numVisitProcesses > 1 and len(exposures) > 1:
+            return self._solveVisitInPool(exposures, expMdList, sourceCats, visitRefs)
+        return [self._solveVisitExposure(exposure, expMd, sourceCat, visitRefs)
+                for exposure, expMd, sourceCat in zip(exposures, expMdList, sourceCats)]
+
+    def _solveVisitExposure(self, exposure, expMd, sourceCat, visitRefs):
+        """Solve one exposure of a visit with the visit reference catalog.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            exposure whose WCS is to be fit
+        expMd : `lsst.pipe.base.Struct`
+            metadata of ``exposure``, as returned by `_getExposureMetadata`
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of sources detected on the exposure
+        visitRefs : `lsst.pipe.base.Struct`
+            reference objects of the visit, as returned by
+            `loadVisitReferences`
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components as for `solve`.
+        """
+        sourceSelection = self.sourceSelector.run(sourceCat)
+        self.log.info("Purged %d sources, leaving %d good sources" %
+                      (len(sourceCat) - len(sourceSelection.sourceCat),
+                       len(sourceSelection.sourceCat)))
+        return self._solve(
+            exposure=exposure,
+            expMd=expMd,
+            sourceCat=sourceCat,
+            goodSourceCat=sourceSelection.sourceCat,
+            refCat=self._selectDetectorReferences(visitRefs, expMd),
+            refFluxField=visitRefs.fluxField,
+            matchMeta=visitRefs.matchMeta,
+        )
+
+    def _solveVisitInPool(self, exposures, expMdList, sourceCats, visitRefs):
+        """Solve the exposures of a visit in forked worker processes.
+
+        Parameters are as for `_solveVisitExposure`, with lists of the
+        exposures, their metadata and their source catalogs.
+
+        Returns
+        -------
+        results : `list` of `lsst.pipe.base.Struct`
+            Result of each exposure, as for `solveVisit`.
+
+        Notes
+        -----
+        The sources and reference objects of each exposure are selected and
+        its first match tolerance, including the pattern matcher and its
+        reference pair index, is made here, before forking, so the workers
+        inherit them instead of each building its own.
+        """
+        goodSourceCats = []
+        refCats = []
+        matchTolerances = []
+        for expMd, sourceCat in zip(expMdList, sourceCats):
+            sourceSelection = self.sourceSelector.run(sourceCat)
+            self.log.info("Purged %d sources, leaving %d good sources" %
+                          (len(sourceCat) - len(sourceSelection.sourceCat),
+                           len(sourceSelection.sourceCat)))
+            refCat = self._selectDetectorReferences(visitRefs, expMd)
+            goodSourceCats.append(sourceSelection.sourceCat)
+            refCats.append(refCat)
+            matchTolerances.append(self._makeMatchTolerance(refCat, sourceSelection.sourceCat,
+                                                            expMd.wcs, visitRefs.fluxField))
+
+        numProcesses = min(self.config.numVisitProcesses, len(exposures))
+        with _visitStateLock:
+            stateId = next(_visitStateIds)
+            _visitStates[stateId] = pipeBase.Struct(
+                task=self,
+                exposures=exposures,
+                expMdList=expMdList,
+                sourceCats=sourceCats,
+                goodSourceCats=goodSourceCats,
+                refCats=refCats,
+                matchTolerances=matchTolerances,
+                visitRefs=visitRefs,
+            )
+        try:
+            with multiprocessing.get_context("fork").Pool(numProcesses) as pool:
+                workerResults = pool.map(functools.partial(_solveVisitExposureInWorker, stateId),
+                                         range(len(exposures)), chunksize=1)
+        finally:
+            with _visitStateLock:
+                del _visitStates[stateId]
+
+        failures = ["exposure %d: %s" % (i, workerRes.error)
+                    for i, workerRes in enumerate(workerResults) if workerRes.error is not None]
+        if failures:
+            raise RuntimeError("Could not solve %d of %d exposures: %s" %
+                               (len(failures), len(exposures), "; ".join(failures)))
+
+        # The workers updated their own copies of the records, so repeat the
+        # updates of the WCS fitter and _solve here.
+        results = []
+        for exposure, sourceCat, refCat, workerRes in zip(exposures, sourceCats, refCats, workerResults):
+            afwTable.updateRefCentroids(workerRes.wcs, refList=refCat)
+            afwTable.updateSourceCoords(workerRes.wcs, sourceList=sourceCat)
+            matches = MatchSet.fromIds(refCat, sourceCat, workerRes.refIds, workerRes.sourceIds,
+                                       workerRes.distances)
+            if self.usedKey:
+                matches.setSourceFlag(self.usedKey, True)
+            if not self.config.useMatchSet:
+                matches = matches.toMatches()
+            exposure.setWcs(workerRes.wcs)
+            results.append(pipeBase.Struct(
+                refCat=refCat,
+                matches=matches,
+                scatterOnSky=workerRes.scatterOnSky*lsst.geom.radians,
+                matchMeta=visitRefs.matchMeta,
+            ))
+        return results
+
+    def _makeMatchTolerance(self, refCat, goodSourceCat, wcs, refFluxField):
+        """Make the match tolerance of the first iteration of `_solve`, if
+        the matcher supports it.
+
+        Parameters
+        ----------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            catalog of selected reference objects overlapping the exposure
+        goodSourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of down-selected good sources detected on the exposure
+        wcs : `lsst.afw.geom.SkyWcs`
+            initial guess for WCS of exposure
+        refFluxField : `str`
+            field of refCat to use for flux
+
+        Returns
+        -------
+        match_tolerance : `lsst.meas.astrom.MatchTolerance` or `None`
+            match tolerance as returned by the ``makeMatchTolerance`` method
+            of the matcher, or `None` if the matcher has no such method or it
+            fails, in which case the matcher builds its state when matching.
+        """
+        if not hasattr(self.matcher, "makeMatchTolerance"):
+            return None
+        sourceFluxField = "slot_%sFlux_instFlux" % (self.config.sourceFluxType)
+        try:
+            return self.matcher.makeMatchTolerance(
+                refCat=refCat,
+                sourceCat=goodSourceCat,
+                wcs=wcs,
+                sourceFluxField=sourceFluxField,
+                refFluxField=refFluxField,
+            )
+        except Exception as e:
+            # matching fails the same way in the worker, which reports it
+            self.log.debug("Could not prepare the matcher: %s", e)
+            return None
+
+    def loadVisitReferences(self, expMdList):
+        """Load and select the reference objects overlapping a set of
+        exposures.
+
+        Parameters
+        ----------
+        expMdList : `list` of `lsst.pipe.base.Struct`
+            metadata of each exposure, as returned by `_getExposureMetadata`;
+            the filter and epoch of the first are used for loading
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components:
+
+            - ``refCat`` : contiguous reference object catalog of objects in
+              a circle enclosing the bounding boxes of all the exposures,
+              grown by the pixel margin of the loader
+              (`lsst.afw.table.SimpleCatalog`)
+            - ``selected`` : reference objects selected by the reference
+              selector (`numpy.ndarray` of `bool`)
+            - ``refVectors`` : unit vectors of the reference objects
+              (`numpy.ndarray` of shape (N, 3))
+            - ``fluxField`` : name of the flux field of refCat (`str`)
+            - ``matchMeta`` : metadata needed to unpersist matches
+              (`lsst.daf.base.PropertyList`)
+        """
+        corners = []
+        for expMd in expMdList:
+            bbox = self._getPaddedBBox(expMd)
+            corners += [_toArray(expMd.wcs.pixelToSky(corner).getVector()) for corner in bbox.getCorners()]
+        center = np.mean(corners, axis=0)
+        ctrCoord = lsst.geom.SpherePoint(lsst.sphgeom.Vector3d(*center))
+        radius = max(ctrCoord.separation(lsst.geom.SpherePoint(lsst.sphgeom.Vector3d(*corner)))
+                     for corner in corners)
+        filterName = expMdList[0].filterName
+        epoch = expMdList[0].epoch
+        self.log.info("Loading reference objects within %0.3f deg of %s for %d exposures" %
+                      (radius.asDegrees(), ctrCoord, len(expMdList)))
+
+        loadRes = self.refObjLoader.loadSkyCircle(ctrCoord, radius, filterName=filterName, epoch=epoch,
+                                                  centroids=True)
+        refCat = loadRes.refCat
+        if not refCat.isContiguous():
+            refCat = refCat.copy(deep=True)
+        refSelection = self.referenceSelector.run(refCat)
+        matchMeta = self.refObjLoader.getMetadataCircle(ctrCoord, radius, filterName,
+                                                        photoCalib=expMdList[0].photoCalib, epoch=epoch)
+
+        refVectors = _toUnitVectors(refCat["coord_ra"], refCat["coord_dec"])
+        return pipeBase.Struct(
+            refCat=refCat,
+            selected=np.array(refSelection.selected, dtype=bool),
+            refVectors=refVectors,
+            fluxField=loadRes.fluxField,
+            matchMeta=matchMeta,
+        )
+
+    def _selectDetectorReferences(self, visitRefs, expMd):
+        """Select the reference objects of a visit catalog that overlap an
+        exposure and compute their centroids.
+
+        Parameters
+        ----------
+        visitRefs : `lsst.pipe.base.Struct`
+            reference objects of the visit, as returned by
+            `loadVisitReferences`
+        expMd : `lsst.pipe.base.Struct`
+            metadata of the exposure, as returned by `_getExposureMetadata`
+
+        Returns
+        -------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            contiguous copy of the selected reference objects in the bounding
+            box of the exposure, grown by the pixel margin of the loader,
+            with centroids computed with the WCS of ``expMd``
+
+        Notes
+        -----
+        The bounding boxes of neighbouring exposures overlap once grown, so
+        the records are copied rather than shared with ``visitRefs.refCat``;
+        otherwise the centroids set for one exposure would overwrite those
+        of another.
+        """
+        bbox = self._getPaddedBBox(expMd)
+        ctrCoord = expMd.wcs.pixelToSky(bbox.getCenter())
+        radius = max(ctrCoord.separation(expMd.wcs.pixelToSky(corner)) for corner in bbox.getCorners())
+        near = visitRefs.refVectors.dot(_toArray(ctrCoord.getVector())) >= np.cos(radius.asRadians())
+        rows = np.flatnonzero(near & visitRefs.selected)
+
+        refCat = visitRefs.refCat
+        mapping = expMd.wcs.getTransform().getMapping()
+        x, y = mapping.applyInverse(np.array([refCat["coord_ra"][rows], refCat["coord_dec"][rows]]))
+        inside = (x >= bbox.getMinX()) & (x < bbox.getMaxX()) & (y >= bbox.getMinY()) & (y < bbox.getMaxY())
+        mask = np.zeros(len(refCat), dtype=bool)
+        mask[rows[inside]] = True
+        detRefCat = refCat.subset(mask).copy(deep=True)
+        afwTable.updateRefCentroids(expMd.wcs, refList=detRefCat)
+        return detRefCat
+
+    def _getPaddedBBox(self, expMd):
+        """Return the bounding box of an exposure grown by the pixel margin of
+        the reference object loader.
+        """
+        bbox = lsst.geom.Box2D(expMd.bbox)
+        bbox.grow(self.refObjLoader.config.pixelMargin)
+        return bbox
+
+    def _solve(self, exposure, expMd, sourceCat, goodSourceCat, refCat, refFluxField, matchMeta,
+               match_tolerance=None):
+        """Match sources to already loaded and selected reference objects and
+        fit a WCS, iterating as configured.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            exposure whose WCS is to be fit; its WCS is updated
+        expMd : `lsst.pipe.base.Struct`
+            metadata of ``exposure``, as returned by `_getExposureMetadata`
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of sources detected on the exposure
+        goodSourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of down-selected good sources detected on the exposure
+        refCat : `lsst.afw.table.SimpleCatalog`
+            catalog of selected reference objects overlapping the exposure
+        refFluxField : `str`
+            field of refCat to use for flux
+        matchMeta : `lsst.daf.base.PropertyList`
+            metadata needed to unpersist matches
+        match_tolerance : `lsst.meas.astrom.MatchTolerance`, optional
+            match tolerance of the first iteration, as returned by
+            `_makeMatchTolerance`, or `None`
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components as for `solve`.
+        """
+        import lsstDebug
+        debug = lsstDebug.Info(__name__)
+
         if debug.display:
             frame = int(debug.frame)
             displayAstrometry(
-                refCat=refSelection.sourceCat,
-                sourceCat=sourceSelection.sourceCat,
+                refCat=refCat,
+                sourceCat=goodSourceCat,
                 exposure=exposure,
                 bbox=expMd.bbox,
                 frame=frame,
                 title="Reference catalog",
             )
 
+        goodSourceRows = None
+        if self.config.useMatchSet and self.config.refineMatches:
+            # rows of the good sources in sourceCat, so refined matches can be
+            # held as a MatchSet without looking up their IDs each iteration
+            goodSourceRows = self._findGoodSourceRows(sourceCat, goodSourceCat)
+
         res = None
         wcs = expMd.wcs
-        match_tolerance = None
         for i in range(self.config.maxIter):
             iterNum = i + 1
             try:
                 tryRes = self._matchAndFitWcs(
-                    refCat=refSelection.sourceCat,
+                    refCat=refCat,
                     sourceCat=sourceCat,
-                    goodSourceCat=sourceSelection.sourceCat,
-                    refFluxField=loadRes.fluxField,
+                    goodSourceCat=goodSourceCat,
+                    refFluxField=refFluxField,
                     bbox=expMd.bbox,
                     wcs=wcs,
                     exposure=exposure,
                     match_tolerance=match_tolerance,
+                    refine=self.config.refineMatches and res is not None,
+                    goodSourceRows=goodSourceRows,
                 )
             except Exception as e:
                 # if we have had a succeessful iteration then use that; otherwise fail
@@ -251,7 +803,9 @@ class AstrometryTask(RefMatchTask):
                 tryMatchDist.distStdDev.asArcseconds(), tryMatchDist.maxMatchDist.asArcseconds())
 
             maxMatchDist = tryMatchDist.maxMatchDist
+            prevRes = res
             res = tryRes
+            matchWcs = wcs
             wcs = res.wcs
             if maxMatchDist.asArcseconds() < self.config.minMatchDistanceArcSec:
                 self.log.debug(
@@ -259,6 +813,14 @@ class AstrometryTask(RefMatchTask):
                     "that's good enough",
                     maxMatchDist.asArcseconds(), self.config.minMatchDistanceArcSec)
                 break
+            if self.config.stopWhenConverged:
+                rescoredMatches = None
+                if prevRes is None:
+                    rescoredMatches = self._rescoreMatches(res.matches, maxMatchDist)
+                if self._hasConverged(matchWcs, wcs, expMd.bbox, prevRes, res, rescoredMatches):
+                    if rescoredMatches is not None:
+                        res.matches = rescoredMatches
+                    break
             match_tolerance.maxMatchDist = maxMatchDist
 
         self.log.info(
@@ -266,21 +828,184 @@ class AstrometryTask(RefMatchTask):
             "found %d matches with scatter = %0.3f +- %0.3f arcsec" %
             (iterNum, len(tryRes.matches), tryMatchDist.distMean.asArcseconds(),
                 tryMatchDist.distStdDev.asArcseconds()))
-        for m in res.matches:
-            if self.usedKey:
-                m.second.set(self.usedKey, True)
+        if self.usedKey:
+            if isinstance(res.matches, MatchSet):
+                res.matches.setSourceFlag(self.usedKey, True)
+            else:
+                for m in res.matches:
+                    m.second.set(self.usedKey, True)
         exposure.setWcs(res.wcs)
 
         return pipeBase.Struct(
-            refCat=refSelection.sourceCat,
+            refCat=refCat,
             matches=res.matches,
             scatterOnSky=res.scatterOnSky,
             matchMeta=matchMeta,
         )
 
+    @staticmethod
+    def _findGoodSourceRows(sourceCat, goodSourceCat):
+        """Return the row of ``sourceCat`` of each record of
+        ``goodSourceCat``.
+        """
+        goodSourceIds = readCatalogColumn(goodSourceCat, goodSourceCat.schema["id"].asKey(), dtype=np.int64)
+        return findCatalogRows(sourceCat, goodSourceIds)
+
+    def _refineMatches(self, refCat, sourceCat, wcs, match_tolerance):
+        """Match sources to the nearest reference objects under a WCS that is
+        already good.
+
+        Parameters
+        ----------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            catalog of reference objects
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of sources to match
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS of the exposure, usually the fit WCS of a previous iteration
+        match_tolerance : `lsst.meas.astrom.MatchTolerance`
+            match tolerance of the previous iteration; its maxMatchDist is
+            the maximum match distance
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components:
+
+            - ``matches``: matches (`list` of
+              `lsst.afw.table.ReferenceMatch`), with at most one source for
+              each reference object, or `None` if config.useMatchSet.
+            - ``refIndices``: row of ``refCat`` of each match
+              (`numpy.ndarray` of `int`).
+            - ``sourceIndices``: row of ``sourceCat`` of each match
+              (`numpy.ndarray` of `int`).
+            - ``distances``: on-sky distance of each match, in radians
+              (`numpy.ndarray` of `float`).
+            - ``usableSourceCat``: ``sourceCat``.
+            - ``match_tolerance``: ``match_tolerance``, unchanged.
+
+        Notes
+        -----
+        The sources are projected to the sky with ``wcs`` and matched with a
+        k-d tree of the unit vectors of the reference objects. When several
+        sources have the same nearest reference object only the closest is
+        kept.
+        """
+        refIndices = np.zeros(0, dtype=np.int64)
+        sourceIndices = np.zeros(0, dtype=np.int64)
+        distances = np.zeros(0)
+        if len(refCat) > 0 and len(sourceCat) > 0:
+            refCoordKey = afwTable.CoordKey(refCat.schema["coord"])
+            refVectors = _toUnitVectors(readCatalogColumn(refCat, refCoordKey.getRa()),
+                                        readCatalogColumn(refCat, refCoordKey.getDec()))
+            centroidKey = afwTable.Point2DKey(sourceCat.schema["slot_Centroid"])
+            pixels = np.array([readCatalogColumn(sourceCat, centroidKey.getX()),
+                               readCatalogColumn(sourceCat, centroidKey.getY())])
+            sourceRa, sourceDec = wcs.getTransform().getMapping().applyForward(pixels)
+            sourceVectors = _toUnitVectors(sourceRa, sourceDec)
+
+            maxChord = 2.0*np.sin(0.5*min(match_tolerance.maxMatchDist.asRadians(), np.pi))
+            chords, nearest = cKDTree(refVectors).query(sourceVectors, distance_upper_bound=maxChord)
+            sourceIndices = np.flatnonzero(np.isfinite(chords))
+            # keep the closest source of each reference object
+            order = sourceIndices[np.argsort(chords[sourceIndices], kind="stable")]
+            _, first = np.unique(nearest[order], return_index=True)
+            sourceIndices = np.sort(order[first])
+            refIndices = nearest[sourceIndices]
+            distances = 2.0*np.arcsin(0.5*chords[sourceIndices])
+        matches = None
+        if not self.config.useMatchSet:
+            matches = [afwTable.ReferenceMatch(refCat[int(refIndex)], sourceCat[int(sourceIndex)], distance)
+                       for refIndex, sourceIndex, distance in zip(refIndices, sourceIndices, distances)]
+        self.log.debug("Refined matches with a maximum match distance of %0.3f arcsec",
+                       match_tolerance.maxMatchDist.asArcseconds())
+        return pipeBase.Struct(
+            matches=matches,
+            refIndices=refIndices,
+            sourceIndices=sourceIndices,
+            distances=distances,
+            usableSourceCat=sourceCat,
+            match_tolerance=match_tolerance,
+        )
+
+    @staticmethod
+    def _rescoreMatches(matches, maxMatchDist):
+        """Select the matches whose distance is at most a maximum match
+        distance.
+
+        Parameters
+        ----------
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
+            matches whose distances, in radians, were set with the fit WCS
+        maxMatchDist : `lsst.geom.Angle`
+            maximum match distance
+
+        Returns
+        -------
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
+            the matches no farther apart than ``maxMatchDist``
+        """
+        maxDist = maxMatchDist.asRadians()
+        if isinstance(matches, MatchSet):
+            return matches.subset(matches.distances <= maxDist)
+        return [match for match in matches if match.distance <= maxDist]
+
+    def _hasConverged(self, matchWcs, fitWcs, bbox, prevRes, res, rescoredMatches=None):
+        """Test whether an iteration of matching and fitting has converged.
+
+        Parameters
+        ----------
+        matchWcs : `lsst.afw.geom.SkyWcs`
+            WCS used for matching in the iteration
+        fitWcs : `lsst.afw.geom.SkyWcs`
+            WCS fit in the iteration
+        bbox : `lsst.geom.Box2I`
+            bounding box of the exposure
+        prevRes : `lsst.pipe.base.Struct`
+            result of `_matchAndFitWcs` in the previous iteration, or `None`
+            for the first iteration
+        res : `lsst.pipe.base.Struct`
+            result of `_matchAndFitWcs` in the iteration
+        rescoredMatches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`, optional
+            for the first iteration, the matches of ``res`` re-scored with
+            `_rescoreMatches`
+
+        Returns
+        -------
+        converged : `bool`
+            `True` if the fit moved positions by less than
+            config.convergedMaxShiftPix and at most
+            config.convergedMaxMatchFraction of the matches were dropped by
+            re-scoring (on the first iteration) or changed from the previous
+            iteration.
+        """
+        shift = _computeMaxShift(matchWcs, fitWcs, bbox)
+        if shift >= self.config.convergedMaxShiftPix:
+            self.log.debug("Fit WCS moved positions by up to %0.3f pixels; not converged", shift)
+            return False
+        if prevRes is None:
+            droppedFraction = 1 - len(rescoredMatches)/max(len(res.matches), 1)
+            if len(rescoredMatches) == 0 or droppedFraction > self.config.convergedMaxMatchFraction:
+                self.log.debug("Fit WCS moved positions by up to %0.3f pixels but re-scoring dropped "
+                               "%0.3f of the matches; not converged", shift, droppedFraction)
+                return False
+            self.log.debug("Fit WCS moved positions by up to %0.3f pixels and re-scoring dropped %0.3f "
+                           "of the matches; converged", shift, droppedFraction)
+            return True
+        prevPairs = _getMatchIdPairs(prevRes.matches)
+        pairs = _getMatchIdPairs(res.matches)
+        matchFraction = len(prevPairs ^ pairs)/max(len(prevPairs), len(pairs), 1)
+        if matchFraction > self.config.convergedMaxMatchFraction:
+            self.log.debug("Fit WCS moved positions by up to %0.3f pixels but %0.3f of the matches "
+                           "changed; not converged", shift, matchFraction)
+            return False
+        self.log.debug("Fit WCS moved positions by up to %0.3f pixels and %0.3f of the matches changed; "
+                       "converged", shift, matchFraction)
+        return True
+
     @pipeBase.timeMethod
     def _matchAndFitWcs(self, refCat, sourceCat, goodSourceCat, refFluxField, bbox, wcs, match_tolerance,
-                        exposure=None):
+                        exposure=None, refine=False, goodSourceRows=None):
         """Match sources to reference objects and fit a WCS.
 
         Parameters
@@ -304,6 +1029,13 @@ class AstrometryTask(RefMatchTask):
         exposure : `lsst.afw.image.Exposure`
             exposure whose WCS is to be fit, or None; used only for the debug
             display.
+        refine : `bool`
+            if True, ``wcs`` is the fit WCS of a previous iteration and the
+            matches are found by `_refineMatches` instead of the matcher.
+        goodSourceRows : `numpy.ndarray` of `int`, optional
+            row of ``sourceCat`` of each record of ``goodSourceCat``, used to
+            make the refined matches into a `MatchSet` if config.useMatchSet;
+            found from the IDs if `None`.
 
         Returns
         -------
@@ -311,7 +1043,8 @@ class AstrometryTask(RefMatchTask):
             Result struct with components:
 
             - ``matches``:  astrometric matches
-              (`list` of `lsst.afw.table.ReferenceMatch`).
+              (`list` of `lsst.afw.table.ReferenceMatch`, or `MatchSet` if
+              config.useMatchSet).
             - ``wcs``:  the fit WCS (lsst.afw.geom.SkyWcs).
             - ``scatterOnSky`` :  median on-sky separation between reference
               objects and sources in "matches" (`lsst.afw.geom.Angle`).
@@ -321,21 +1054,38 @@ class AstrometryTask(RefMatchTask):
 
         sourceFluxField = "slot_%sFlux_instFlux" % (self.config.sourceFluxType)
 
-        matchRes = self.matcher.matchObjectsToSources(
-            refCat=refCat,
-            sourceCat=goodSourceCat,
-            wcs=wcs,
-            sourceFluxField=sourceFluxField,
-            refFluxField=refFluxField,
-            match_tolerance=match_tolerance,
-        )
-        self.log.debug("Found %s matches", len(matchRes.matches))
+        if refine and match_tolerance is not None and match_tolerance.maxMatchDist is not None:
+            matchRes = self._refineMatches(
+                refCat=refCat,
+                sourceCat=goodSourceCat,
+                wcs=wcs,
+                match_tolerance=match_tolerance,
+            )
+        else:
+            matchRes = self.matcher.matchObjectsToSources(
+                refCat=refCat,
+                sourceCat=goodSourceCat,
+                wcs=wcs,
+                sourceFluxField=sourceFluxField,
+                refFluxField=refFluxField,
+                match_tolerance=match_tolerance,
+            )
+        matches = matchRes.matches
+        if self.config.useMatchSet:
+            if matches is None:
+                if goodSourceRows is None:
+                    goodSourceRows = self._findGoodSourceRows(sourceCat, goodSourceCat)
+                matches = MatchSet(refCat, sourceCat, matchRes.refIndices,
+                                   goodSourceRows[matchRes.sourceIndices], matchRes.distances)
+            else:
+                matches = MatchSet.fromMatches(matches, refCat=refCat, sourceCat=sourceCat)
+        self.log.debug("Found %s matches", len(matches))
         if debug.display:
             frame = int(debug.frame)
             displayAstrometry(
                 refCat=refCat,
                 sourceCat=matchRes.usableSourceCat,
-                matches=matchRes.matches,
+                matches=matches,
                 exposure=exposure,
                 bbox=bbox,
                 frame=frame + 1,
@@ -344,7 +1094,7 @@ class AstrometryTask(RefMatchTask):
 
         self.log.debug("Fitting WCS")
         fitRes = self.wcsFitter.fitWcs(
-            matches=matchRes.matches,
+            matches=matches,
             initWcs=wcs,
             bbox=bbox,
             refCat=refCat,
@@ -358,7 +1108,7 @@ class AstrometryTask(RefMatchTask):
             displayAstrometry(
                 refCat=refCat,
                 sourceCat=matchRes.usableSourceCat,
-                matches=matchRes.matches,
+                matches=matches,
                 exposure=exposure,
                 bbox=bbox,
                 frame=frame + 2,
@@ -366,7 +1116,7 @@ class AstrometryTask(RefMatchTask):
             )
 
         return pipeBase.Struct(
-            matches=matchRes.matches,
+            matches=matches,
             wcs=fitWcs,
             scatterOnSky=scatterOnSky,
             match_tolerance=matchRes.match_tolerance,
@@ -22,6 +22,7 @@
 __all__ = ["denormalizeMatches"]
 
 import lsst.afw.table as afwTable
+from .matchSet import MatchSet
 
 
 def denormalizeMatches(matches, matchMeta=None):
@@ -29,7 +30,7 @@ def denormalizeMatches(matches, matchMeta=None):
 
     Parameters
     ----------
-    matches : `list` of `lsst.afw.table.ReferenceMatch`
+    matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
         List of matches between reference catalog and source catalog.
     matchMeta : `lsst.daf.base.PropertyList`
         Matching metadata to write in catalog.
@@ -64,8 +65,16 @@ def denormalizeMatches(matches, matchMeta=None):
     if len(matches) == 0:
         raise RuntimeError("No matches provided.")
 
-    refSchema = matches[0].first.getSchema()
-    srcSchema = matches[0].second.getSchema()
+    if isinstance(matches, MatchSet):
+        refSchema = matches.refCat.getSchema()
+        srcSchema = matches.sourceCat.getSchema()
+        rows = ((matches.refCat[int(refRow)], matches.sourceCat[int(srcRow)], distance)
+                for refRow, srcRow, distance in zip(matches.refIndices, matches.sourceIndices,
+                                                    matches.distances))
+    else:
+        refSchema = matches[0].first.getSchema()
+        srcSchema = matches[0].second.getSchema()
+        rows = ((mm.first, mm.second, mm.distance) for mm in matches)
 
     refMapper, srcMapper = afwTable.SchemaMapper.join([refSchema, srcSchema], ["ref_", "src_"])
     schema = refMapper.editOutputSchema()
@@ -77,11 +86,11 @@ def denormalizeMatches(matches, matchMeta=None):
 
     catalog = afwTable.BaseCatalog(schema)
     catalog.reserve(len(matches))
-    for mm in matches:
+    for ref, src, distance in rows:
         row = catalog.addNew()
-        row.assign(mm.first, refMapper)
-        row.assign(mm.second, srcMapper)
-        row.set(distKey, mm.distance)
+        row.assign(ref, refMapper)
+        row.assign(src, srcMapper)
+        row.set(distKey, distance)
 
     if matchMeta is not None:
         catalog.getTable().setMetadata(matchMeta)
@@ -33,6 +33,7 @@ import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 
 from .makeMatchStatistics import makeMatchStatisticsInRadians
+from .matchSet import MatchSet
 from .setMatchDistance import setMatchDistance
 
 
@@ -118,7 +119,7 @@ class FitAffineWcsTask(pipeBase.Task):
 
         Parameters
         ----------
-        matches : `list` of `lsst.afw.table.ReferenceMatch`
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             The following fields are read:
 
             - match.first (reference object) coord
@@ -231,9 +232,12 @@ class FitAffineWcsTask(pipeBase.Task):
                 sourceList=[match.second for match in matches])
         setMatchDistance(matches)
 
-        stats = makeMatchStatisticsInRadians(wcs,
-                                             matches,
-                                             lsst.afw.math.MEDIAN)
+        if isinstance(matches, MatchSet):
+            stats = matches.makeMatchStatisticsInRadians(wcs, lsst.afw.math.MEDIAN)
+        else:
+            stats = makeMatchStatisticsInRadians(wcs,
+                                                 matches,
+                                                 lsst.afw.math.MEDIAN)
         scatterOnSky = stats.getValue() * radians
 
         self.log.debug("In fitter scatter %.4f" % scatterOnSky.asArcseconds())
@@ -32,6 +32,7 @@ import lsst.afw.display
 from .scaledPolynomialTransformFitter import ScaledPolynomialTransformFitter, OutlierRejectionControl
 from .sipTransform import SipForwardTransform, SipReverseTransform, makeWcs
 from .makeMatchStatistics import makeMatchStatisticsInRadians
+from .matchSet import MatchSet
 
 from .setMatchDistance import setMatchDistance
 
@@ -117,7 +118,7 @@ class FitSipDistortionTask(lsst.pipe.base.Task):
 
         Parameters
         ----------
-        matches : `list` of `lsst.afw.table.ReferenceMatch`
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             A sequence of reference object/source matches.
             The following fields are read:
             - match.first (reference object) coord
@@ -247,7 +248,10 @@ class FitSipDistortionTask(lsst.pipe.base.Task):
         self.log.debug("Updating distance in match list")
         setMatchDistance(matches)
 
-        stats = makeMatchStatisticsInRadians(wcs, matches, lsst.afw.math.MEDIAN)
+        if isinstance(matches, MatchSet):
+            stats = matches.makeMatchStatisticsInRadians(wcs, lsst.afw.math.MEDIAN)
+        else:
+            stats = makeMatchStatisticsInRadians(wcs, matches, lsst.afw.math.MEDIAN)
         scatterOnSky = stats.getValue()*lsst.geom.radians
 
         if scatterOnSky.asArcseconds() > self.config.maxScatterArcsec:
@@ -30,6 +30,7 @@ import lsst.afw.geom as afwGeom
 import lsst.afw.table as afwTable
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
+from .matchSet import MatchSet
 from .setMatchDistance import setMatchDistance
 from .sip import makeCreateWcsWithSip
 
@@ -82,7 +83,7 @@ class FitTanSipWcsTask(pipeBase.Task):
 
         Parameters
         ----------
-        matches : `list` of `lsst.afw.table.ReferenceMatch`
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             The following fields are read:
 
             - match.first (reference object) coord
@@ -128,9 +129,12 @@ class FitTanSipWcsTask(pipeBase.Task):
         debug = lsstDebug.Info(__name__)
 
         wcs = self.initialWcs(matches, initWcs)
+        # The SIP fitter takes a list of matches; make it once, so the
+        # rejection iterations only select from it
+        matchList = matches.toMatches() if isinstance(matches, MatchSet) else matches
         rejected = np.zeros(len(matches), dtype=bool)
         for rej in range(self.config.numRejIter):
-            sipObject = self._fitWcs([mm for i, mm in enumerate(matches) if not rejected[i]], wcs)
+            sipObject = self._fitWcs(self._selectGoodMatches(matchList, rejected), wcs)
             wcs = sipObject.getNewWcs()
             rejected = self.rejectMatches(matches, wcs, rejected)
             if rejected.sum() == len(rejected):
@@ -145,7 +149,7 @@ class FitTanSipWcsTask(pipeBase.Task):
                 print("Plotting fit after rejection iteration %d/%d" % (rej + 1, self.config.numRejIter))
                 self.plotFit(matches, wcs, rejected)
         # Final fit after rejection
-        sipObject = self._fitWcs([mm for i, mm in enumerate(matches) if not rejected[i]], wcs)
+        sipObject = self._fitWcs(self._selectGoodMatches(matchList, rejected), wcs)
         wcs = sipObject.getNewWcs()
         if debug.plot:
             print("Plotting final fit")
@@ -191,7 +195,7 @@ class FitTanSipWcsTask(pipeBase.Task):
 
         Parameters
         ----------
-        matches : `list` of `lsst.afw.table.ReferenceMatch`
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             List of sources matched to references.
         wcs : `lsst.afw.geom.SkyWcs`
             Current WCS.
@@ -201,6 +205,14 @@ class FitTanSipWcsTask(pipeBase.Task):
         newWcs : `lsst.afw.geom.SkyWcs`
             Initial WCS guess from estimated crpix and crval.
         """
+        if isinstance(matches, MatchSet):
+            crpix = lsst.geom.Point2D(matches.sourceX.mean(), matches.sourceY.mean())
+            cosDec = np.cos(matches.refDec)
+            crval = lsst.sphgeom.Vector3d((cosDec*np.cos(matches.refRa)).mean(),
+                                          (cosDec*np.sin(matches.refRa)).mean(),
+                                          np.sin(matches.refDec).mean())
+            return afwGeom.makeSkyWcs(crpix=crpix, crval=lsst.geom.SpherePoint(crval),
+                                      cdMatrix=wcs.getCdMatrix())
         crpix = lsst.geom.Extent2D(0, 0)
         crval = lsst.sphgeom.Vector3d(0, 0, 0)
         for mm in matches:
@@ -233,6 +245,24 @@ class FitTanSipWcsTask(pipeBase.Task):
             wcs = sipObject.getNewWcs()
         return sipObject
 
+    @staticmethod
+    def _selectGoodMatches(matches, rejected):
+        """Select the matches that have not been rejected.
+
+        Parameters
+        ----------
+        matches : `list` of `lsst.afw.table.ReferenceMatch`
+            List of sources matched to references.
+        rejected : array-like of `bool`
+            Array of matches rejected from the fit.
+
+        Returns
+        -------
+        goodMatches : `list` of `lsst.afw.table.ReferenceMatch`
+            Matches that have not been rejected.
+        """
+        return [mm for i, mm in enumerate(matches) if not rejected[i]]
+
     def rejectMatches(self, matches, wcs, rejected):
         """Flag deviant matches
 
@@ -242,7 +272,7 @@ class FitTanSipWcsTask(pipeBase.Task):
 
         Parameters
         ----------
-        matches : `list` of `lsst.afw.table.ReferenceMatch`
+        matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             List of sources matched to references.
         wcs : `lsst.afw.geom.SkyWcs`
             Fitted WCS.
@@ -254,9 +284,14 @@ class FitTanSipWcsTask(pipeBase.Task):
         rejectedMatches : `ndarray` of type `bool`
             Matched objects found to be outside of tolerance.
         """
-        fit = [wcs.skyToPixel(m.first.getCoord()) for m in matches]
-        dx = np.array([ff.getX() - mm.second.getCentroid().getX() for ff, mm in zip(fit, matches)])
-        dy = np.array([ff.getY() - mm.second.getCentroid().getY() for ff, mm in zip(fit, matches)])
+        if isinstance(matches, MatchSet):
+            fitX, fitY = matches.getRefPixels(wcs)
+            dx = fitX - matches.sourceX
+            dy = fitY - matches.sourceY
+        else:
+            fit = [wcs.skyToPixel(m.first.getCoord()) for m in matches]
+            dx = np.array([ff.getX() - mm.second.getCentroid().getX() for ff, mm in zip(fit, matches)])
+            dy = np.array([ff.getY() - mm.second.getCentroid().getY() for ff, mm in zip(fit, matches)])
         good = np.logical_not(rejected)
         return (dx > self.config.rejSigma*dx[good].std()) | (dy > self.config.rejSigma*dy[good].std())
 
@@ -34,12 +34,13 @@ namespace {
 
 template <typename MatchT>
 static void declareMakeMatchStatistics(py::module& mod) {
+    // The statistics only read the matches, so other Python threads can run while they are computed.
     mod.def("makeMatchStatistics", &makeMatchStatistics<MatchT>, "matchList"_a, "flags"_a,
-            "sctrl"_a = afw::math::StatisticsControl());
+            "sctrl"_a = afw::math::StatisticsControl(), py::call_guard<py::gil_scoped_release>());
     mod.def("makeMatchStatisticsInPixels", &makeMatchStatisticsInPixels<MatchT>, "wcs"_a, "matchList"_a,
-            "flags"_a, "sctrl"_a = afw::math::StatisticsControl());
+            "flags"_a, "sctrl"_a = afw::math::StatisticsControl(), py::call_guard<py::gil_scoped_release>());
     mod.def("makeMatchStatisticsInRadians", &makeMatchStatisticsInRadians<MatchT>, "wcs"_a, "matchList"_a,
-            "flags"_a, "sctrl"_a = afw::math::StatisticsControl());
+            "flags"_a, "sctrl"_a = afw::math::StatisticsControl(), py::call_guard<py::gil_scoped_release>());
 }
 
 }  // namespace
@@ -86,12 +86,29 @@ static void declareMatchOptimisticBControl(py::module &mod) {
     cls.def("validate", &MatchOptimisticBControl::validate);
 }
 
+static void declareOptimisticPatternMatcherB(py::module &mod) {
+    py::class_<OptimisticPatternMatcherB, std::shared_ptr<OptimisticPatternMatcherB>> cls(
+            mod, "OptimisticPatternMatcherB");
+
+    // Preparing the catalogs only reads them, so other Python threads can run while it does.
+    cls.def(py::init<afw::table::SimpleCatalog const &, afw::table::SourceCatalog const &,
+                     MatchOptimisticBControl const &, afw::geom::SkyWcs const &, int, bool>(),
+            "posRefCat"_a, "sourceCat"_a, "control"_a, "wcs"_a, "posRefBegInd"_a = 0, "verbose"_a = false,
+            py::call_guard<py::gil_scoped_release>());
+
+    // Matching only reads the prepared catalogs, so other Python threads, including ones matching
+    // with other tolerances, can run while it does.
+    cls.def("match", &OptimisticPatternMatcherB::match, "control"_a,
+            py::call_guard<py::gil_scoped_release>());
+}
+
 }  // namespace
 
 PYBIND11_MODULE(matchOptimisticB, mod) {
     declareRecordProxy(mod);
     declareProxyPair(mod);
     declareMatchOptimisticBControl(mod);
+    declareOptimisticPatternMatcherB(mod);
 
     mod.def("makeProxies",
             (ProxyVector(*)(afw::table::SourceCatalog const &, afw::geom::SkyWcs const &,
@@ -103,7 +120,7 @@ PYBIND11_MODULE(matchOptimisticB, mod) {
             "posRefCat"_a, "tanWcs"_a);
 
     mod.def("matchOptimisticB", &matchOptimisticB, "posRefCat"_a, "sourceCat"_a, "control"_a, "wcs"_a,
-            "posRefBegInd"_a = 0, "verbose"_a = false);
+            "posRefBegInd"_a = 0, "verbose"_a = false, py::call_guard<py::gil_scoped_release>());
 }
 
 }  // namespace astrom
@@ -3,12 +3,13 @@ __all__ = ["MatchOptimisticBTask", "MatchOptimisticBConfig",
            "MatchTolerance"]
 
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 
 from .setMatchDistance import setMatchDistance
-from .matchOptimisticB import matchOptimisticB, MatchOptimisticBControl
+from .matchOptimisticB import MatchOptimisticBControl, OptimisticPatternMatcherB
 
 
 class MatchTolerance:
@@ -89,6 +90,13 @@ class MatchOptimisticBConfig(pexConfig.Config):
         dtype=float,
         default=0.02,
     )
+    numToleranceWorkers = pexConfig.RangeField(
+        doc="Number of threads trying the sets of matching tolerances concurrently. The matches "
+            "returned are those of the first successful set in the order they are tried serially.",
+        dtype=int,
+        default=1,
+        min=1,
+    )
 
 
 # The following block adds links to this task from the Task Documentation page.
@@ -299,31 +307,63 @@ class MatchOptimisticBTask(pipeBase.Task):
             maxMatchDistArcSec = min(maxMatchDist.asArcseconds(), self.config.maxMatchDistArcSec)
         configMatchDistPix = maxMatchDistArcSec/wcs.getPixelScale().asArcseconds()
 
-        matchControl = MatchOptimisticBControl()
-        matchControl.refFluxField = refFluxField
-        matchControl.sourceFluxField = sourceFluxField
-        matchControl.numBrightStars = self.config.numBrightStars
-        matchControl.minMatchedPairs = self.config.minMatchedPairs
-        matchControl.maxOffsetPix = self.config.maxOffsetPix
-        matchControl.numPointsForShape = self.config.numPointsForShape
-        matchControl.maxDeterminant = self.config.maxDeterminant
+        def makeMatchControl():
+            matchControl = MatchOptimisticBControl()
+            matchControl.refFluxField = refFluxField
+            matchControl.sourceFluxField = sourceFluxField
+            matchControl.numBrightStars = self.config.numBrightStars
+            matchControl.minMatchedPairs = self.config.minMatchedPairs
+            matchControl.maxOffsetPix = self.config.maxOffsetPix
+            matchControl.numPointsForShape = self.config.numPointsForShape
+            matchControl.maxDeterminant = self.config.maxDeterminant
+            return matchControl
+
+        # The catalogs are projected and their pair lists built once for all
+        # the tolerances tried below.
+        matcher = OptimisticPatternMatcherB(
+            refCat,
+            sourceCat,
+            makeMatchControl(),
+            wcs,
+            posRefBegInd,
+            verbose,
+        )
 
+        # Sets of tolerances to try, loosest last.
+        matchControlList = []
         for maxRotInd in range(4):
-            matchControl.maxRotationDeg = self.config.maxRotationDeg * math.pow(2.0, 0.5*maxRotInd)
             for matchRadInd in range(3):
-                matchControl.matchingAllowancePix = configMatchDistPix * math.pow(1.25, matchRadInd)
-
                 for angleDiffInd in range(3):
+                    matchControl = makeMatchControl()
+                    matchControl.maxRotationDeg = self.config.maxRotationDeg * math.pow(2.0, 0.5*maxRotInd)
+                    matchControl.matchingAllowancePix = configMatchDistPix * math.pow(1.25, matchRadInd)
                     matchControl.allowedNonperpDeg = self.config.allowedNonperpDeg*(angleDiffInd+1)
-                    matches = matchOptimisticB(
-                        refCat,
-                        sourceCat,
-                        matchControl,
-                        wcs,
-                        posRefBegInd,
-                        verbose,
-                    )
-                    if matches is not None and len(matches) > 0:
-                        setMatchDistance(matches)
-                        return matches
-        return matches
+                    matchControlList.append(matchControl)
+
+        if self.config.numToleranceWorkers <= 1:
+            for matchControl in matchControlList:
+                matches = matcher.match(matchControl)
+                if matches is not None and len(matches) > 0:
+                    setMatchDistance(matches)
+                    return matches
+            return matches
+
+        # The matcher releases the GIL while matching, so the sets of
+        # tolerances are tried in parallel. The results are then examined in
+        # the serial order, and once one succeeds the sets after it not yet
+        # started are cancelled and those running are left to finish in the
+        # background.
+        executor = ThreadPoolExecutor(max_workers=self.config.numToleranceWorkers)
+        futures = []
+        try:
+            futures = [executor.submit(matcher.match, matchControl) for matchControl in matchControlList]
+            for future in futures:
+                matches = future.result()
+                if matches is not None and len(matches) > 0:
+                    setMatchDistance(matches)
+                    return matches
+            return matches
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
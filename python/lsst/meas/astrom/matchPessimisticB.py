@@ -1,4 +1,8 @@
 
+from collections import OrderedDict
+import hashlib
+import threading
+
 import numpy as np
 from scipy.spatial import cKDTree
 
@@ -14,6 +18,13 @@ from .pessimistic_pattern_matcher_b_3D import PessimisticPatternMatcherB
 __all__ = ["MatchPessimisticBTask", "MatchPessimisticBConfig",
            "MatchTolerancePessimistic"]
 
+# In process cache of pattern matchers keyed on the reference object
+# positions, shared by all MatchPessimisticBTasks. Entries are ordered from
+# least to most recently used. The lock guards all accesses, as tasks may
+# match concurrently in several threads.
+_matcherCache = OrderedDict()
+_matcherCacheLock = threading.Lock()
+
 
 class MatchTolerancePessimistic(MatchTolerance):
     """Stores match tolerances for use in AstrometryTask and later
@@ -147,12 +158,87 @@ class MatchPessimisticBConfig(pexConfig.Config):
         default=1000,
     )
     maxRefObjects = pexConfig.RangeField(
-        doc="Maximum number of reference objects to use for the matcher. The "
-            "absolute maximum allowed for is 2 ** 16 for memory reasons.",
+        doc="Maximum number of reference objects to use for the matcher. "
+            "Catalogs of more than 2 ** 16 objects use 32 bit ids. The "
+            "memory of the reference pair index grows as the square of this "
+            "number, so values above 2 ** 16 require useSparsePairIndex.",
         dtype=int,
         default=2**16,
         min=0,
-        max=2**16 + 1,
+        max=2**32,
+    )
+    useSparsePairIndex = pexConfig.Field(
+        doc="Only store reference pairs that are shorter than the longest "
+            "possible source spoke, set from the footprint of the source "
+            "catalog plus the loosest match tolerance. This reduces the "
+            "memory and setup time of the matcher for dense reference "
+            "catalogs without changing the matches found.",
+        dtype=bool,
+        default=False,
+    )
+    indexCacheDir = pexConfig.Field(
+        doc="Directory in which to persist the reference pair indexes of the "
+            "matcher, keyed by the reference object positions. Indexes found "
+            "there are memory mapped rather than rebuilt, allowing reruns "
+            "and concurrent processes to share them. No cache is used if "
+            "None.",
+        dtype=str,
+        default=None,
+        optional=True,
+    )
+    maxIndexCacheSizeGB = pexConfig.RangeField(
+        doc="Maximum total size of the reference pair indexes in "
+            "indexCacheDir (GB). The least recently used indexes are "
+            "removed when this is exceeded.",
+        dtype=float,
+        default=10.,
+        min=0,
+    )
+    useCompiledPatternSearch = pexConfig.Field(
+        doc="Run the shift, rotation and spoke tests of the pattern search "
+            "in compiled code rather than Python. The matches found are "
+            "unchanged.",
+        dtype=bool,
+        default=False,
+    )
+    usePatternPrefilter = pexConfig.Field(
+        doc="Before searching for a source pattern, test if any reference "
+            "object has pairs with the lengths of the pattern spokes and "
+            "skip the pattern if not. The test is conservative so the "
+            "matches are unchanged. The summary of the pair lengths of each "
+            "reference object it uses, in bins of the match tolerance, takes "
+            "up to 16 bytes of memory per reference pair.",
+        dtype=bool,
+        default=False,
+    )
+    numPatternWorkers = pexConfig.RangeField(
+        doc="Number of threads constructing candidate patterns concurrently "
+            "in the pattern search. The pattern matched is the same as for "
+            "the serial search. Most effective with "
+            "useCompiledPatternSearch.",
+        dtype=int,
+        default=1,
+        min=1,
+    )
+    warmStartSoftenIterations = pexConfig.Field(
+        doc="Have the pattern matcher record the candidate reference "
+            "patterns failing its shift and rotation tests, which do not "
+            "depend on the match distance, and skip them in the following "
+            "softening iterations. The matches found are unchanged. Only "
+            "used by the Python pattern search.",
+        dtype=bool,
+        default=False,
+    )
+    matcherCacheSize = pexConfig.RangeField(
+        doc="Number of pattern matchers to keep in an in process cache "
+            "shared by all tasks, keyed on the reference object positions. "
+            "Matching a reference catalog that is in the cache, for instance "
+            "in a new solve or with a different source selection, then skips "
+            "building the reference pair index. Each matcher holds its index "
+            "in memory. No cache is used if 0.",
+        dtype=int,
+        default=0,
+        min=0,
     )
 
     def validate(self):
@@ -163,6 +249,9 @@ class MatchPessimisticBConfig(pexConfig.Config):
         if self.numPointsForShape > self.numBrightStars:
             raise ValueError("numBrightStars must be greater than "
                              "numPointsForShape.")
+        if self.maxRefObjects > 2**16 and not self.useSparsePairIndex:
+            raise ValueError("useSparsePairIndex must be set if maxRefObjects "
+                             "is greater than 2 ** 16.")
 
 
 # The following block adds links to this task from the Task Documentation page.
@@ -184,6 +273,15 @@ class MatchPessimisticBTask(pipeBase.Task):
     def __init__(self, **kwargs):
         pipeBase.Task.__init__(self, **kwargs)
 
+    @staticmethod
+    def clearMatcherCache():
+        """Remove all pattern matchers from the in process matcher cache.
+
+        Call this to release the memory of the cached reference pair indexes.
+        """
+        with _matcherCacheLock:
+            _matcherCache.clear()
+
     @pipeBase.timeMethod
     def matchObjectsToSources(self, refCat, sourceCat, wcs, sourceFluxField, refFluxField,
                               match_tolerance=None):
@@ -281,6 +379,41 @@ class MatchPessimisticBTask(pipeBase.Task):
             match_tolerance=match_tolerance,
         )
 
+    def makeMatchTolerance(self, refCat, sourceCat, wcs, sourceFluxField,
+                           refFluxField):
+        """Create the match tolerance of the first match of a match and fit
+        cycle, including its pattern matcher.
+
+        Passing the result to `matchObjectsToSources` with the same
+        arguments finds the same matches as passing `None`, without building
+        the reference pair index there. This allows the index to be built
+        before forking processes that match, so they share it.
+
+        Parameters
+        ----------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            catalog of reference objects that overlap the exposure
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of good sources found on the exposure
+        wcs : `lsst.afw.geom.SkyWcs`
+            estimated WCS
+        sourceFluxField: `str`
+            field of sourceCat to use for flux
+        refFluxField : `str`
+            field of refCat to use for flux
+
+        Returns
+        -------
+        match_tolerance : `lsst.meas.astrom.MatchTolerancePessimistic`
+            Match tolerance with the automated maximum match distance and
+            the pattern matcher set.
+        """
+        match_tolerance = MatchTolerancePessimistic()
+        src_array = self._makeSourceArray(sourceCat, wcs, sourceFluxField)
+        self._initMatchTolerance(self._filterRefCat(refCat, refFluxField),
+                                 src_array, wcs, refFluxField, match_tolerance)
+        return match_tolerance
+
     def _filterRefCat(self, refCat, refFluxField):
         """Sub-select a number of reference objects starting from the brightest
         and maxing out at the number specified by maxRefObjects in the config.
@@ -362,43 +495,15 @@ class MatchPessimisticBTask(pipeBase.Task):
         # objects contiguous in memory. We need to do these slightly
         # differently for the reference and source cats as they are
         # different catalog objects with different fields.
-        src_array = np.empty((len(sourceCat), 4), dtype=np.float64)
-        for src_idx, srcObj in enumerate(sourceCat):
-            coord = wcs.pixelToSky(srcObj.getCentroid())
-            theta = np.pi / 2 - coord.getLatitude().asRadians()
-            phi = coord.getLongitude().asRadians()
-            flux = srcObj[sourceFluxField]
-            src_array[src_idx, :] = \
-                self._latlong_flux_to_xyz_mag(theta, phi, flux)
+        src_array = self._makeSourceArray(sourceCat, wcs, sourceFluxField)
 
         if match_tolerance.PPMbObj is None or \
            match_tolerance.autoMaxMatchDist is None:
             # The reference catalog is fixed per AstrometryTask so we only
             # create the data needed if this is the first step in the match
             # fit cycle.
-            ref_array = np.empty((len(refCat), 4), dtype=np.float64)
-            for ref_idx, refObj in enumerate(refCat):
-                theta = np.pi / 2 - refObj.getDec().asRadians()
-                phi = refObj.getRa().asRadians()
-                flux = refObj[refFluxField]
-                ref_array[ref_idx, :] = \
-                    self._latlong_flux_to_xyz_mag(theta, phi, flux)
-            # Create our matcher object.
-            match_tolerance.PPMbObj = PessimisticPatternMatcherB(
-                ref_array[:, :3], self.log)
-            self.log.debug("Computing source statistics...")
-            maxMatchDistArcSecSrc = self._get_pair_pattern_statistics(
-                src_array)
-            self.log.debug("Computing reference statistics...")
-            maxMatchDistArcSecRef = self._get_pair_pattern_statistics(
-                ref_array)
-            maxMatchDistArcSec = np.max((
-                self.config.minMatchDistPixels *
-                wcs.getPixelScale().asArcseconds(),
-                np.min((maxMatchDistArcSecSrc,
-                        maxMatchDistArcSecRef))))
-            match_tolerance.autoMaxMatchDist = geom.Angle(
-                maxMatchDistArcSec, geom.arcseconds)
+            self._initMatchTolerance(refCat, src_array, wcs, refFluxField,
+                                     match_tolerance)
 
         # Set configurable defaults when we encounter None type or set
         # state based on previous run of AstrometryTask._matchAndFitWcs.
@@ -419,6 +524,7 @@ class MatchPessimisticBTask(pipeBase.Task):
         # of the two.
         if match_tolerance.maxMatchDist is None:
             match_tolerance.maxMatchDist = match_tolerance.autoMaxMatchDist
+            maxMatchDistArcSec = match_tolerance.autoMaxMatchDist.asArcseconds()
         else:
             maxMatchDistArcSec = np.max(
                 (self.config.minMatchDistPixels *
@@ -471,7 +577,10 @@ class MatchPessimisticBTask(pipeBase.Task):
                 max_dist=maxMatchDistArcSec * 2. ** soften_dist,
                 min_matches=minMatchedPairs,
                 pattern_skip_array=np.array(
-                    match_tolerance.failedPatternList)
+                    match_tolerance.failedPatternList),
+                n_workers=self.config.numPatternWorkers,
+                warm_start=self.config.warmStartSoftenIterations,
+                log=self.log,
             )
 
             if soften_dist == 0 and \
@@ -540,39 +649,206 @@ class MatchPessimisticBTask(pipeBase.Task):
             match_tolerance=match_tolerance,
         )
 
+    def _makeSourceArray(self, sourceCat, wcs, sourceFluxField):
+        """Convert a source catalog to the unit sphere positions and
+        magnitudes used by the pattern matcher.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            catalog of sources found on the exposure
+        wcs : `lsst.afw.geom.SkyWcs`
+            estimated WCS of exposure
+        sourceFluxField : `str`
+            Name of the flux field in the source catalog.
+
+        Returns
+        -------
+        src_array : `numpy.ndarray`, (N, 4)
+            x, y, z position on the unit sphere and magnitude of each source.
+        """
+        # Column access requires contiguous catalogs so we copy those that
+        # are not, keeping the input catalog for creating the matches.
+        srcColumnCat = sourceCat
+        if not srcColumnCat.isContiguous():
+            srcColumnCat = srcColumnCat.copy(deep=True)
+        src_ra, src_dec = wcs.pixelToSkyArray(srcColumnCat.getX(),
+                                              srcColumnCat.getY(),
+                                              degrees=False)
+        return self._latlong_flux_to_xyz_mag(
+            np.pi / 2 - src_dec, src_ra, srcColumnCat[sourceFluxField])
+
+    def _initMatchTolerance(self, refCat, src_array, wcs, refFluxField,
+                            match_tolerance):
+        """Set the automated maximum match distance and the pattern matcher
+        of a match tolerance.
+
+        Parameters
+        ----------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            catalog of position reference objects that overlap an exposure
+        src_array : `numpy.ndarray`, (N, 4)
+            x, y, z position on the unit sphere and magnitude of each source.
+        wcs : `lsst.afw.geom.SkyWcs`
+            estimated WCS of exposure
+        refFluxField : `str`
+            field of refCat to use for flux
+        match_tolerance : `lsst.meas.astrom.MatchTolerancePessimistic`
+            match tolerance to update.
+        """
+        refColumnCat = refCat
+        if not refColumnCat.isContiguous():
+            refColumnCat = refColumnCat.copy(deep=True)
+        ref_array = self._latlong_flux_to_xyz_mag(
+            np.pi / 2 - refColumnCat["coord_dec"],
+            refColumnCat["coord_ra"], refColumnCat[refFluxField])
+        self.log.debug("Computing source statistics...")
+        maxMatchDistArcSecSrc = self._get_pair_pattern_statistics(
+            src_array)
+        self.log.debug("Computing reference statistics...")
+        maxMatchDistArcSecRef = self._get_pair_pattern_statistics(
+            ref_array)
+        maxMatchDistArcSec = np.max((
+            self.config.minMatchDistPixels *
+            wcs.getPixelScale().asArcseconds(),
+            np.min((maxMatchDistArcSecSrc,
+                    maxMatchDistArcSecRef))))
+        match_tolerance.autoMaxMatchDist = geom.Angle(
+            maxMatchDistArcSec, geom.arcseconds)
+        # Create our matcher object.
+        if self.config.useSparsePairIndex:
+            maxPairDistRad = self._get_max_pair_dist(src_array,
+                                                     maxMatchDistArcSec)
+        else:
+            maxPairDistRad = None
+        match_tolerance.PPMbObj = self._getMatcher(ref_array,
+                                                   maxPairDistRad)
+
     def _latlong_flux_to_xyz_mag(self, theta, phi, flux):
         """Convert angles theta and phi and a flux into unit sphere
         x, y, z, and a relative magnitude.
 
-        Takes in a afw catalog object and converts the catalog object RA, DECs
+        Takes in the RA, DECs of afw catalog objects and converts them
         to points on the unit sphere. Also converts the flux into a simple,
         non-zero-pointed magnitude for relative sorting.
 
         Parameters
         ----------
-        theta : `float`
+        theta : `float` or `numpy.ndarray`, (N,)
             Angle from the north pole (z axis) of the sphere
-        phi : `float`
+        phi : `float` or `numpy.ndarray`, (N,)
             Rotation around the sphere
+        flux : `float` or `numpy.ndarray`, (N,)
+            Flux of the objects.
 
         Return
         ------
-        output_array : `numpy.ndarray`, (N, 4)
+        output_array : `numpy.ndarray`, (4,) or (N, 4)
             Spherical unit vector x, y, z  with flux.
         """
-        output_array = np.empty(4, dtype=np.float64)
-        output_array[0] = np.sin(theta)*np.cos(phi)
-        output_array[1] = np.sin(theta)*np.sin(phi)
-        output_array[2] = np.cos(theta)
-        if flux > 0:
-            output_array[3] = -2.5 * np.log10(flux)
-        else:
-            # Set flux to a very faint mag if its for some reason it
-            # does not exist
-            output_array[3] = 99.
+        theta = np.asarray(theta, dtype=np.float64)
+        phi = np.asarray(phi, dtype=np.float64)
+        flux = np.asarray(flux, dtype=np.float64)
+        output_array = np.empty(theta.shape + (4,), dtype=np.float64)
+        output_array[..., 0] = np.sin(theta)*np.cos(phi)
+        output_array[..., 1] = np.sin(theta)*np.sin(phi)
+        output_array[..., 2] = np.cos(theta)
+        # Set flux to a very faint mag if its for some reason it
+        # does not exist
+        with np.errstate(divide="ignore", invalid="ignore"):
+            output_array[..., 3] = np.where(flux > 0, -2.5 * np.log10(flux),
+                                            99.)
 
         return output_array
 
+    def _getMatcher(self, ref_array, maxPairDistRad):
+        """Return a pattern matcher for the reference objects, reusing one from
+        the matcher cache if possible.
+
+        A cached matcher is reused if it was created for the same reference
+        positions and stores all reference pairs up to ``maxPairDistRad``.
+
+        Parameters
+        ----------
+        ref_array : `numpy.ndarray`, (N, 4)
+            array of 3 vectors representing the x, y, z position of reference
+            objects on the unit sphere and their magnitude.
+        maxPairDistRad : `float` or `None`
+            Maximum reference pair distance the matcher must store. All
+            pairs are needed if `None`.
+
+        Returns
+        -------
+        matcher : `lsst.meas.astrom.pessimistic_pattern_matcher_b_3D.PessimisticPatternMatcherB`
+            Pattern matcher for the reference objects.
+        """
+        cacheKey = None
+        if self.config.matcherCacheSize > 0:
+            keyHash = hashlib.sha1(np.ascontiguousarray(
+                ref_array[:, :3], dtype=np.float64).tobytes())
+            refKey = (keyHash.hexdigest(),
+                      self.config.useCompiledPatternSearch,
+                      self.config.usePatternPrefilter)
+            with _matcherCacheLock:
+                for cacheKey, matcher in _matcherCache.items():
+                    cachedMaxPairDistRad = cacheKey[-1]
+                    if cacheKey[:-1] == refKey and \
+                       (cachedMaxPairDistRad is None or
+                            (maxPairDistRad is not None and
+                             cachedMaxPairDistRad >= maxPairDistRad)):
+                        self.log.debug("Reusing cached pattern matcher.")
+                        _matcherCache.move_to_end(cacheKey)
+                        return matcher
+            cacheKey = refKey + (maxPairDistRad,)
+
+        matcher = PessimisticPatternMatcherB(
+            ref_array[:, :3], self.log, max_pair_dist_rad=maxPairDistRad,
+            index_cache_dir=self.config.indexCacheDir,
+            max_index_cache_bytes=int(
+                self.config.maxIndexCacheSizeGB * 1024 ** 3),
+            use_compiled_search=self.config.useCompiledPatternSearch,
+            use_pattern_prefilter=self.config.usePatternPrefilter)
+
+        if cacheKey is not None:
+            with _matcherCacheLock:
+                _matcherCache[cacheKey] = matcher
+                while len(_matcherCache) > self.config.matcherCacheSize:
+                    _matcherCache.popitem(last=False)
+        return matcher
+
+    def _get_max_pair_dist(self, cat_array, max_match_dist_arcsec):
+        """Compute the longest reference pair distance the matcher can need
+        for a given source catalog.
+
+        Any source spoke is shorter than twice the largest distance of a
+        source from the catalog center. Reference pairs can be matched to a
+        spoke up to the match tolerance, which doubles in each softening
+        iteration of the matcher.
+
+        Parameters
+        ----------
+        cat_array : `numpy.ndarray`, (N, 4)
+            array of 3 vectors representing the x, y, z position of catalog
+            objects on the unit sphere and their magnitude.
+        max_match_dist_arcsec : `float`
+            Starting maximum match distance of the matcher in arcseconds.
+
+        Returns
+        -------
+        max_pair_dist_rad : `float`
+            Maximum reference pair distance to store in radians.
+        """
+        center_vect = np.mean(cat_array[:, :3], axis=0)
+        center_vect /= np.sqrt(np.dot(center_vect, center_vect))
+        max_spoke_dist_rad = 2 * np.max(np.sqrt(
+            np.sum((cat_array[:, :3] - center_vect) ** 2, axis=1)))
+        max_match_dist_rad = np.radians(
+            max_match_dist_arcsec / 3600. *
+            2. ** (self.config.matcherIterations - 1))
+        # The estimate of the source footprint changes slightly as the WCS
+        # is updated between match/fit iterations so we pad it.
+        return 1.1 * max_spoke_dist_rad + max_match_dist_rad
+
     def _get_pair_pattern_statistics(self, cat_array):
         """ Compute the tolerances for the matcher automatically by comparing
         pinwheel patterns as we would in the matcher.
@@ -599,32 +875,26 @@ class MatchPessimisticBTask(pipeBase.Task):
 
         self.log.debug("Starting automated tolerance calculation...")
 
-        # Create an empty array of all the patterns we possibly make
-        # sorting from brightest to faintest.
-        pattern_array = np.empty(
-            (cat_array.shape[0] - self.config.numPointsForShape,
-             self.config.numPointsForShape - 1))
+        # Sort our input array from brightest to faintest.
         flux_args_array = np.argsort(cat_array[:, -1])
-
-        # Sort our input array.
         tmp_sort_array = cat_array[flux_args_array]
 
-        # Start making patterns.
-        for start_idx in range(cat_array.shape[0] -
-                               self.config.numPointsForShape):
-            pattern_points = tmp_sort_array[start_idx:start_idx +
-                                            self.config.numPointsForShape, :-1]
-            pattern_delta = pattern_points[1:, :] - pattern_points[0, :]
-            pattern_array[start_idx, :] = np.sqrt(
-                pattern_delta[:, 0] ** 2 +
-                pattern_delta[:, 1] ** 2 +
-                pattern_delta[:, 2] ** 2)
-
-            # When we store the length of each spoke in our pattern we
-            # sort from shortest to longest so we have a defined space
-            # to compare them in.
-            pattern_array[start_idx, :] = pattern_array[
-                start_idx, np.argsort(pattern_array[start_idx, :])]
+        # Make all the patterns we possibly can at once. Pattern i is
+        # centered on object i with spokes to the following
+        # numPointsForShape - 1 objects.
+        n_patterns = cat_array.shape[0] - self.config.numPointsForShape
+        pattern_ids = (np.arange(n_patterns)[:, np.newaxis] +
+                       np.arange(1, self.config.numPointsForShape))
+        pattern_delta = (tmp_sort_array[pattern_ids, :3] -
+                         tmp_sort_array[:n_patterns, np.newaxis, :3])
+        pattern_array = np.sqrt(pattern_delta[:, :, 0] ** 2 +
+                                pattern_delta[:, :, 1] ** 2 +
+                                pattern_delta[:, :, 2] ** 2)
+
+        # When we store the length of each spoke in our pattern we
+        # sort from shortest to longest so we have a defined space
+        # to compare them in.
+        pattern_array.sort(axis=1)
 
         # Create a searchable tree object of the patterns and find
         # for any given pattern the closest pattern in the sorted
@@ -0,0 +1,480 @@
+# This file is part of meas_astrom.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["MatchSet", "readCatalogColumn", "findCatalogRows"]
+
+import copy
+import operator
+
+import numpy as np
+
+import lsst.afw.math as afwMath
+import lsst.afw.table as afwTable
+
+
+def readCatalogColumn(catalog, key, rows=None, dtype=float):
+    """Read a column of a catalog.
+
+    Parameters
+    ----------
+    catalog : `lsst.afw.table.SimpleCatalog`
+        Catalog to read.
+    key : `lsst.afw.table.Key`
+        Key of the field to read.
+    rows : `numpy.ndarray` of `int`, optional
+        Rows to read; all rows if `None`.
+    dtype : `numpy.dtype`, optional
+        Type of the returned array.
+
+    Returns
+    -------
+    values : `numpy.ndarray`
+        Values of the field; angles are in radians.
+
+    Notes
+    -----
+    Contiguous catalogs are read through their column views; others are read
+    record by record.
+    """
+    if catalog.isContiguous():
+        column = catalog.columns[key]
+        return np.array(column if rows is None else column[rows], dtype=dtype)
+    if rows is None:
+        return np.array([record.get(key) for record in catalog], dtype=dtype)
+    return np.array([catalog[int(row)].get(key) for row in rows], dtype=dtype)
+
+
+def findCatalogRows(catalog, ids):
+    """Find the rows of a catalog holding records with some IDs.
+
+    Parameters
+    ----------
+    catalog : `lsst.afw.table.SimpleCatalog`
+        Catalog to search.
+    ids : array-like of `int`
+        IDs to find.
+
+    Returns
+    -------
+    rows : `numpy.ndarray` of `int`
+        Row of ``catalog`` with each ID.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if an ID is not in ``catalog``, or if the IDs of ``catalog``
+        are not unique.
+    """
+    ids = np.array(ids, dtype=np.int64)
+    catalogIds = readCatalogColumn(catalog, catalog.schema["id"].asKey(), dtype=np.int64)
+    if len(catalogIds) == 0:
+        if len(ids) > 0:
+            raise RuntimeError("Catalog is empty")
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(catalogIds, kind="stable")
+    sortedIds = catalogIds[order]
+    duplicated = sortedIds[1:] == sortedIds[:-1]
+    if np.any(duplicated):
+        raise RuntimeError("Catalog IDs are not unique; %d records repeat an ID" %
+                           (np.count_nonzero(duplicated),))
+    positions = np.searchsorted(catalogIds, ids, sorter=order)
+    rows = order[np.minimum(positions, len(order) - 1)]
+    if np.any(catalogIds[rows] != ids):
+        raise RuntimeError("%d of %d IDs are not in the catalog" %
+                           (np.count_nonzero(catalogIds[rows] != ids), len(ids)))
+    return rows
+
+
+def _angularSeparation(ra1, dec1, ra2, dec2):
+    """Compute the angular separation between arrays of positions on the sky
+    with the haversine formula.
+
+    All angles are in radians.
+    """
+    sinHalfDDec = np.sin(0.5*(dec2 - dec1))
+    sinHalfDRa = np.sin(0.5*(ra2 - ra1))
+    hav = sinHalfDDec**2 + np.cos(dec1)*np.cos(dec2)*sinHalfDRa**2
+    return 2.0*np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0)))
+
+
+class MatchSet:
+    """A set of reference object/source matches held as columns.
+
+    Instead of a list of `lsst.afw.table.ReferenceMatch`, a match set holds
+    the catalogs that were matched, the row of each match in them and the
+    match distances as `numpy` arrays, together with the reference and
+    source coordinates and source centroids of the matches. Stages that work
+    on the columns avoid touching records from Python.
+
+    A match set can be used where a list of matches is expected:
+    ``len``, indexing with an integer and iteration return
+    `lsst.afw.table.ReferenceMatch` objects built on demand (or
+    `lsst.afw.table.SourceMatch` objects if ``refCat`` is a
+    `lsst.afw.table.SourceCatalog`), which pybind11 also accepts as a match
+    vector. Setting the distance of such a match does not change the match
+    set.
+
+    Parameters
+    ----------
+    refCat : `lsst.afw.table.SimpleCatalog`
+        Catalog of reference objects; the "coord" field is read.
+    sourceCat : `lsst.afw.table.SourceCatalog`
+        Catalog of sources; the "coord" and "slot_Centroid" fields are read.
+    refIndices : array-like of `int`
+        Row of ``refCat`` of each match.
+    sourceIndices : array-like of `int`
+        Row of ``sourceCat`` of each match.
+    distances : array-like of `float`, optional
+        Distance of each match; zero if `None`.
+
+    Raises
+    ------
+    ValueError
+        Raised if the arrays do not all have the same length.
+
+    Notes
+    -----
+    The coordinate and centroid columns are read when the match set is
+    created. Call `refresh` after changing them in the catalogs, e.g. with
+    `lsst.afw.table.updateSourceCoords`; `updateDistances` does this for the
+    coordinates.
+
+    Contiguous catalogs are read through their column views, so it is best
+    to match against them rather than against subsets of them.
+    """
+    _columnNames = ("refIndices", "sourceIndices", "distances", "refRa", "refDec",
+                    "sourceRa", "sourceDec", "sourceX", "sourceY")
+
+    def __init__(self, refCat, sourceCat, refIndices, sourceIndices, distances=None):
+        self.refCat = refCat
+        self.sourceCat = sourceCat
+        self.refIndices = np.array(refIndices, dtype=np.int64)
+        self.sourceIndices = np.array(sourceIndices, dtype=np.int64)
+        if distances is None:
+            distances = np.zeros(len(self.refIndices))
+        self.distances = np.array(distances, dtype=float)
+        if not (len(self.refIndices) == len(self.sourceIndices) == len(self.distances)):
+            raise ValueError("refIndices, sourceIndices and distances must have the same length; "
+                             "got %d, %d and %d" %
+                             (len(self.refIndices), len(self.sourceIndices), len(self.distances)))
+
+        self._refCoordKey = afwTable.CoordKey(refCat.schema["coord"])
+        self._sourceCoordKey = afwTable.CoordKey(sourceCat.schema["coord"])
+        self._sourceCentroidKey = afwTable.Point2DKey(sourceCat.schema["slot_Centroid"])
+        if isinstance(refCat, afwTable.SourceCatalog):
+            self._matchClass = afwTable.SourceMatch
+        else:
+            self._matchClass = afwTable.ReferenceMatch
+        self.refresh()
+
+    @classmethod
+    def fromMatches(cls, matches, refCat=None, sourceCat=None):
+        """Make a match set from a list of matches.
+
+        Parameters
+        ----------
+        matches : `list` of `lsst.afw.table.ReferenceMatch`
+            Matches to convert.
+        refCat : `lsst.afw.table.SimpleCatalog`, optional
+            Catalog holding the reference objects of the matches, which are
+            found by ID. If `None`, a catalog of the reference objects of the
+            matches is made, sharing their records.
+        sourceCat : `lsst.afw.table.SourceCatalog`, optional
+            Catalog holding the sources of the matches, which are found by ID.
+            If `None`, a catalog of the sources of the matches is made,
+            sharing their records.
+
+        Returns
+        -------
+        matchSet : `MatchSet`
+            The matches, with the distances of ``matches``.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if ``matches`` is empty and a catalog is not provided, if
+            a record of a match is not in the provided catalog, or if the IDs
+            of a provided catalog are not unique.
+        """
+        if isinstance(matches, MatchSet):
+            return matches
+        if len(matches) == 0 and (refCat is None or sourceCat is None):
+            raise RuntimeError("No matches provided.")
+        refRecords = [match.first for match in matches]
+        sourceRecords = [match.second for match in matches]
+        if refCat is None:
+            refCat = cls._makeCatalog(refRecords)
+            refIndices = np.arange(len(refRecords))
+        else:
+            refIndices = findCatalogRows(refCat, [record.getId() for record in refRecords])
+        if sourceCat is None:
+            sourceCat = cls._makeCatalog(sourceRecords)
+            sourceIndices = np.arange(len(sourceRecords))
+        else:
+            sourceIndices = findCatalogRows(sourceCat, [record.getId() for record in sourceRecords])
+        distances = [match.distance for match in matches]
+        return cls(refCat, sourceCat, refIndices, sourceIndices, distances)
+
+    @classmethod
+    def fromIds(cls, refCat, sourceCat, refIds, sourceIds, distances=None):
+        """Make a match set from the IDs of the matched records.
+
+        Parameters
+        ----------
+        refCat : `lsst.afw.table.SimpleCatalog`
+            Catalog of reference objects.
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            Catalog of sources.
+        refIds : array-like of `int`
+            ID of the reference object of each match.
+        sourceIds : array-like of `int`
+            ID of the source of each match.
+        distances : array-like of `float`, optional
+            Distance of each match; zero if `None`.
+
+        Returns
+        -------
+        matchSet : `MatchSet`
+            The matches.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if an ID is not in its catalog, or if the IDs of a catalog
+            are not unique.
+        """
+        return cls(refCat, sourceCat, findCatalogRows(refCat, refIds), findCatalogRows(sourceCat, sourceIds),
+                   distances)
+
+    @staticmethod
+    def _makeCatalog(records):
+        """Make a catalog sharing a list of records of the same table.
+        """
+        table = records[0].getTable()
+        if isinstance(table, afwTable.SourceTable):
+            catalog = afwTable.SourceCatalog(table)
+        else:
+            catalog = afwTable.SimpleCatalog(table)
+        catalog.reserve(len(records))
+        for record in records:
+            catalog.append(record)
+        return catalog
+
+    def toMatches(self):
+        """Convert the match set to a list of matches.
+
+        Returns
+        -------
+        matches : `list` of `lsst.afw.table.ReferenceMatch`
+            The matches; `lsst.afw.table.SourceMatch` if ``refCat`` is a
+            `lsst.afw.table.SourceCatalog`.
+        """
+        return list(self)
+
+    def getIds(self):
+        """Return the IDs of the matched records.
+
+        Returns
+        -------
+        refIds, sourceIds : `numpy.ndarray` of `int`
+            ID of the reference object and of the source of each match.
+        """
+        refIds = readCatalogColumn(self.refCat, self.refCat.schema["id"].asKey(), self.refIndices,
+                                   dtype=np.int64)
+        sourceIds = readCatalogColumn(self.sourceCat, self.sourceCat.schema["id"].asKey(),
+                                      self.sourceIndices, dtype=np.int64)
+        return refIds, sourceIds
+
+    def refresh(self):
+        """Read the coordinate and centroid columns of the matches from the
+        catalogs again.
+        """
+        self.refRa = readCatalogColumn(self.refCat, self._refCoordKey.getRa(), self.refIndices)
+        self.refDec = readCatalogColumn(self.refCat, self._refCoordKey.getDec(), self.refIndices)
+        self.sourceRa = readCatalogColumn(self.sourceCat, self._sourceCoordKey.getRa(), self.sourceIndices)
+        self.sourceDec = readCatalogColumn(self.sourceCat, self._sourceCoordKey.getDec(), self.sourceIndices)
+        self.sourceX = readCatalogColumn(self.sourceCat, self._sourceCentroidKey.getX(), self.sourceIndices)
+        self.sourceY = readCatalogColumn(self.sourceCat, self._sourceCentroidKey.getY(), self.sourceIndices)
+
+    def subset(self, selection):
+        """Select some of the matches.
+
+        Parameters
+        ----------
+        selection : `numpy.ndarray` of `bool` or `int`, or `slice`
+            Matches to select, as for indexing a `numpy.ndarray`.
+
+        Returns
+        -------
+        matchSet : `MatchSet`
+            The selected matches, sharing the catalogs of this match set.
+        """
+        result = copy.copy(self)
+        for name in self._columnNames:
+            setattr(result, name, getattr(self, name)[selection])
+        return result
+
+    def updateDistances(self):
+        """Set the distances of the matches to the on-sky separations
+        between the reference objects and sources, in radians.
+
+        The coordinates are read from the catalogs again first.
+        """
+        self.refresh()
+        self.distances = _angularSeparation(self.refRa, self.refDec, self.sourceRa, self.sourceDec)
+
+    def getRefPixels(self, wcs):
+        """Compute the pixel positions of the reference objects.
+
+        Parameters
+        ----------
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS to use.
+
+        Returns
+        -------
+        x, y : `numpy.ndarray` of `float`
+            Pixel positions of the reference objects of the matches.
+        """
+        mapping = wcs.getTransform().getMapping()
+        pixels = mapping.applyInverse(np.array([self.refRa, self.refDec]))
+        return pixels[0], pixels[1]
+
+    def getSourceSkyPositions(self, wcs):
+        """Compute the sky positions of the source centroids.
+
+        Parameters
+        ----------
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS to use.
+
+        Returns
+        -------
+        ra, dec : `numpy.ndarray` of `float`
+            Sky positions of the sources of the matches, in radians.
+        """
+        mapping = wcs.getTransform().getMapping()
+        sky = mapping.applyForward(np.array([self.sourceX, self.sourceY]))
+        return sky[0], sky[1]
+
+    def setSourceFlag(self, key, value=True):
+        """Set a flag of the sources of the matches.
+
+        Parameters
+        ----------
+        key : `lsst.afw.table.Key`
+            Key of the flag.
+        value : `bool`, optional
+            Value to set.
+        """
+        for row in np.unique(self.sourceIndices):
+            self.sourceCat[int(row)].set(key, value)
+
+    def makeMatchStatistics(self, flags, sctrl=None):
+        """Compute statistics of the match distances.
+
+        Like `lsst.meas.astrom.makeMatchStatistics`.
+
+        Parameters
+        ----------
+        flags : `int`
+            Statistics to compute, an OR of `lsst.afw.math.Property` values.
+        sctrl : `lsst.afw.math.StatisticsControl`, optional
+            Statistics control; the default if `None`.
+
+        Returns
+        -------
+        statistics : `lsst.afw.math.Statistics`
+            Statistics of the distances.
+        """
+        return self._makeStatistics(self.distances, flags, sctrl)
+
+    def makeMatchStatisticsInPixels(self, wcs, flags, sctrl=None):
+        """Compute statistics of the pixel separations between the
+        reference objects, positioned with a WCS, and the sources.
+
+        Like `lsst.meas.astrom.makeMatchStatisticsInPixels`.
+
+        Parameters
+        ----------
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS to use.
+        flags : `int`
+            Statistics to compute, an OR of `lsst.afw.math.Property` values.
+        sctrl : `lsst.afw.math.StatisticsControl`, optional
+            Statistics control; the default if `None`.
+
+        Returns
+        -------
+        statistics : `lsst.afw.math.Statistics`
+            Statistics of the separations, in pixels.
+        """
+        refX, refY = self.getRefPixels(wcs)
+        return self._makeStatistics(np.hypot(self.sourceX - refX, self.sourceY - refY), flags, sctrl)
+
+    def makeMatchStatisticsInRadians(self, wcs, flags, sctrl=None):
+        """Compute statistics of the on-sky separations between the
+        reference objects and the sources, positioned with a WCS.
+
+        Like `lsst.meas.astrom.makeMatchStatisticsInRadians`.
+
+        Parameters
+        ----------
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS to use.
+        flags : `int`
+            Statistics to compute, an OR of `lsst.afw.math.Property` values.
+        sctrl : `lsst.afw.math.StatisticsControl`, optional
+            Statistics control; the default if `None`.
+
+        Returns
+        -------
+        statistics : `lsst.afw.math.Statistics`
+            Statistics of the separations, in radians.
+        """
+        sourceRa, sourceDec = self.getSourceSkyPositions(wcs)
+        return self._makeStatistics(_angularSeparation(self.refRa, self.refDec, sourceRa, sourceDec),
+                                    flags, sctrl)
+
+    def _makeStatistics(self, values, flags, sctrl):
+        if len(values) == 0:
+            raise RuntimeError("matchList is empty")
+        if sctrl is None:
+            sctrl = afwMath.StatisticsControl()
+        return afwMath.makeStatistics(values, flags, sctrl)
+
+    def __len__(self):
+        return len(self.refIndices)
+
+    def __getitem__(self, index):
+        try:
+            index = operator.index(index)
+        except TypeError:
+            return self.subset(index)
+        if index < -len(self) or index >= len(self):
+            raise IndexError("Match index %d out of range for %d matches" % (index, len(self)))
+        return self._matchClass(self.refCat[int(self.refIndices[index])],
+                                self.sourceCat[int(self.sourceIndices[index])],
+                                float(self.distances[index]))
+
+    def __iter__(self):
+        for refRow, sourceRow, distance in zip(self.refIndices, self.sourceIndices, self.distances):
+            yield self._matchClass(self.refCat[int(refRow)], self.sourceCat[int(sourceRow)], float(distance))
@@ -0,0 +1,74 @@
+/*
+ * LSST Data Management System
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ * See the COPYRIGHT file
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <https://www.lsstcorp.org/LegalNotices/>.
+ */
+#include "pybind11/pybind11.h"
+#include "pybind11/eigen.h"
+#include "pybind11/stl.h"
+
+#include <cstdint>
+#include <string>
+
+#include "ndarray/pybind11.h"
+
+#include "lsst/meas/astrom/PessimisticPatternSearch.h"
+
+namespace py = pybind11;
+using namespace pybind11::literals;
+
+namespace lsst {
+namespace meas {
+namespace astrom {
+namespace {
+
+template <typename IdT>
+static void declarePessimisticPatternSearch(py::module &mod, std::string const &suffix) {
+    using Class = PessimisticPatternSearch<IdT>;
+    py::class_<Class> cls(mod, ("PessimisticPatternSearch" + suffix).c_str());
+
+    cls.def(py::init<ndarray::Array<double const, 2, 2> const &, ndarray::Array<float const, 1, 1> const &,
+                     ndarray::Array<IdT const, 2, 2> const &, ndarray::Array<float const, 1, 1> const &,
+                     ndarray::Array<IdT const, 1, 1> const &,
+                     ndarray::Array<std::int64_t const, 1, 1> const &>(),
+            "referenceArray"_a, "distArray"_a, "idArray"_a, "pairDistArray"_a, "pairIdArray"_a,
+            "pairIndptrArray"_a);
+
+    // The search only reads the arrays it references, so other Python
+    // threads can run while it does.
+    cls.def("start", &Class::start, "srcPatternArray"_a, "nMatch"_a, "maxCosThetaShift"_a,
+            "maxCosRotSq"_a, "maxDistRad"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("next", &Class::next, py::call_guard<py::gil_scoped_release>());
+    cls.def("getRefCandidates", &Class::getRefCandidates);
+    cls.def("getSrcCandidates", &Class::getSrcCandidates);
+    cls.def("getShiftRotMatrix", &Class::getShiftRotMatrix, py::return_value_policy::copy);
+    cls.def("getCosShift", &Class::getCosShift);
+    cls.def("getSinRot", &Class::getSinRot);
+}
+
+}  // namespace
+
+PYBIND11_MODULE(pessimisticPatternSearch, mod) {
+    declarePessimisticPatternSearch<std::uint16_t>(mod, "U16");
+    declarePessimisticPatternSearch<std::uint32_t>(mod, "U32");
+}
+
+}  // namespace astrom
+}  // namespace meas
+}  // namespace lsst
@@ -1,4 +1,11 @@
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+import threading
+import time
+
 import numpy as np
 from scipy.optimize import least_squares
 from scipy.spatial import cKDTree
@@ -6,6 +13,9 @@ from scipy.stats import sigmaclip
 
 import lsst.pipe.base as pipeBase
 
+from .pessimisticPatternSearch import (PessimisticPatternSearchU16,
+                                       PessimisticPatternSearchU32)
+
 
 def _rotation_matrix_chi_sq(flattened_rot_matrix,
                             pattern_a,
@@ -50,6 +60,110 @@ def _rotation_matrix_chi_sq(flattened_rot_matrix,
     return diff_pattern_a_to_b.flatten() / max_dist_rad
 
 
+def _get_id_dtype(n_objects):
+    """Return the smallest unsigned integer type able to hold the ids of a
+    catalog.
+
+    Parameters
+    ----------
+    n_objects : `int`
+        Number of objects in the catalog.
+
+    Returns
+    -------
+    id_dtype : `type`
+        `numpy.uint16` for catalogs of up to 2 ** 16 objects, otherwise
+        `numpy.uint32`.
+    """
+    if n_objects <= 2 ** 16:
+        return np.uint16
+    return np.uint32
+
+
+def _stable_argsort_dist(dist_array):
+    """Return the indices that stably sort an array of distances.
+
+    Equivalent to ``dist_array.argsort(kind="mergesort")`` but faster for
+    the large pair arrays of the matcher. The bits of non-negative floats
+    sort in the same order as their values, so combining them with the
+    array index gives unique integer keys that any sort orders stably.
+
+    Parameters
+    ----------
+    dist_array : `numpy.ndarray`, (N,)
+        Non-negative float32 distances to sort.
+
+    Returns
+    -------
+    sorted_args : `numpy.ndarray`, (N,)
+        Indices sorting ``dist_array`` from smallest to largest, with equal
+        distances kept in their input order.
+    """
+    if len(dist_array) >= 2 ** 32:
+        return dist_array.argsort(kind="mergesort")
+    sort_keys = dist_array.astype(np.float32).view(np.uint32).astype(np.uint64)
+    sort_keys <<= np.uint64(32)
+    sort_keys |= np.arange(len(dist_array), dtype=np.uint64)
+    sort_keys.sort()
+    return (sort_keys & np.uint64(2 ** 32 - 1)).astype(np.int64)
+
+
+def _evict_index_cache(index_cache_dir, max_index_cache_bytes, keep_key=None,
+                       max_tmp_age_sec=3600.):
+    """Remove the least recently used indexes from an index cache until its
+    total size is below a maximum.
+
+    Indexes being written by `PessimisticPatternMatcherB._save_index` count
+    towards the total size. Those not modified for ``max_tmp_age_sec`` were
+    left by processes that were killed while saving and are always removed.
+
+    Parameters
+    ----------
+    index_cache_dir : `str`
+        Directory containing the cached indexes.
+    max_index_cache_bytes : `int`
+        Maximum total size of the cached indexes in bytes.
+    keep_key : `str`, optional
+        Key of an index that should never be removed.
+    max_tmp_age_sec : `float`, optional
+        Age in seconds after which an index being written is considered
+        abandoned.
+    """
+    index_list = []
+    tmp_bytes = 0
+    now = time.time()
+    for index_key in os.listdir(index_cache_dir):
+        index_dir = os.path.join(index_cache_dir, index_key)
+        if not os.path.isdir(index_dir):
+            continue
+        try:
+            index_bytes = sum(
+                os.path.getsize(os.path.join(index_dir, file_name))
+                for file_name in os.listdir(index_dir))
+            index_mtime = os.path.getmtime(index_dir)
+        except OSError:
+            # The index was removed or renamed by another process.
+            continue
+        if ".tmp" in index_key:
+            if now - index_mtime > max_tmp_age_sec:
+                shutil.rmtree(index_dir, ignore_errors=True)
+            else:
+                tmp_bytes += index_bytes
+            continue
+        index_list.append((index_mtime, index_bytes, index_key))
+
+    total_bytes = tmp_bytes + sum(index_bytes
+                                  for _, index_bytes, _ in index_list)
+    for _, index_bytes, index_key in sorted(index_list):
+        if total_bytes <= max_index_cache_bytes:
+            break
+        if index_key == keep_key:
+            continue
+        shutil.rmtree(os.path.join(index_cache_dir, index_key),
+                      ignore_errors=True)
+        total_bytes -= index_bytes
+
+
 class PessimisticPatternMatcherB:
     """Class implementing a pessimistic version of Optimistic Pattern Matcher
     B (OPMb) from Tabur 2007. See `DMTN-031 <http://ls.st/DMTN-031`_
@@ -61,6 +175,33 @@ class PessimisticPatternMatcherB:
         pattern matching.
     log : `lsst.log.Log`
         Logger for outputting debug info.
+    max_pair_dist_rad : `float`, optional
+        If set, only store reference pairs with a separation less than or
+        equal to this value in radians, held in per-reference compressed
+        arrays rather than dense N x (N - 1) arrays. Matching results are
+        identical to the dense index as long as this value is larger than the
+        longest source spoke plus the match tolerance. This is typically set
+        from the footprint of the source catalog.
+    index_cache_dir : `str`, optional
+        Directory in which to persist the reference pair index. If an index
+        for the same reference array and ``max_pair_dist_rad`` exists there
+        it is memory mapped instead of being rebuilt, otherwise the newly
+        built index is saved. Memory mapping lets several processes share one
+        copy of the index.
+    max_index_cache_bytes : `int`, optional
+        Maximum total size of the indexes in ``index_cache_dir``. The least
+        recently used indexes are removed when a new index is saved and the
+        cache exceeds this size. No limit is applied if `None`.
+    use_compiled_search : `bool`, optional
+        Run the shift, rotation and spoke tests of the pattern search with the
+        compiled `PessimisticPatternSearchU16` (or ``U32``) rather than in
+        Python. Both return the same candidate patterns; the Python
+        implementation is kept as the reference.
+    use_pattern_prefilter : `bool`, optional
+        Before searching for a source pattern, test if any reference object
+        has pairs of the lengths of the pattern spokes, to within the match
+        tolerance. Patterns failing this are rejected without any rotation
+        work. The test is conservative so the matches are unchanged.
 
     Notes
     -----
@@ -74,12 +215,147 @@ class PessimisticPatternMatcherB:
     DMTN #031 for more details. http://github.com/lsst-dm/dmtn-031
     """
 
-    def __init__(self, reference_array, log):
+    # Names of the arrays that make up the reference pair index. These are
+    # the files persisted in an index cache directory.
+    _index_array_names = ["_dist_array", "_id_array", "_pair_id_array",
+                          "_pair_dist_array", "_pair_indptr_array"]
+
+    def __init__(self, reference_array, log, max_pair_dist_rad=None,
+                 index_cache_dir=None, max_index_cache_bytes=None,
+                 use_compiled_search=False, use_pattern_prefilter=False):
         self._reference_array = reference_array
         self._n_reference = len(self._reference_array)
         self.log = log
+        self._max_pair_dist_rad = max_pair_dist_rad
+        # Integer type of the reference ids in the pair index.
+        self._id_dtype = _get_id_dtype(self._n_reference)
+
+        # Offsets into the flattened pair arrays for each reference object.
+        # This stays None when the dense pair arrays are used.
+        self._pair_indptr_array = None
+        # kd-tree of the reference objects, created when first needed.
+        self._ref_kdtree = None
+
+        if index_cache_dir is None or \
+           not self._load_index(index_cache_dir):
+            if self._max_pair_dist_rad is None:
+                self._build_distances_and_angles()
+            else:
+                self._build_sparse_distances_and_angles()
+
+            if index_cache_dir is not None:
+                self._save_index(index_cache_dir, max_index_cache_bytes)
+
+        # Compiled pattern searches are stateful so each thread uses its own.
+        self._use_compiled_search = use_compiled_search
+        self._thread_local = threading.local()
 
-        self._build_distances_and_angles()
+        # Spoke length occupancy of the reference objects for the pattern
+        # prefilter, created when first needed.
+        self._use_pattern_prefilter = use_pattern_prefilter
+        self._spoke_occupancy = None
+
+        # Candidate first spokes of each pattern known to fail the shift or
+        # rotation tests, and the key of the match arguments they are valid
+        # for. See `match`.
+        self._warm_start_state = (None, {})
+
+    def _get_index_key(self):
+        """Compute the key of the reference pair index in an index cache.
+
+        Returns
+        -------
+        key : `str`
+            Hash of the reference positions and the index settings.
+        """
+        key_hash = hashlib.sha1()
+        key_hash.update(np.ascontiguousarray(
+            self._reference_array, dtype=np.float64).tobytes())
+        key_hash.update(repr((self._n_reference,
+                              self._max_pair_dist_rad)).encode())
+        return key_hash.hexdigest()
+
+    def _load_index(self, index_cache_dir):
+        """Memory map a previously saved reference pair index.
+
+        Parameters
+        ----------
+        index_cache_dir : `str`
+            Directory containing the cached indexes.
+
+        Returns
+        -------
+        loaded : `bool`
+            True if an index was found and loaded.
+        """
+        index_dir = os.path.join(index_cache_dir, self._get_index_key())
+        if not os.path.isdir(index_dir):
+            return False
+        # The dense index has no offsets array.
+        required_names = [array_name for array_name in self._index_array_names
+                          if array_name != "_pair_indptr_array" or
+                          self._max_pair_dist_rad is not None]
+        try:
+            index_arrays = dict.fromkeys(self._index_array_names)
+            for array_name in required_names:
+                # A missing array is a cache miss, for instance if the index
+                # was evicted by another process while being loaded.
+                index_arrays[array_name] = np.load(
+                    os.path.join(index_dir, array_name + ".npy"),
+                    mmap_mode="r")
+            # Mark the index as recently used for the cache eviction.
+            os.utime(index_dir)
+        except FileNotFoundError:
+            # Remove what is left so the rebuilt index can be saved.
+            self.log.debug("Cached reference index in %s is incomplete; "
+                           "rebuilding it" % index_dir)
+            shutil.rmtree(index_dir, ignore_errors=True)
+            return False
+        except (OSError, ValueError) as e:
+            self.log.warn("Failed to load cached reference index from %s: %s" %
+                          (index_dir, e))
+            return False
+        for array_name, array in index_arrays.items():
+            setattr(self, array_name, array)
+        self.log.debug("Loaded cached reference index from %s" % index_dir)
+        return True
+
+    def _save_index(self, index_cache_dir, max_index_cache_bytes=None):
+        """Save the reference pair index to an index cache and evict the least
+        recently used indexes if the cache is too large.
+
+        The index is written to a temporary directory and moved into place so
+        that concurrent processes never see a partial index.
+
+        Parameters
+        ----------
+        index_cache_dir : `str`
+            Directory containing the cached indexes.
+        max_index_cache_bytes : `int`, optional
+            Maximum total size of the cached indexes.
+        """
+        index_key = self._get_index_key()
+        index_dir = os.path.join(index_cache_dir, index_key)
+        tmp_dir = "%s.tmp%i" % (index_dir, os.getpid())
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for array_name in self._index_array_names:
+                array = getattr(self, array_name)
+                if array is not None:
+                    np.save(os.path.join(tmp_dir, array_name + ".npy"), array)
+            os.rename(tmp_dir, index_dir)
+        except OSError as e:
+            # Another process may have saved the same index first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(index_dir):
+                self.log.warn("Failed to save reference index to %s: %s" %
+                              (index_dir, e))
+                return
+        self.log.debug("Saved reference index to %s" % index_dir)
+
+        if max_index_cache_bytes is not None:
+            _evict_index_cache(index_cache_dir, max_index_cache_bytes,
+                               keep_key=index_key)
 
     def _build_distances_and_angles(self):
         """Create the data structures we will use to search for our pattern
@@ -90,79 +366,201 @@ class PessimisticPatternMatcherB:
         'index' into the arrays sorted on distance.
         """
 
-        # Initialize the arrays we will need for quick look up of pairs once
-        # have a candidate spoke center.
-        self._pair_id_array = np.empty(
-            (self._n_reference, self._n_reference - 1),
-            dtype=np.uint16)
-        self._pair_dist_array = np.empty(
-            (self._n_reference, self._n_reference - 1),
-            dtype=np.float32)
-
-        # Create empty lists to temporarily store our pair information per
-        # reference object. These will be concatenated into our final arrays.
-        sub_id_array_list = []
-        sub_dist_array_list = []
-
-        # Loop over reference objects storing pair distances and ids.
-        for ref_id, ref_obj in enumerate(self._reference_array):
-
-            # Reserve and fill the ids of each reference object pair.
-            # 16 bit is safe for the id array as the catalog input from
-            # MatchPessimisticB is limited to a max length of 2 ** 16.
-            sub_id_array = np.zeros((self._n_reference - 1 - ref_id, 2),
-                                    dtype=np.uint16)
-            sub_id_array[:, 0] = ref_id
-            sub_id_array[:, 1] = np.arange(ref_id + 1, self._n_reference,
-                                           dtype=np.uint16)
+        n_pairs = self._n_reference * (self._n_reference - 1) // 2
+        ref_id_array = np.arange(self._n_reference, dtype=self._id_dtype)
+
+        # Reserve the arrays of unique reference pairs, those with the first
+        # id smaller than the second. The ids are 16 bit unless the catalog
+        # has more than 2 ** 16 objects.
+        unsorted_id_array = np.empty((n_pairs, 2), dtype=self._id_dtype)
+        unsorted_dist_array = np.empty(n_pairs, dtype=np.float32)
+
+        # Compute the pair distances in blocks of reference objects to bound
+        # the size of the temporary arrays. Pairs are stored in row major
+        # order of their ids.
+        block_size = max(1, 2 ** 22 // max(1, self._n_reference))
+        pair_idx = 0
+        for start_id in range(0, self._n_reference, block_size):
+            end_id = min(start_id + block_size, self._n_reference)
+            block_ids = ref_id_array[start_id:end_id]
+            # Only objects from the start of the block onward can be the
+            # second member of a pair.
+            upper_mask = (ref_id_array[np.newaxis, start_id:] >
+                          block_ids[:, np.newaxis])
+            block_pair_rows, block_pair_cols = np.nonzero(upper_mask)
+            block_n_pairs = len(block_pair_rows)
 
             # Compute the vector deltas for each pair of reference objects.
             # Compute and store the distances.
-            sub_delta_array = (self._reference_array[ref_id + 1:, :] -
-                               ref_obj).astype(np.float32)
-            sub_dist_array = np.sqrt(sub_delta_array[:, 0] ** 2 +
-                                     sub_delta_array[:, 1] ** 2 +
-                                     sub_delta_array[:, 2] ** 2)
-
-            # Append to our arrays to the output lists for later
-            # concatenation.
-            sub_id_array_list.append(sub_id_array)
-            sub_dist_array_list.append(sub_dist_array)
-
-            # Fill the pair look up arrays row wise and then column wise.
-            self._pair_id_array[ref_id, ref_id:] = sub_id_array[:, 1]
-            self._pair_dist_array[ref_id, ref_id:] = sub_dist_array
-
-            # Don't fill the array column wise if we are on the last as
-            # these pairs have already been filled by previous
-            # iterations.
-            if ref_id < self._n_reference - 1:
-                self._pair_id_array[ref_id + 1:, ref_id] = ref_id
-                self._pair_dist_array[ref_id + 1:, ref_id] = sub_dist_array
-
-            # Sort each row on distance for fast look up of pairs given
-            # the id of one of the objects in the pair.
-            sorted_pair_dist_args = self._pair_dist_array[ref_id, :].argsort()
-            self._pair_dist_array[ref_id, :] = self._pair_dist_array[
-                ref_id, sorted_pair_dist_args]
-            self._pair_id_array[ref_id, :] = self._pair_id_array[
-                ref_id, sorted_pair_dist_args]
-
-        # Concatenate our arrays together.
-        unsorted_id_array = np.concatenate(sub_id_array_list)
-        unsorted_dist_array = np.concatenate(sub_dist_array_list)
+            block_delta_array = (
+                self._reference_array[np.newaxis, start_id:, :] -
+                self._reference_array[start_id:end_id, np.newaxis, :]).astype(
+                    np.float32)
+            block_dist_array = np.sqrt(block_delta_array[:, :, 0] ** 2 +
+                                       block_delta_array[:, :, 1] ** 2 +
+                                       block_delta_array[:, :, 2] ** 2)
+            unsorted_dist_array[pair_idx:pair_idx + block_n_pairs] = \
+                block_dist_array[block_pair_rows, block_pair_cols]
+            unsorted_id_array[pair_idx:pair_idx + block_n_pairs, 0] = \
+                block_ids[block_pair_rows]
+            unsorted_id_array[pair_idx:pair_idx + block_n_pairs, 1] = \
+                block_pair_cols + start_id
+            pair_idx += block_n_pairs
 
         # Sort each array on the pair distances for the initial
         # optimistic pattern matcher lookup.
-        sorted_dist_args = unsorted_dist_array.argsort()
+        sorted_dist_args = _stable_argsort_dist(unsorted_dist_array)
         self._dist_array = unsorted_dist_array[sorted_dist_args]
         self._id_array = unsorted_id_array[sorted_dist_args]
+        del unsorted_dist_array, unsorted_id_array, sorted_dist_args
+
+        # Create the arrays we will need for quick look up of pairs once we
+        # have a candidate spoke center. Each pair appears in the rows of
+        # both of its members. Grouping the distance sorted pairs by row with
+        # a stable sort leaves each row sorted on distance, with equal
+        # distances in id order.
+        sorted_row_args = self._id_array.ravel().argsort(kind="stable")
+        self._pair_id_array = self._id_array[:, ::-1].ravel()[
+            sorted_row_args].reshape(
+                (self._n_reference, self._n_reference - 1))
+        self._pair_dist_array = np.repeat(self._dist_array, 2)[
+            sorted_row_args].reshape(
+                (self._n_reference, self._n_reference - 1))
 
         return None
 
+    def _build_sparse_distances_and_angles(self):
+        """Create the data structures we will use to search for our pattern
+        match in, storing only those pairs with separations less than or equal
+        to ``max_pair_dist_rad``.
+
+        The per reference object pair look up arrays are stored flattened
+        with the pairs of reference object ``ref_id`` occupying the range
+        ``_pair_indptr_array[ref_id]:_pair_indptr_array[ref_id + 1]``. Within
+        that range pairs are sorted on distance, as in the dense arrays.
+        """
+        # Find all pairs within the maximum distance. The pairs are sorted
+        # by their first and then second id to mirror the ordering of the
+        # dense construction before the stable distance sorts below.
+        pair_ids = self._get_ref_kdtree().query_pairs(self._max_pair_dist_rad,
+                                                      output_type="ndarray")
+        pair_ids = pair_ids[np.lexsort((pair_ids[:, 1], pair_ids[:, 0]))]
+
+        # Compute the pair distances exactly as the dense construction does
+        # so that both produce identical look up arrays.
+        pair_delta_array = (self._reference_array[pair_ids[:, 1], :] -
+                            self._reference_array[pair_ids[:, 0], :]).astype(
+                                np.float32)
+        pair_dist_array = np.sqrt(pair_delta_array[:, 0] ** 2 +
+                                  pair_delta_array[:, 1] ** 2 +
+                                  pair_delta_array[:, 2] ** 2)
+
+        # Sort on the pair distances for the initial optimistic pattern
+        # matcher lookup.
+        sorted_dist_args = _stable_argsort_dist(pair_dist_array)
+        self._dist_array = pair_dist_array[sorted_dist_args]
+        self._id_array = pair_ids[sorted_dist_args].astype(self._id_dtype)
+
+        # Each pair appears twice in the per object look up, once for each
+        # of its members. Grouping the distance sorted pairs by object with a
+        # stable sort leaves the pairs of each object sorted on distance,
+        # with equal distances in id order.
+        row_array = self._id_array.ravel()
+        sorted_row_args = row_array.argsort(kind="stable")
+        self._pair_id_array = self._id_array[:, ::-1].ravel()[sorted_row_args]
+        self._pair_dist_array = np.repeat(self._dist_array, 2)[sorted_row_args]
+        self._pair_indptr_array = np.zeros(self._n_reference + 1,
+                                           dtype=np.int64)
+        self._pair_indptr_array[1:] = np.cumsum(
+            np.bincount(row_array, minlength=self._n_reference))
+
+        return None
+
+    def _get_ref_kdtree(self):
+        """Return the kd-tree of the reference objects, building it on first
+        use.
+
+        Returns
+        -------
+        ref_kdtree : `scipy.spatial.cKDTree`
+            kd-tree of the reference 3 vectors.
+        """
+        if self._ref_kdtree is None:
+            self._ref_kdtree = cKDTree(self._reference_array)
+        return self._ref_kdtree
+
+    def _get_reference_pairs(self, ref_id):
+        """Return the sorted pair distances and ids of a reference object.
+
+        Parameters
+        ----------
+        ref_id : `int`
+            Id of the reference object in the reference array.
+
+        Returns
+        -------
+        ref_dist_array : `numpy.ndarray`, (N,)
+            Distances between ``ref_id`` and its paired reference objects
+            sorted from smallest to largest.
+        ref_id_array : `numpy.ndarray`, (N,)
+            Ids of the objects paired with ``ref_id``.
+        """
+        if self._pair_indptr_array is None:
+            return self._pair_dist_array[ref_id], self._pair_id_array[ref_id]
+        start_idx = self._pair_indptr_array[ref_id]
+        end_idx = self._pair_indptr_array[ref_id + 1]
+        return (self._pair_dist_array[start_idx:end_idx],
+                self._pair_id_array[start_idx:end_idx])
+
+    def _get_pattern_search(self):
+        """Return the compiled pattern search of the calling thread, creating
+        it on first use.
+
+        Returns
+        -------
+        pattern_search : `PessimisticPatternSearchU16` or `PessimisticPatternSearchU32`
+            Search referencing the arrays of the reference pair index.
+        """
+        pattern_search = getattr(self._thread_local, "pattern_search", None)
+        if pattern_search is None:
+            pattern_search = self._make_pattern_search()
+            self._thread_local.pattern_search = pattern_search
+        return pattern_search
+
+    def _make_pattern_search(self):
+        """Create the compiled pattern search over the reference pair index.
+
+        Returns
+        -------
+        pattern_search : `PessimisticPatternSearchU16` or `PessimisticPatternSearchU32`
+            Search referencing the arrays of the reference pair index.
+        """
+        if self._id_array.dtype == np.uint16:
+            search_class = PessimisticPatternSearchU16
+        else:
+            search_class = PessimisticPatternSearchU32
+        # The dense per reference object arrays are passed flattened, as the
+        # sparse arrays are stored.
+        if self._pair_indptr_array is None:
+            pair_indptr_array = ((self._n_reference - 1) *
+                                 np.arange(self._n_reference + 1,
+                                           dtype=np.int64))
+        else:
+            pair_indptr_array = self._pair_indptr_array
+        return search_class(
+            np.ascontiguousarray(self._reference_array, dtype=np.float64),
+            np.ascontiguousarray(self._dist_array, dtype=np.float32),
+            np.ascontiguousarray(self._id_array),
+            np.ascontiguousarray(self._pair_dist_array,
+                                 dtype=np.float32).ravel(),
+            np.ascontiguousarray(self._pair_id_array,
+                                 dtype=self._id_array.dtype).ravel(),
+            np.ascontiguousarray(pair_indptr_array, dtype=np.int64))
+
     def match(self, source_array, n_check, n_match, n_agree,
               max_n_patterns, max_shift, max_rotation, max_dist,
-              min_matches, pattern_skip_array=None):
+              min_matches, pattern_skip_array=None, n_workers=1,
+              warm_start=False, log=None):
         """Match a given source catalog into the loaded reference catalog.
 
         Given array of points on the unit sphere and tolerances, we
@@ -205,6 +603,22 @@ class PessimisticPatternMatcherB:
             This assumes the ordering of the source objects is the same
             between different runs of the matcher which, assuming no object
             has been inserted or the magnitudes have changed, it should be.
+        n_workers : `int`, optional
+            Number of threads constructing candidate patterns concurrently.
+            The pattern matched is the same as for the serial search, with
+            the candidates tested in order of their pattern index. This is
+            most effective with ``use_compiled_search``, which runs without
+            holding the GIL.
+        warm_start : `bool`, optional
+            Record the candidate first spokes of each pattern that fail the
+            shift or rotation tests, which do not depend on ``max_dist``,
+            and skip them in later calls with the same sources, ``n_check``,
+            ``max_shift`` and ``max_rotation``. This speeds up repeated
+            calls that only loosen ``max_dist``. The records are reset when
+            any of these change. Only the Python pattern search uses them.
+        log : `lsst.log.Log`, optional
+            Log to write to; the log of the matcher if `None`. Matchers may
+            be shared by several tasks, which pass their own log here.
 
         Returns
         -------
@@ -221,6 +635,9 @@ class PessimisticPatternMatcherB:
               objects in arcseconds. None if no match found (`float`).
         """
 
+        if log is None:
+            log = self.log
+
         # Given our input source_array we sort on magnitude.
         sorted_source_array = source_array[source_array[:, -1].argsort(), :3]
         n_source = len(sorted_source_array)
@@ -234,48 +651,58 @@ class PessimisticPatternMatcherB:
             max_dist_rad=None,)
 
         if n_source <= 0:
-            self.log.warn("Source object array is empty. Unable to match. "
-                          "Exiting matcher.")
+            log.warn("Source object array is empty. Unable to match. "
+                     "Exiting matcher.")
             return None
 
         # To test if the shifts and rotations we find agree with each other,
         # we first create two test points situated at the top and bottom of
         # where the z axis on the sphere bisects the source catalog.
-        test_vectors = self._compute_test_vectors(source_array[:, :3])
+        test_vectors = self._compute_test_vectors(source_array[:, :3],
+                                                  log=log)
 
         # We now create an empty list of our resultant rotated vectors to
         # compare the different rotations we find.
         rot_vect_list = []
 
+        # kd-tree of the sources for the final verify step, built the first
+        # time a pattern reaches it.
+        src_kdtree = None
+
         # Convert the tolerances to values we will use in the code.
         max_cos_shift = np.cos(np.radians(max_shift / 3600.))
         max_cos_rot_sq = np.cos(np.radians(max_rotation)) ** 2
         max_dist_rad = np.radians(max_dist / 3600.)
 
-        # Loop through the sources from brightest to faintest, grabbing a
-        # chunk of n_check each time.
-        for pattern_idx in range(np.min((max_n_patterns,
-                                         n_source - n_match))):
+        # If only a radius bounded set of reference pairs is stored, check
+        # that the spokes of every pattern we may create are covered by it.
+        # Twice the largest distance from the center of the pattern sources
+        # bounds the length of any spoke.
+        if self._max_pair_dist_rad is not None:
+            pattern_sources = sorted_source_array[:max_n_patterns + n_check]
+            center_vect = np.mean(pattern_sources, axis=0)
+            center_vect /= np.sqrt(np.dot(center_vect, center_vect))
+            max_spoke_dist = 2 * np.max(np.sqrt(
+                np.sum((pattern_sources - center_vect) ** 2, axis=1)))
+            if max_spoke_dist + max_dist_rad > self._max_pair_dist_rad:
+                log.warn("Source patterns may be larger than the maximum "
+                         "reference pair distance. Some matches may be "
+                         "missed.")
 
-            # If this pattern is one that we matched on the past but we
-            # now want to skip, we do so here.
-            if pattern_skip_array is not None and \
-               np.any(pattern_skip_array == pattern_idx):
-                self.log.debug(
-                    "Skipping previously matched bad pattern %i..." %
-                    pattern_idx)
-                continue
-            # Grab the sources to attempt to create this pattern.
-            pattern = sorted_source_array[
-                pattern_idx: np.min((pattern_idx + n_check, n_source)), :3]
-
-            # Construct a pattern given the number of points defining the
-            # pattern complexity. This is the start of the primary tests to
-            # match our source pattern into the reference objects.
-            construct_return_struct = \
-                self._construct_pattern_and_shift_rot_matrix(
-                    pattern, n_match, max_cos_shift, max_cos_rot_sq,
-                    max_dist_rad)
+        # Loop through the sources from brightest to faintest, grabbing a
+        # chunk of n_check each time. The patterns are constructed in
+        # order of their index, possibly several at a time, and tested
+        # against each other and verified one after another below.
+        n_patterns = np.min((max_n_patterns, n_source - n_match))
+        rejected_candidates = None
+        if warm_start:
+            rejected_candidates = self._get_rejected_candidates(
+                sorted_source_array, n_check, max_cos_shift, max_cos_rot_sq)
+        for pattern_idx, construct_return_struct in self._construct_patterns(
+                sorted_source_array, n_patterns, n_check, n_match,
+                max_cos_shift, max_cos_rot_sq, max_dist_rad,
+                pattern_skip_array, n_workers, rejected_candidates,
+                log=log):
 
             # Our struct is None if we could not match the pattern.
             if construct_return_struct.ref_candidates is None or \
@@ -312,15 +739,21 @@ class PessimisticPatternMatcherB:
 
             # Test if we have enough rotations, which agree, or if we
             # are in optimistic mode.
-            if self._test_rotation_agreement(rot_vect_list, max_dist_rad) < \
+            if self._test_rotation_agreement(rot_vect_list, max_dist_rad,
+                                             log=log) < \
                n_agree - 1:
                 continue
 
             # Run the final verify step.
+            # The source kd-tree is shared by all the patterns that reach
+            # the final verify.
+            if src_kdtree is None:
+                src_kdtree = cKDTree(source_array[:, :3])
             match_struct = self._final_verify(source_array[:, :3],
                                               shift_rot_matrix,
                                               max_dist_rad,
-                                              min_matches)
+                                              min_matches,
+                                              src_kdtree)
             if match_struct.match_ids is None or \
                match_struct.distances_rad is None or \
                match_struct.max_dist_rad is None:
@@ -329,10 +762,10 @@ class PessimisticPatternMatcherB:
             # Convert the observed shift to arcseconds
             shift = np.degrees(np.arccos(cos_shift)) * 3600.
             # Print information to the logger.
-            self.log.debug("Succeeded after %i patterns." % pattern_idx)
-            self.log.debug("\tShift %.4f arcsec" % shift)
-            self.log.debug("\tRotation: %.4f deg" %
-                           np.degrees(np.arcsin(sin_rot)))
+            log.debug("Succeeded after %i patterns." % pattern_idx)
+            log.debug("\tShift %.4f arcsec" % shift)
+            log.debug("\tRotation: %.4f deg" %
+                      np.degrees(np.arcsin(sin_rot)))
 
             # Fill the struct and return.
             output_match_struct.match_ids = \
@@ -344,10 +777,141 @@ class PessimisticPatternMatcherB:
             output_match_struct.max_dist_rad = match_struct.max_dist_rad
             return output_match_struct
 
-        self.log.debug("Failed after %i patterns." % (pattern_idx + 1))
+        log.debug("Failed after %i patterns." % n_patterns)
         return output_match_struct
 
-    def _compute_test_vectors(self, source_array):
+    def _construct_patterns(self, sorted_source_array, n_patterns, n_check,
+                            n_match, max_cos_shift, max_cos_rot_sq,
+                            max_dist_rad, pattern_skip_array, n_workers,
+                            rejected_candidates=None, log=None):
+        """Construct the candidate patterns of the sources in order of their
+        pattern index.
+
+        With more than one worker, blocks of ``n_workers`` patterns are
+        constructed concurrently in a thread pool. The patterns are still
+        yielded in order of their index so the caller sees the same sequence
+        as the serial search.
+
+        Parameters
+        ----------
+        sorted_source_array : `numpy.ndarray`, (N, 3)
+            3 vectors of the sources sorted from brightest to faintest.
+        n_patterns : `int`
+            Number of patterns to construct.
+        n_check : `int`
+            Number of sources to create a pattern from.
+        n_match : `int`
+            Number of objects to use in constructing a pattern to match.
+        max_cos_shift : `float`
+            Maximum shift allowed between two patterns' centers.
+        max_cos_rot_sq : `float`
+            Maximum rotation between two patterns that have been shifted
+            to have their centers on top of each other.
+        max_dist_rad : `float`
+            Maximum delta distance allowed between the source and reference
+            pair distances.
+        pattern_skip_array : `numpy.ndarray` or `None`
+            Pattern indices to skip.
+        n_workers : `int`
+            Number of patterns to construct concurrently.
+        rejected_candidates : `dict` or `None`, optional
+            Sets of the candidate first spokes known to fail the shift or
+            rotation tests, keyed by pattern index. Updated with those found
+            while constructing the patterns.
+        log : `lsst.log.Log`, optional
+            Log to write to; the log of the matcher if `None`.
+
+        Yields
+        ------
+        pattern_idx : `int`
+            Index of the pattern.
+        construct_return_struct : `lsst.pipe.base.Struct`
+            Result of `_construct_pattern_and_shift_rot_matrix` for the
+            pattern.
+        """
+        if log is None:
+            log = self.log
+        n_source = len(sorted_source_array)
+        pattern_idx_list = []
+        for pattern_idx in range(n_patterns):
+            # If this pattern is one that we matched on the past but we
+            # now want to skip, we do so here.
+            if pattern_skip_array is not None and \
+               np.any(pattern_skip_array == pattern_idx):
+                log.debug(
+                    "Skipping previously matched bad pattern %i..." %
+                    pattern_idx)
+                continue
+            pattern_idx_list.append(pattern_idx)
+
+        def construct_pattern(pattern_idx):
+            # Grab the sources to attempt to create this pattern.
+            pattern = sorted_source_array[
+                pattern_idx: np.min((pattern_idx + n_check, n_source)), :3]
+
+            pattern_rejected_candidates = None
+            if rejected_candidates is not None:
+                pattern_rejected_candidates = \
+                    rejected_candidates.setdefault(pattern_idx, set())
+
+            # Construct a pattern given the number of points defining the
+            # pattern complexity. This is the start of the primary tests to
+            # match our source pattern into the reference objects.
+            return self._construct_pattern_and_shift_rot_matrix(
+                pattern, n_match, max_cos_shift, max_cos_rot_sq, max_dist_rad,
+                pattern_rejected_candidates)
+
+        if n_workers <= 1:
+            for pattern_idx in pattern_idx_list:
+                yield pattern_idx, construct_pattern(pattern_idx)
+            return
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for block_start in range(0, len(pattern_idx_list), n_workers):
+                block_idx_list = \
+                    pattern_idx_list[block_start:block_start + n_workers]
+                yield from zip(block_idx_list,
+                               executor.map(construct_pattern, block_idx_list))
+
+    def _get_rejected_candidates(self, sorted_source_array, n_check,
+                                 max_cos_shift, max_cos_rot_sq):
+        """Return the records of the candidate first spokes failing the
+        shift or rotation tests for a set of match arguments.
+
+        The records are kept between calls to `match` and reset when the
+        arguments change.
+
+        Parameters
+        ----------
+        sorted_source_array : `numpy.ndarray`, (N, 3)
+            3 vectors of the sources sorted from brightest to faintest.
+        n_check : `int`
+            Number of sources to create a pattern from.
+        max_cos_shift : `float`
+            Maximum shift allowed between two patterns' centers.
+        max_cos_rot_sq : `float`
+            Maximum rotation between two patterns that have been shifted
+            to have their centers on top of each other.
+
+        Returns
+        -------
+        rejected_candidates : `dict`
+            Sets of the candidate first spokes known to fail the tests,
+            keyed by pattern index.
+        """
+        source_hash = hashlib.sha1(
+            np.ascontiguousarray(sorted_source_array).tobytes())
+        warm_start_key = (source_hash.hexdigest(), n_check, max_cos_shift,
+                          max_cos_rot_sq)
+        # The key and records are stored together so that concurrent calls
+        # never use records made for other arguments.
+        state = self._warm_start_state
+        if state[0] != warm_start_key:
+            state = (warm_start_key, {})
+            self._warm_start_state = state
+        return state[1]
+
+    def _compute_test_vectors(self, source_array, log=None):
         """Compute spherical 3 vectors at the edges of the x, y, z extent
         of the input source catalog.
 
@@ -356,6 +920,8 @@ class PessimisticPatternMatcherB:
         source_array : `numpy.ndarray`, (N, 3)
             array of 3 vectors representing positions on the unit
             sphere.
+        log : `lsst.log.Log`, optional
+            Log to write to; the log of the matcher if `None`.
 
         Returns
         -------
@@ -366,10 +932,12 @@ class PessimisticPatternMatcherB:
             when the code is running in pessimistic mode.
         """
 
+        if log is None:
+            log = self.log
         # Get the center of source_array.
         if np.any(np.logical_not(np.isfinite(source_array))):
-            self.log.warn("Input source objects contain non-finite values. "
-                          "This could end badly.")
+            log.warn("Input source objects contain non-finite values. "
+                     "This could end badly.")
         center_vect = np.nanmean(source_array, axis=0)
 
         # So that our rotation test works over the full sky we compute
@@ -401,7 +969,8 @@ class PessimisticPatternMatcherB:
 
     def _construct_pattern_and_shift_rot_matrix(self, src_pattern_array,
                                                 n_match, max_cos_theta_shift,
-                                                max_cos_rot_sq, max_dist_rad):
+                                                max_cos_rot_sq, max_dist_rad,
+                                                rejected_candidates=None):
         """Test an input source pattern against the reference catalog.
 
         Returns the candidate matched patterns and their
@@ -424,6 +993,11 @@ class PessimisticPatternMatcherB:
             pair distances to consider the reference pair a candidate for
             the source pair. Also sets the tolerance between the opening
             angles of the spokes when compared to the reference.
+        rejected_candidates : `set` or `None`, optional
+            Candidate first spokes, as ``2 * ref_dist_idx + pair_idx``, known
+            to fail the shift or rotation tests for this pattern. These are
+            skipped and any others failing the tests are added. Not used by
+            the compiled search.
 
         Return
         -------
@@ -473,6 +1047,18 @@ class PessimisticPatternMatcherB:
                                  src_delta_array[:, 1]**2 +
                                  src_delta_array[:, 2]**2)
 
+        # Reject patterns whose spoke lengths no reference pattern center
+        # can provide before doing any rotation work.
+        if self._use_pattern_prefilter and \
+           not self._test_pattern_prefilter(src_dist_array, n_match,
+                                            max_dist_rad):
+            return output_matched_pattern
+
+        if self._use_compiled_search:
+            return self._construct_pattern_and_shift_rot_matrix_compiled(
+                src_pattern_array, n_match, max_cos_theta_shift,
+                max_cos_rot_sq, max_dist_rad, output_matched_pattern)
+
         # Our first test. We search the reference dataset for pairs
         # that have the same length as our first source pairs to with
         # plus/minus the max_dist tolerance.
@@ -486,6 +1072,10 @@ class PessimisticPatternMatcherB:
             # over and test both possibilities.
             tmp_ref_pair_list = self._id_array[ref_dist_idx]
             for pair_idx, ref_id in enumerate(tmp_ref_pair_list):
+                candidate_key = 2 * int(ref_dist_idx) + pair_idx
+                if rejected_candidates is not None and \
+                   candidate_key in rejected_candidates:
+                    continue
                 src_candidates = [0, 1]
                 ref_candidates = []
                 shift_rot_matrix = None
@@ -497,6 +1087,8 @@ class PessimisticPatternMatcherB:
                 ref_center = self._reference_array[ref_id]
                 cos_shift = np.dot(src_pattern_array[0], ref_center)
                 if cos_shift < max_cos_theta_shift:
+                    if rejected_candidates is not None:
+                        rejected_candidates.add(candidate_key)
                     continue
 
                 # We can now append this one as a candidate.
@@ -524,6 +1116,8 @@ class PessimisticPatternMatcherB:
                 if test_rot_struct.cos_rot_sq is None or \
                    test_rot_struct.proj_ref_ctr_delta is None or \
                    test_rot_struct.shift_matrix is None:
+                    if rejected_candidates is not None:
+                        rejected_candidates.add(candidate_key)
                     continue
 
                 # Get the data from the return struct.
@@ -534,8 +1128,8 @@ class PessimisticPatternMatcherB:
                 # Now that we have a candidate first spoke and reference
                 # pattern center, we mask our future search to only those
                 # pairs that contain our candidate reference center.
-                tmp_ref_dist_array = self._pair_dist_array[ref_id]
-                tmp_ref_id_array = self._pair_id_array[ref_id]
+                tmp_ref_dist_array, tmp_ref_id_array = \
+                    self._get_reference_pairs(ref_id)
 
                 # Now we feed this sub data to match the spokes of
                 # our pattern.
@@ -594,6 +1188,198 @@ class PessimisticPatternMatcherB:
 
         return output_matched_pattern
 
+    def _construct_pattern_and_shift_rot_matrix_compiled(
+            self, src_pattern_array, n_match, max_cos_theta_shift,
+            max_cos_rot_sq, max_dist_rad, output_matched_pattern):
+        """Test an input source pattern against the reference catalog using
+        the compiled pattern search.
+
+        The compiled search returns the candidate patterns passing the shift,
+        rotation and spoke tests in the same order as
+        `_construct_pattern_and_shift_rot_matrix`. The intermediate verify
+        step is run here.
+
+        Parameters
+        ----------
+        src_pattern_array : `numpy.ndarray`, (N, 3)
+            Sub selection of source 3 vectors to create a pattern from
+        n_match : `int`
+            Number of points to attempt to create a pattern from.
+        max_cos_theta_shift : `float`
+            Maximum shift allowed between two patterns' centers.
+        max_cos_rot_sq : `float`
+            Maximum rotation between two patterns that have been shifted
+            to have their centers on top of each other.
+        max_dist_rad : `float`
+            Maximum delta distance allowed between the source and reference
+            pair distances.
+        output_matched_pattern : `lsst.pipe.base.Struct`
+            Empty result struct to fill.
+
+        Returns
+        -------
+        output_matched_pattern : `lsst.pipe.base.Struct`
+            Result struct, as returned by
+            `_construct_pattern_and_shift_rot_matrix`.
+        """
+        pattern_search = self._get_pattern_search()
+        pattern_search.start(
+            np.ascontiguousarray(src_pattern_array, dtype=np.float64),
+            n_match, max_cos_theta_shift, max_cos_rot_sq, max_dist_rad)
+        while pattern_search.next():
+            ref_candidates = pattern_search.getRefCandidates()
+            src_candidates = pattern_search.getSrcCandidates()
+            fit_shift_rot_matrix = self._intermediate_verify(
+                src_pattern_array[src_candidates],
+                self._reference_array[ref_candidates],
+                pattern_search.getShiftRotMatrix(), max_dist_rad)
+            if fit_shift_rot_matrix is not None:
+                output_matched_pattern.ref_candidates = ref_candidates
+                output_matched_pattern.src_candidates = src_candidates
+                output_matched_pattern.shift_rot_matrix = fit_shift_rot_matrix
+                output_matched_pattern.cos_shift = pattern_search.getCosShift()
+                output_matched_pattern.sin_rot = pattern_search.getSinRot()
+                return output_matched_pattern
+
+        return output_matched_pattern
+
+    def _get_spoke_occupancy(self, max_dist_rad):
+        """Return the spoke length occupancy of the reference objects for a
+        spoke length tolerance, building it if needed.
+
+        The pair lengths of the reference index are divided into bins of the
+        width of the tolerance. The occupancy lists the (reference id, bin)
+        combinations holding the length of at least one pair of the
+        reference object, encoded as ``id * n_bins + bin`` and sorted. It is
+        rebuilt when the tolerance drops below half the bin width, as in the
+        next match and fit iteration; the loosening of the softening
+        iterations only widens the ranges of bins tested.
+
+        Parameters
+        ----------
+        max_dist_rad : `float`
+            Tolerance on the spoke lengths in radians.
+
+        Returns
+        -------
+        bin_width : `float`
+            Width of the length bins in radians.
+        n_bins : `int`
+            Number of length bins.
+        occupancy : `numpy.ndarray`, (M,)
+            Sorted codes of the occupied (reference id, bin) combinations.
+        """
+        spoke_occupancy = self._spoke_occupancy
+        if spoke_occupancy is None or max_dist_rad < 0.5 * spoke_occupancy[0]:
+            max_dist = 0.
+            if len(self._dist_array) > 0:
+                max_dist = float(self._dist_array[-1])
+            bin_width = max_dist_rad if max_dist_rad > 0 else max(max_dist, 1.)
+            n_bins = int(np.floor(max_dist / bin_width)) + 1
+            # The pairs of each reference object are sorted on distance in the
+            # per object look up arrays, so the codes are already sorted and
+            # only the repeats need removing. This is done in blocks of
+            # pairs to bound the size of the temporary arrays.
+            pair_dist_array = self._pair_dist_array.ravel()
+            if self._pair_indptr_array is None:
+                pair_indptr_array = (np.arange(self._n_reference + 1) *
+                                     (self._n_reference - 1))
+            else:
+                pair_indptr_array = self._pair_indptr_array
+            block_size = 2 ** 22
+            block_codes = []
+            last_code = -1
+            for start_idx in range(0, len(pair_dist_array), block_size):
+                end_idx = start_idx + block_size
+                bins = np.floor(pair_dist_array[start_idx:end_idx].astype(
+                    np.float64) / bin_width).astype(np.int64)
+                rows = np.searchsorted(
+                    pair_indptr_array,
+                    np.arange(start_idx, start_idx + len(bins)),
+                    side='right').astype(np.int64) - 1
+                codes = rows * n_bins + bins
+                new_mask = np.empty(len(codes), dtype=bool)
+                new_mask[0] = codes[0] != last_code
+                np.not_equal(codes[1:], codes[:-1], out=new_mask[1:])
+                block_codes.append(codes[new_mask])
+                last_code = codes[-1]
+            spoke_occupancy = (bin_width, n_bins,
+                               np.concatenate(block_codes)
+                               if block_codes else np.empty(0, np.int64))
+            self._spoke_occupancy = spoke_occupancy
+        return spoke_occupancy
+
+    def _test_pattern_prefilter(self, src_dist_array, n_match, max_dist_rad):
+        """Test if any candidate reference pattern center has pairs of the
+        lengths needed to match a source pattern.
+
+        This is a necessary condition for the pattern search to succeed: the
+        center must be in a reference pair matching the first spoke and have
+        pairs matching at least ``n_match - 2`` of the other spokes. Pair
+        lengths are compared using the quantized spoke length occupancy of
+        the reference objects, so the test never rejects a pattern the search
+        could match.
+
+        Parameters
+        ----------
+        src_dist_array : `numpy.ndarray`, (N,)
+            Lengths of the spokes of the source pattern in radians.
+        n_match : `int`
+            Number of points in a matched pattern.
+        max_dist_rad : `float`
+            Tolerance on the spoke lengths in radians.
+
+        Returns
+        -------
+        plausible : `bool`
+            False if no reference pattern can match the source pattern.
+        """
+        # The tolerance is padded slightly to cover rounding differences in
+        # the spoke lengths.
+        pad_dist_rad = max_dist_rad * (1 + 1e-6)
+
+        # Find the candidate pattern centers from the first spoke, as the
+        # search does.
+        start_idx = np.searchsorted(self._dist_array,
+                                    src_dist_array[0] - pad_dist_rad)
+        end_idx = np.searchsorted(self._dist_array,
+                                  src_dist_array[0] + pad_dist_rad,
+                                  side='right')
+        if start_idx >= end_idx:
+            return False
+        if n_match <= 2:
+            return True
+        # Sorted center ids give sorted occupancy queries, which are faster.
+        ctr_ids = np.unique(self._id_array[start_idx:end_idx]).astype(np.int64)
+
+        # Count the spokes for which each candidate center has a pair in one
+        # of the length bins within tolerance, dropping the centers that can
+        # no longer reach n_match - 2 spokes.
+        bin_width, n_bins, occupancy = self._get_spoke_occupancy(max_dist_rad)
+        min_bins = np.clip(
+            np.floor((src_dist_array[1:] - pad_dist_rad) / bin_width),
+            0, n_bins - 1).astype(np.int64)
+        max_bins = np.clip(
+            np.floor((src_dist_array[1:] + pad_dist_rad) / bin_width),
+            0, n_bins - 1).astype(np.int64)
+        ctr_codes = ctr_ids * n_bins
+        n_spokes = np.zeros(len(ctr_codes), dtype=np.int64)
+        n_needed = n_match - 2
+        n_remaining = len(min_bins)
+        for min_bin, max_bin in zip(min_bins, max_bins):
+            n_spokes += (np.searchsorted(occupancy, ctr_codes + max_bin,
+                                         side='right') >
+                         np.searchsorted(occupancy, ctr_codes + min_bin))
+            n_remaining -= 1
+            if np.any(n_spokes >= n_needed):
+                return True
+            keep = n_spokes + n_remaining >= n_needed
+            ctr_codes = ctr_codes[keep]
+            n_spokes = n_spokes[keep]
+            if len(ctr_codes) == 0:
+                return False
+        return False
+
     def _find_candidate_reference_pairs(self, src_dist, ref_dist_array,
                                         max_dist_rad):
         """Wrap numpy.searchsorted to find the range of reference spokes
@@ -639,9 +1425,10 @@ class PessimisticPatternMatcherB:
 
         # Now we sort the indices from smallest absolute delta dist difference
         # to the largest and return the vector. This step greatly increases
-        # the speed of the algorithm.
+        # the speed of the algorithm. A stable sort keeps equal differences
+        # in distance order, as the compiled pattern search does.
         tmp_diff_array = np.fabs(ref_dist_array[start_idx:end_idx] - src_dist)
-        return tmp_diff_array.argsort() + start_idx
+        return tmp_diff_array.argsort(kind="stable") + start_idx
 
     def _test_rotation(self, src_center, ref_center, src_delta, ref_delta,
                        cos_shift, max_cos_rot_sq):
@@ -936,55 +1723,64 @@ class PessimisticPatternMatcherB:
             return an int id into the master reference array.
         """
 
-        # Loop over our candidate reference objects.
-        for ref_dist_idx in ref_dist_idx_array:
-            # Compute the delta vector from the pattern center.
-            ref_delta = (self._reference_array[ref_id_array[ref_dist_idx]] -
-                         ref_ctr)
-            # Compute the cos between our "center" reference vector and the
-            # current reference candidate.
-            proj_ref_delta = ref_delta - np.dot(ref_delta, ref_ctr) * ref_ctr
-            geom_dist_ref = np.sqrt(proj_ref_ctr_dist_sq *
-                                    np.dot(proj_ref_delta, proj_ref_delta))
-            cos_theta_ref = (np.dot(proj_ref_delta, proj_ref_ctr_delta) /
-                             geom_dist_ref)
-
-            # Make sure we can safely make the comparison in case
-            # our "center" and candidate vectors are mostly aligned.
-            if cos_theta_ref ** 2 < (1 - src_sin_tol ** 2):
-                cos_sq_comparison = ((cos_theta_src - cos_theta_ref) ** 2 /
-                                     (1 - cos_theta_ref ** 2))
-            else:
-                cos_sq_comparison = ((cos_theta_src - cos_theta_ref) ** 2 /
-                                     src_sin_tol ** 2)
-            # Test the difference of the cosine of the reference angle against
-            # the source angle. Assumes that the delta between the two is
-            # small.
-            if cos_sq_comparison > src_sin_tol ** 2:
-                continue
-
-            # The cosine tests the magnitude of the angle but not
-            # its direction. To do that we need to know the sine as well.
-            # This cross product calculation does that.
-            cross_ref = (np.cross(proj_ref_delta, proj_ref_ctr_delta) /
-                         geom_dist_ref)
-            sin_theta_ref = np.dot(cross_ref, ref_ctr)
-
-            # Check the value of the cos again to make sure that it is not
-            # near zero.
-            if abs(cos_theta_src) < src_sin_tol:
-                sin_comparison = (sin_theta_src - sin_theta_ref) / src_sin_tol
-            else:
-                sin_comparison = \
-                    (sin_theta_src - sin_theta_ref) / cos_theta_ref
-
-            if abs(sin_comparison) > src_sin_tol:
-                continue
+        if len(ref_dist_idx_array) == 0:
+            return None
 
-            # Return the correct id of the candidate we found.
-            return ref_id_array[ref_dist_idx]
+        # Compute the delta vectors from the pattern center for all of our
+        # candidate reference objects at once.
+        ref_ids = ref_id_array[ref_dist_idx_array]
+        ref_delta_array = self._reference_array[ref_ids] - ref_ctr
+        # Compute the cos between our "center" reference vector and the
+        # current reference candidates.
+        proj_ref_delta_array = (
+            ref_delta_array -
+            np.dot(ref_delta_array, ref_ctr)[:, np.newaxis] * ref_ctr)
+        geom_dist_ref_array = np.sqrt(
+            proj_ref_ctr_dist_sq *
+            np.sum(proj_ref_delta_array ** 2, axis=1))
+        cos_theta_ref_array = (np.dot(proj_ref_delta_array, proj_ref_ctr_delta) /
+                               geom_dist_ref_array)
+
+        # Make sure we can safely make the comparison in case
+        # our "center" and candidate vectors are mostly aligned. Both
+        # branches are evaluated for all candidates so we silence the
+        # divisions by zero in the branch that is not used.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_sq_comparison_array = np.where(
+                cos_theta_ref_array ** 2 < (1 - src_sin_tol ** 2),
+                (cos_theta_src - cos_theta_ref_array) ** 2 /
+                (1 - cos_theta_ref_array ** 2),
+                (cos_theta_src - cos_theta_ref_array) ** 2 / src_sin_tol ** 2)
+
+        # The cosine tests the magnitude of the angle but not
+        # its direction. To do that we need to know the sine as well.
+        # This cross product calculation does that.
+        cross_ref_array = (np.cross(proj_ref_delta_array, proj_ref_ctr_delta) /
+                           geom_dist_ref_array[:, np.newaxis])
+        sin_theta_ref_array = np.dot(cross_ref_array, ref_ctr)
+
+        # Check the value of the cos again to make sure that it is not
+        # near zero.
+        if abs(cos_theta_src) < src_sin_tol:
+            sin_comparison_array = \
+                (sin_theta_src - sin_theta_ref_array) / src_sin_tol
+        else:
+            sin_comparison_array = \
+                (sin_theta_src - sin_theta_ref_array) / cos_theta_ref_array
+
+        # Test the difference of the cosine of the reference angle against
+        # the source angle, assuming that the delta between the two is small,
+        # and then the sine. The comparisons are negated so that candidates
+        # are rejected exactly when the comparisons fail.
+        passed_array = np.logical_not(np.logical_or(
+            cos_sq_comparison_array > src_sin_tol ** 2,
+            np.fabs(sin_comparison_array) > src_sin_tol))
+        if not np.any(passed_array):
+            return None
 
-        return None
+        # Return the id of the first candidate that passed, the one with the
+        # smallest difference in spoke length.
+        return ref_ids[np.argmax(passed_array)]
 
     def _create_shift_rot_matrix(self, cos_rot_sq, shift_matrix, src_delta,
                                  ref_ctr, ref_delta):
@@ -1155,7 +1951,7 @@ class PessimisticPatternMatcherB:
             np.logical_and((1 - max_dist_rad) ** 2 < dists,
                            dists < (1 + max_dist_rad) ** 2))
 
-    def _test_rotation_agreement(self, rot_vects, max_dist_rad):
+    def _test_rotation_agreement(self, rot_vects, max_dist_rad, log=None):
         """ Test this rotation against the previous N found and return
         the number that a agree within tolerance to where our test
         points are.
@@ -1169,6 +1965,8 @@ class PessimisticPatternMatcherB:
         max_dist_rad : `float`
             maximum distance in radians to consider two points "agreeing" on
             a rotation
+        log : `lsst.log.Log`, optional
+            Log to write to; the log of the matcher if `None`.
 
         Returns
         -------
@@ -1177,8 +1975,10 @@ class PessimisticPatternMatcherB:
             test 3 vectors.
         """
 
-        self.log.debug("Comparing pattern %i to previous %i rotations..." %
-                       (rot_vects[-1][-1], len(rot_vects) - 1))
+        if log is None:
+            log = self.log
+        log.debug("Comparing pattern %i to previous %i rotations..." %
+                  (rot_vects[-1][-1], len(rot_vects) - 1))
 
         tot_consent = 0
         for rot_idx in range(max((len(rot_vects) - 1), 0)):
@@ -1196,7 +1996,8 @@ class PessimisticPatternMatcherB:
                       source_array,
                       shift_rot_matrix,
                       max_dist_rad,
-                      min_matches):
+                      min_matches,
+                      src_kdtree=None):
         """Match the all sources into the reference catalog using the shift/rot
         matrix.
 
@@ -1217,6 +2018,8 @@ class PessimisticPatternMatcherB:
         min_matches : `int`
             Minimum number of matched objects required to consider the
             match good.
+        src_kdtree : `scipy.spatial.cKDTree`, optional
+            kd-tree of ``source_array``. Built here if not given.
 
         Returns
         -------
@@ -1237,9 +2040,13 @@ class PessimisticPatternMatcherB:
             max_dist_rad=None,
         )
 
+        if src_kdtree is None:
+            src_kdtree = cKDTree(source_array)
+
         # Perform an iterative final verify.
         match_sources_struct = self._match_sources(source_array,
-                                                   shift_rot_matrix)
+                                                   shift_rot_matrix,
+                                                   src_kdtree)
         cut_ids = match_sources_struct.match_ids[
             match_sources_struct.distances_rad < max_dist_rad]
 
@@ -1266,7 +2073,7 @@ class PessimisticPatternMatcherB:
 
         # Redo the matching using the newly fit shift/rotation matrix.
         match_sources_struct = self._match_sources(
-            source_array, fit_shift_rot_matrix)
+            source_array, fit_shift_rot_matrix, src_kdtree)
 
         # Double check the match distances to make sure enough matches
         # survive still. We'll just overwrite the previously used variables.
@@ -1327,7 +2134,8 @@ class PessimisticPatternMatcherB:
 
     def _match_sources(self,
                        source_array,
-                       shift_rot_matrix):
+                       shift_rot_matrix,
+                       src_kdtree=None):
         """ Shift both the reference and source catalog to the the respective
         frames and find their nearest neighbor using a kdTree.
 
@@ -1343,6 +2151,8 @@ class PessimisticPatternMatcherB:
         shift_rot_matrix : `numpy.ndarray`, (3, 3)
             3x3 rotation matrix that performs the spherical rotation from the
             source frame into the reference frame.
+        src_kdtree : `scipy.spatial.cKDTree`, optional
+            kd-tree of ``source_array``. Built here if not given.
 
         Returns
         -------
@@ -1363,23 +2173,28 @@ class PessimisticPatternMatcherB:
             shift_rot_matrix,
             source_array.transpose()).transpose()
 
+        # The match arrays hold both source and reference ids.
+        id_dtype = _get_id_dtype(max(len(shifted_references),
+                                     len(shifted_sources)))
         ref_matches = np.empty((len(shifted_references), 2),
-                               dtype=np.uint16)
+                               dtype=id_dtype)
         src_matches = np.empty((len(shifted_sources), 2),
-                               dtype=np.uint16)
+                               dtype=id_dtype)
 
         ref_matches[:, 1] = np.arange(len(shifted_references),
-                                      dtype=np.uint16)
+                                      dtype=id_dtype)
         src_matches[:, 0] = np.arange(len(shifted_sources),
-                                      dtype=np.uint16)
+                                      dtype=id_dtype)
 
-        ref_kdtree = cKDTree(self._reference_array)
-        src_kdtree = cKDTree(source_array)
+        # The trees are built on the unrotated points, so each is queried
+        # with the other catalog rotated into its frame.
+        if src_kdtree is None:
+            src_kdtree = cKDTree(source_array)
 
         ref_to_src_dist, tmp_ref_to_src_idx = \
             src_kdtree.query(shifted_references)
         src_to_ref_dist, tmp_src_to_ref_idx = \
-            ref_kdtree.query(shifted_sources)
+            self._get_ref_kdtree().query(shifted_sources)
 
         ref_matches[:, 0] = tmp_ref_to_src_idx
         src_matches[:, 1] = tmp_src_to_ref_idx
@@ -1401,16 +2216,13 @@ class PessimisticPatternMatcherB:
             rotated reference objects matched into the sources.
         matches_ref : `numpy.ndarray`, (N, 2)
             int array of nearest neighbor matches between shifted and
-            rotated source objects matched into the references.
+            rotated source objects matched into the references. Row i must
+            hold the match of reference object i.
         Return
         ------
         handshake_mask_array : `numpy.ndarray`, (N,)
            Return the array positions where the two match catalogs agree.
         """
-        handshake_mask_array = np.zeros(len(matches_src), dtype=np.bool)
-
-        for src_match_idx, match in enumerate(matches_src):
-            ref_match_idx = np.searchsorted(matches_ref[:, 1], match[1])
-            if match[0] == matches_ref[ref_match_idx, 0]:
-                handshake_mask_array[src_match_idx] = True
-        return handshake_mask_array
+        # As the reference matches are ordered by reference id we can look
+        # up the source matched to each source's reference directly.
+        return matches_ref[matches_src[:, 1], 0] == matches_src[:, 0]
@@ -33,6 +33,7 @@ from lsst.meas.algorithms import ReferenceSourceSelectorTask
 from lsst.meas.algorithms.sourceSelector import sourceSelectorRegistry
 from .matchPessimisticB import MatchPessimisticBTask
 from .display import displayAstrometry
+from .matchSet import MatchSet
 from . import makeMatchStatistics
 
 
@@ -207,7 +208,7 @@ class RefMatchTask(pipeBase.Task):
 
         Parameters
         ----------
-        matchList : `list` of `lsst.afw.table.ReferenceMatch`
+        matchList : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
             list of matches between reference object and sources;
             the distance field is the only field read and it must be set to distance in radians
 
@@ -222,7 +223,10 @@ class RefMatchTask(pipeBase.Task):
             - ``maxMatchDist`` : distMean + self.config.matchDistanceSigma *
               distStdDev (`float`)
         """
-        distStatsInRadians = makeMatchStatistics(matchList, afwMath.MEANCLIP | afwMath.STDEVCLIP)
+        if isinstance(matchList, MatchSet):
+            distStatsInRadians = matchList.makeMatchStatistics(afwMath.MEANCLIP | afwMath.STDEVCLIP)
+        else:
+            distStatsInRadians = makeMatchStatistics(matchList, afwMath.MEANCLIP | afwMath.STDEVCLIP)
         distMean = distStatsInRadians.getValue(afwMath.MEANCLIP)*lsst.geom.radians
         distStdDev = distStatsInRadians.getValue(afwMath.STDEVCLIP)*lsst.geom.radians
         return pipeBase.Struct(
@@ -49,13 +49,21 @@ static void declareOutlierRejectionControl(py::module& mod) {
 static void declareScaledPolynomialTransformFitter(py::module& mod) {
     py::class_<ScaledPolynomialTransformFitter> cls(mod, "ScaledPolynomialTransformFitter");
 
-    cls.def_static("fromMatches", &ScaledPolynomialTransformFitter::fromMatches);
-    cls.def_static("fromGrid", &ScaledPolynomialTransformFitter::fromGrid);
-    cls.def("fit", &ScaledPolynomialTransformFitter::fit, "order"_a = -1);
-    cls.def("updateModel", &ScaledPolynomialTransformFitter::updateModel);
-    cls.def("updateIntrinsicScatter", &ScaledPolynomialTransformFitter::updateIntrinsicScatter);
+    // Construction and the fitting steps only touch the fitter and its inputs, so other Python
+    // threads, including ones fitting other catalogs, can run while they do.
+    cls.def_static("fromMatches", &ScaledPolynomialTransformFitter::fromMatches,
+                   py::call_guard<py::gil_scoped_release>());
+    cls.def_static("fromGrid", &ScaledPolynomialTransformFitter::fromGrid,
+                   py::call_guard<py::gil_scoped_release>());
+    cls.def("fit", &ScaledPolynomialTransformFitter::fit, "order"_a = -1,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("updateModel", &ScaledPolynomialTransformFitter::updateModel,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("updateIntrinsicScatter", &ScaledPolynomialTransformFitter::updateIntrinsicScatter,
+            py::call_guard<py::gil_scoped_release>());
     cls.def("getIntrinsicScatter", &ScaledPolynomialTransformFitter::getIntrinsicScatter);
-    cls.def("rejectOutliers", &ScaledPolynomialTransformFitter::rejectOutliers, "ctrl"_a);
+    cls.def("rejectOutliers", &ScaledPolynomialTransformFitter::rejectOutliers, "ctrl"_a,
+            py::call_guard<py::gil_scoped_release>());
     cls.def("getData", &ScaledPolynomialTransformFitter::getData,
             py::return_value_policy::reference_internal);
     cls.def("getTransform", &ScaledPolynomialTransformFitter::getTransform, py::return_value_policy::copy);
@@ -23,6 +23,7 @@
 __all__ = ["setMatchDistance"]
 
 import lsst.afw.table as afwTable
+from .matchSet import MatchSet
 
 
 def setMatchDistance(matches):
@@ -31,7 +32,7 @@ def setMatchDistance(matches):
 
     Parameters
     ----------
-    matches : `list` of `lsst.afw.table.ReferenceMatch`
+    matches : `list` of `lsst.afw.table.ReferenceMatch` or `MatchSet`
         a list of matches, reads the coord field of the source and reference
         object of each match writes the distance field of each match
 
@@ -43,6 +44,10 @@ def setMatchDistance(matches):
     if len(matches) < 1:
         return
 
+    if isinstance(matches, MatchSet):
+        matches.updateDistances()
+        return
+
     sourceCoordKey = afwTable.CoordKey(matches[0].first.schema["coord"])
     refObjCoordKey = afwTable.CoordKey(matches[0].second.schema["coord"])
     for match in matches:
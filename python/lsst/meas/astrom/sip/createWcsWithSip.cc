@@ -46,9 +46,11 @@ template <typename MatchT>
 static void declareCreateWcsWithSip(py::module &mod, std::string const &name) {
     py::class_<CreateWcsWithSip<MatchT>, std::shared_ptr<CreateWcsWithSip<MatchT>>> cls(mod, name.c_str());
 
+    // Fitting only reads the matches and the WCS, so other Python threads can run while it does.
     cls.def(py::init<std::vector<MatchT> const &, afw::geom::SkyWcs const &, int const, geom::Box2I const &,
                      int const>(),
-            "matches"_a, "linearWcs"_a, "order"_a, "bbox"_a = geom::Box2I(), "ngrid"_a = 0);
+            "matches"_a, "linearWcs"_a, "order"_a, "bbox"_a = geom::Box2I(), "ngrid"_a = 0,
+            py::call_guard<py::gil_scoped_release>());
 
     cls.def("getNewWcs", &CreateWcsWithSip<MatchT>::getNewWcs);
     cls.def("getScatterInPixels", &CreateWcsWithSip<MatchT>::getScatterInPixels);
@@ -64,7 +66,7 @@ static void declareCreateWcsWithSip(py::module &mod, std::string const &name) {
     cls.def("getSipBp", &CreateWcsWithSip<MatchT>::getSipBp, py::return_value_policy::copy);
 
     mod.def("makeCreateWcsWithSip", &makeCreateWcsWithSip<MatchT>, "matches"_a, "linearWcs"_a, "order"_a,
-            "bbox"_a = geom::Box2I(), "ngrid"_a = 0);
+            "bbox"_a = geom::Box2I(), "ngrid"_a = 0, py::call_guard<py::gil_scoped_release>());
 }
 
 }  // namespace
@@ -0,0 +1,338 @@
+// -*- LSST-C++ -*-
+
+/*
+ * LSST Data Management System
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ * See the COPYRIGHT file
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <https://www.lsstcorp.org/LegalNotices/>.
+ */
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <sstream>
+
+#include "Eigen/Geometry"
+
+#include "lsst/pex/exceptions.h"
+#include "lsst/meas/astrom/PessimisticPatternSearch.h"
+
+namespace lsst {
+namespace meas {
+namespace astrom {
+
+namespace {
+
+/*
+ * Find the entries of a sorted distance array within maxDistRad of dist.
+ *
+ * The indices are returned sorted on their absolute
+ * difference in distance, smallest first, with ties kept in array order.
+ */
+void findCandidatePairs(float const* distArray, std::size_t nDist, double dist, double maxDistRad,
+                        std::vector<std::size_t>& candidates) {
+    candidates.clear();
+    double const minDist = dist - maxDistRad;
+    double const maxDist = dist + maxDistRad;
+    float const* begin = std::lower_bound(distArray, distArray + nDist, minDist,
+                                          [](float value, double bound) { return value < bound; });
+    float const* end = std::upper_bound(distArray, distArray + nDist, maxDist,
+                                        [](double bound, float value) { return bound < value; });
+    if (begin >= end) {
+        return;
+    }
+    std::size_t const startIdx = begin - distArray;
+    std::size_t const nCandidates = end - begin;
+    std::vector<double> diffs(nCandidates);
+    candidates.resize(nCandidates);
+    for (std::size_t i = 0; i < nCandidates; ++i) {
+        diffs[i] = std::fabs(static_cast<double>(distArray[startIdx + i]) - dist);
+        candidates[i] = i;
+    }
+    std::stable_sort(candidates.begin(), candidates.end(),
+                     [&diffs](std::size_t a, std::size_t b) { return diffs[a] < diffs[b]; });
+    for (auto& candidate : candidates) {
+        candidate += startIdx;
+    }
+}
+
+/*
+ * Generalized 3D rotation matrix about the axis rotAxis.
+ */
+Eigen::Matrix3d makeSphericalRotationMatrix(Eigen::Vector3d const& rotAxis, double cosRotation,
+                                            double sinRotation) {
+    Eigen::Matrix3d rotCrossMatrix;
+    rotCrossMatrix << 0., -rotAxis[2], rotAxis[1], rotAxis[2], 0., -rotAxis[0], -rotAxis[1], rotAxis[0], 0.;
+    return cosRotation * Eigen::Matrix3d::Identity() + sinRotation * rotCrossMatrix +
+           (1. - cosRotation) * rotAxis * rotAxis.transpose();
+}
+
+/*
+ * Sign of a value, propagating NaN as numpy.sign does.
+ */
+double sign(double value) {
+    if (std::isnan(value)) {
+        return value;
+    }
+    return (value > 0) - (value < 0);
+}
+
+}  // namespace
+
+template <typename IdT>
+PessimisticPatternSearch<IdT>::PessimisticPatternSearch(
+        ndarray::Array<double const, 2, 2> const& referenceArray,
+        ndarray::Array<float const, 1, 1> const& distArray, ndarray::Array<IdT const, 2, 2> const& idArray,
+        ndarray::Array<float const, 1, 1> const& pairDistArray,
+        ndarray::Array<IdT const, 1, 1> const& pairIdArray,
+        ndarray::Array<std::int64_t const, 1, 1> const& pairIndptrArray)
+        : _referenceArray(referenceArray),
+          _distArray(distArray),
+          _idArray(idArray),
+          _pairDistArray(pairDistArray),
+          _pairIdArray(pairIdArray),
+          _pairIndptrArray(pairIndptrArray),
+          _nMatch(0),
+          _maxCosThetaShift(0.),
+          _maxCosRotSq(0.),
+          _maxDistRad(0.),
+          _candidateIdx(0),
+          _pairIdx(0),
+          _shiftRotMatrix(Eigen::Matrix3d::Identity()),
+          _cosShift(std::numeric_limits<double>::quiet_NaN()),
+          _sinRot(std::numeric_limits<double>::quiet_NaN()) {
+    std::size_t const nReference = _referenceArray.template getSize<0>();
+    if (_referenceArray.template getSize<1>() != 3) {
+        throw LSST_EXCEPT(pex::exceptions::LengthError, "referenceArray must have shape (N, 3)");
+    }
+    if (_idArray.template getSize<1>() != 2 ||
+        _idArray.template getSize<0>() != _distArray.template getSize<0>()) {
+        std::ostringstream os;
+        os << "idArray must have shape (" << _distArray.template getSize<0>() << ", 2)";
+        throw LSST_EXCEPT(pex::exceptions::LengthError, os.str());
+    }
+    if (_pairIdArray.template getSize<0>() != _pairDistArray.template getSize<0>()) {
+        throw LSST_EXCEPT(pex::exceptions::LengthError,
+                          "pairIdArray and pairDistArray must have the same length");
+    }
+    if (_pairIndptrArray.template getSize<0>() != nReference + 1 ||
+        _pairIndptrArray[nReference] != static_cast<std::int64_t>(_pairIdArray.template getSize<0>())) {
+        std::ostringstream os;
+        os << "pairIndptrArray must have length " << nReference + 1 << " and end at "
+           << _pairIdArray.template getSize<0>();
+        throw LSST_EXCEPT(pex::exceptions::LengthError, os.str());
+    }
+}
+
+template <typename IdT>
+void PessimisticPatternSearch<IdT>::start(ndarray::Array<double const, 2, 2> const& srcPatternArray,
+                                          int nMatch, double maxCosThetaShift, double maxCosRotSq,
+                                          double maxDistRad) {
+    std::size_t const nSrc = srcPatternArray.template getSize<0>();
+    if (nSrc < 2 || srcPatternArray.template getSize<1>() != 3) {
+        throw LSST_EXCEPT(pex::exceptions::LengthError,
+                          "srcPatternArray must have shape (N, 3) with N >= 2");
+    }
+    _nMatch = nMatch;
+    _maxCosThetaShift = maxCosThetaShift;
+    _maxCosRotSq = maxCosRotSq;
+    _maxDistRad = maxDistRad;
+
+    // Create the delta vectors and distances we will need to assemble the
+    // spokes of the pattern.
+    _srcPattern.resize(nSrc);
+    for (std::size_t i = 0; i < nSrc; ++i) {
+        _srcPattern[i] = Eigen::Map<Eigen::Vector3d const>(srcPatternArray.getData() + 3 * i);
+    }
+    _srcDelta.resize(nSrc - 1);
+    _srcDist.resize(nSrc - 1);
+    for (std::size_t i = 0; i < nSrc - 1; ++i) {
+        _srcDelta[i] = _srcPattern[i + 1] - _srcPattern[0];
+        _srcDist[i] = _srcDelta[i].norm();
+    }
+
+    // Search the reference pairs for those that have the same length as our
+    // first source spoke.
+    findCandidatePairs(_distArray.getData(), _distArray.template getSize<0>(), _srcDist[0], _maxDistRad,
+                       _candidates);
+    _candidateIdx = 0;
+    _pairIdx = 0;
+    _refCandidates.clear();
+    _srcCandidates.clear();
+}
+
+template <typename IdT>
+bool PessimisticPatternSearch<IdT>::next() {
+    // Each candidate pair is tested with both of its members as the center
+    // of the reference pattern.
+    while (_candidateIdx < _candidates.size()) {
+        std::size_t const refDistIdx = _candidates[_candidateIdx];
+        int const pairIdx = _pairIdx;
+        if (++_pairIdx > 1) {
+            _pairIdx = 0;
+            ++_candidateIdx;
+        }
+        if (_testCandidate(refDistIdx, pairIdx)) {
+            return true;
+        }
+    }
+    return false;
+}
+
+template <typename IdT>
+bool PessimisticPatternSearch<IdT>::_testCandidate(std::size_t refDistIdx, int pairIdx) {
+    IdT const* refPair = _idArray.getData() + 2 * refDistIdx;
+    IdT const refId = refPair[pairIdx];
+    IdT const otherId = refPair[1 - pairIdx];
+    double const* refData = _referenceArray.getData();
+
+    // Test the angle between our candidate ref center and the source center
+    // of our pattern. This angular distance also defines the shift.
+    Eigen::Vector3d const refCtr = Eigen::Map<Eigen::Vector3d const>(refData + 3 * refId);
+    double const cosShift = _srcPattern[0].dot(refCtr);
+    if (cosShift < _maxCosThetaShift) {
+        return false;
+    }
+    Eigen::Vector3d const refDelta = Eigen::Map<Eigen::Vector3d const>(refData + 3 * otherId) - refCtr;
+
+    // Compute the shift matrix and test the rotation this pair implies.
+    double const clippedCosShift = std::min(std::max(cosShift, -1.), 1.);
+    double const sinShift = std::sqrt(1 - clippedCosShift * clippedCosShift);
+    Eigen::Matrix3d shiftMatrix = Eigen::Matrix3d::Identity();
+    if (sinShift > 0) {
+        Eigen::Vector3d const rotAxis = _srcPattern[0].cross(refCtr) / sinShift;
+        shiftMatrix = makeSphericalRotationMatrix(rotAxis, clippedCosShift, sinShift);
+    }
+    Eigen::Vector3d const rotSrcDelta = shiftMatrix * _srcDelta[0];
+    Eigen::Vector3d const projSrcDelta = rotSrcDelta - rotSrcDelta.dot(refCtr) * refCtr;
+    Eigen::Vector3d const projRefDelta = refDelta - refDelta.dot(refCtr) * refCtr;
+    double const projDot = projSrcDelta.dot(projRefDelta);
+    double const cosRotSq =
+            projDot * projDot / (projSrcDelta.squaredNorm() * projRefDelta.squaredNorm());
+    if (cosRotSq < _maxCosRotSq) {
+        return false;
+    }
+
+    _refCandidates.assign({static_cast<int>(refId), static_cast<int>(otherId)});
+    _srcCandidates.assign({0, 1});
+    if (!_createPatternSpokes(refId, refCtr, projRefDelta)) {
+        return false;
+    }
+
+    // Create the full rotation matrix for both the shift and rotation.
+    double const cosRot = std::sqrt(cosRotSq);
+    double const deltaDotCross = rotSrcDelta.cross(refDelta).dot(refCtr);
+    _sinRot = sign(deltaDotCross) * std::sqrt(1 - cosRotSq);
+    _shiftRotMatrix = makeSphericalRotationMatrix(refCtr, cosRot, _sinRot) * shiftMatrix;
+    _cosShift = cosShift;
+    return true;
+}
+
+template <typename IdT>
+bool PessimisticPatternSearch<IdT>::_createPatternSpokes(IdT refCtrId, Eigen::Vector3d const& refCtr,
+                                                         Eigen::Vector3d const& projRefCtrDelta) {
+    int const nSpokes = _nMatch - 2;
+    Eigen::Vector3d const& srcCtr = _srcPattern[0];
+    double const* refData = _referenceArray.getData();
+    std::int64_t const pairBegin = _pairIndptrArray[refCtrId];
+    std::int64_t const pairEnd = _pairIndptrArray[refCtrId + 1];
+    float const* refDistArray = _pairDistArray.getData() + pairBegin;
+    IdT const* refIdArray = _pairIdArray.getData() + pairBegin;
+    std::vector<std::size_t> refDistIdxArray;
+
+    // Plane project the first spoke of both patterns using the pattern
+    // centers as normal.
+    Eigen::Vector3d const projSrcCtrDelta = _srcDelta[0] - _srcDelta[0].dot(srcCtr) * srcCtr;
+    double const projSrcCtrDistSq = projSrcCtrDelta.squaredNorm();
+    double const projRefCtrDistSq = projRefCtrDelta.squaredNorm();
+
+    int nFail = 0;
+    int nFound = 0;
+    int const nSrcDist = _srcDist.size();
+    for (int srcIdx = 1; srcIdx < nSrcDist; ++srcIdx) {
+        if (nFail > nSrcDist - (_nMatch - 1)) {
+            break;
+        }
+
+        // Tolerance on the opening angle of the spoke, capped where the
+        // small angle approximation stops holding.
+        double const maxSinTol = 0.0447;
+        double const srcSinTol = std::min(_maxDistRad / (_srcDist[srcIdx] + _maxDistRad), maxSinTol);
+        double const srcSinTolSq = srcSinTol * srcSinTol;
+
+        // Cosine and sine of the opening angle of the source spoke.
+        Eigen::Vector3d const projSrcDelta = _srcDelta[srcIdx] - _srcDelta[srcIdx].dot(srcCtr) * srcCtr;
+        double const geomDistSrc = std::sqrt(projSrcDelta.squaredNorm() * projSrcCtrDistSq);
+        double const cosThetaSrc = projSrcDelta.dot(projSrcCtrDelta) / geomDistSrc;
+        double const sinThetaSrc = (projSrcDelta.cross(projSrcCtrDelta) / geomDistSrc).dot(srcCtr);
+
+        findCandidatePairs(refDistArray, pairEnd - pairBegin, _srcDist[srcIdx], _maxDistRad,
+                           refDistIdxArray);
+
+        // Test the candidate spokes from the smallest difference in length
+        // and keep the first one that has the same opening angle.
+        bool found = false;
+        for (std::size_t refDistIdx : refDistIdxArray) {
+            IdT const refId = refIdArray[refDistIdx];
+            Eigen::Vector3d const refDelta = Eigen::Map<Eigen::Vector3d const>(refData + 3 * refId) - refCtr;
+            Eigen::Vector3d const projRefDelta = refDelta - refDelta.dot(refCtr) * refCtr;
+            double const geomDistRef = std::sqrt(projRefCtrDistSq * projRefDelta.squaredNorm());
+            double const cosThetaRef = projRefDelta.dot(projRefCtrDelta) / geomDistRef;
+
+            double const cosDelta = cosThetaSrc - cosThetaRef;
+            double cosSqComparison;
+            if (cosThetaRef * cosThetaRef < (1 - srcSinTolSq)) {
+                cosSqComparison = cosDelta * cosDelta / (1 - cosThetaRef * cosThetaRef);
+            } else {
+                cosSqComparison = cosDelta * cosDelta / srcSinTolSq;
+            }
+
+            double const sinThetaRef = (projRefDelta.cross(projRefCtrDelta) / geomDistRef).dot(refCtr);
+            double sinComparison;
+            if (std::fabs(cosThetaSrc) < srcSinTol) {
+                sinComparison = (sinThetaSrc - sinThetaRef) / srcSinTol;
+            } else {
+                sinComparison = (sinThetaSrc - sinThetaRef) / cosThetaRef;
+            }
+
+            // Written as the negation of the failure condition so that NaN
+            // comparisons behave as in the Python implementation.
+            if (!(cosSqComparison > srcSinTolSq || std::fabs(sinComparison) > srcSinTol)) {
+                _refCandidates.push_back(refId);
+                _srcCandidates.push_back(srcIdx + 1);
+                found = true;
+                break;
+            }
+        }
+        if (!found) {
+            ++nFail;
+            continue;
+        }
+        if (++nFound >= nSpokes) {
+            return true;
+        }
+    }
+    return nFound >= nSpokes;
+}
+
+template class PessimisticPatternSearch<std::uint16_t>;
+template class PessimisticPatternSearch<std::uint32_t>;
+
+}  // namespace astrom
+}  // namespace meas
+}  // namespace lsst
@@ -33,6 +33,70 @@ namespace lsst {
 namespace meas {
 namespace astrom {
 
+namespace {
+
+// The powers of the inputs of PolynomialTransform::operator() and linearize
+// are computed in local workspaces, so const member functions may be called
+// from several threads at once. These are called for every point, so the
+// workspaces are on the stack for polynomials up to this order.
+int const MAX_STACK_ORDER = 15;
+
+using StackPowers = Eigen::Matrix<double, Eigen::Dynamic, 1, 0, MAX_STACK_ORDER + 1, 1>;
+
+template <typename Powers>
+geom::Point2D applyPolynomials(ndarray::Array<double, 2, 2> const& xCoeffs,
+                               ndarray::Array<double, 2, 2> const& yCoeffs, geom::Point2D const& in) {
+    int const order = xCoeffs.getSize<0>() - 1;
+    Powers u(order + 1);
+    Powers v(order + 1);
+    detail::computePowers(u, in.getX());
+    detail::computePowers(v, in.getY());
+    double x = 0;
+    double y = 0;
+    for (int p = 0; p <= order; ++p) {
+        for (int q = 0; q <= order; ++q) {
+            x += xCoeffs(p, q) * u[p] * v[q];
+            y += yCoeffs(p, q) * u[p] * v[q];
+        }
+    }
+    return geom::Point2D(x, y);
+}
+
+template <typename Powers>
+geom::AffineTransform linearizePolynomials(ndarray::Array<double, 2, 2> const& xCoeffs,
+                                           ndarray::Array<double, 2, 2> const& yCoeffs,
+                                           geom::Point2D const& in) {
+    double xu = 0.0, xv = 0.0, yu = 0.0, yv = 0.0, x = 0.0, y = 0.0;
+    int const order = xCoeffs.getSize<0>() - 1;
+    Powers u(order + 1);
+    Powers v(order + 1);
+    detail::computePowers(u, in.getX());
+    detail::computePowers(v, in.getY());
+    for (int p = 0; p <= order; ++p) {
+        for (int q = 0; q <= order; ++q) {
+            if (p > 0) {
+                xu += xCoeffs(p, q) * p * u[p - 1] * v[q];
+                yu += yCoeffs(p, q) * p * u[p - 1] * v[q];
+            }
+            if (q > 0) {
+                xv += xCoeffs(p, q) * q * u[p] * v[q - 1];
+                yv += yCoeffs(p, q) * q * u[p] * v[q - 1];
+            }
+            x += xCoeffs(p, q) * u[p] * v[q];
+            y += yCoeffs(p, q) * u[p] * v[q];
+        }
+    }
+    geom::LinearTransform linear;
+    linear.getMatrix()(0, 0) = xu;
+    linear.getMatrix()(0, 1) = xv;
+    linear.getMatrix()(1, 0) = yu;
+    linear.getMatrix()(1, 1) = yv;
+    geom::Point2D origin(x, y);
+    return geom::AffineTransform(linear, origin - linear(in));
+}
+
+}  // namespace
+
 PolynomialTransform PolynomialTransform::convert(ScaledPolynomialTransform const& scaled) {
     return compose(scaled.getOutputScalingInverse(), compose(scaled.getPoly(), scaled.getInputScaling()));
 }
@@ -58,7 +122,7 @@ PolynomialTransform PolynomialTransform::convert(SipReverseTransform const& othe
                    compose(poly, other._cdInverse));
 }
 
-PolynomialTransform::PolynomialTransform(int order) : _xCoeffs(), _yCoeffs(), _u(), _v() {
+PolynomialTransform::PolynomialTransform(int order) : _xCoeffs(), _yCoeffs() {
     if (order < 0) {
         throw LSST_EXCEPT(pex::exceptions::LengthError, "PolynomialTransform order must be >= 0");
     }
@@ -67,16 +131,11 @@ PolynomialTransform::PolynomialTransform(int order) : _xCoeffs(), _yCoeffs(), _u
     _yCoeffs = ndarray::allocate(order + 1, order + 1);
     _xCoeffs.deep() = 0;
     _yCoeffs.deep() = 0;
-    _u = Eigen::VectorXd(order + 1);
-    _v = Eigen::VectorXd(order + 1);
 }
 
 PolynomialTransform::PolynomialTransform(ndarray::Array<double const, 2, 0> const& xCoeffs,
                                          ndarray::Array<double const, 2, 0> const& yCoeffs)
-        : _xCoeffs(ndarray::copy(xCoeffs)),
-          _yCoeffs(ndarray::copy(yCoeffs)),
-          _u(_xCoeffs.getSize<0>()),
-          _v(_xCoeffs.getSize<0>()) {
+        : _xCoeffs(ndarray::copy(xCoeffs)), _yCoeffs(ndarray::copy(yCoeffs)) {
     if (xCoeffs.getShape() != yCoeffs.getShape()) {
         throw LSST_EXCEPT(
                 pex::exceptions::LengthError,
@@ -95,12 +154,9 @@ PolynomialTransform::PolynomialTransform(ndarray::Array<double const, 2, 0> cons
 }
 
 PolynomialTransform::PolynomialTransform(PolynomialTransform const& other)
-        : _xCoeffs(ndarray::copy(other.getXCoeffs())),
-          _yCoeffs(ndarray::copy(other.getYCoeffs())),
-          _u(other._u.size()),
-          _v(other._v.size()) {}
+        : _xCoeffs(ndarray::copy(other.getXCoeffs())), _yCoeffs(ndarray::copy(other.getYCoeffs())) {}
 
-PolynomialTransform::PolynomialTransform(PolynomialTransform&& other) : _xCoeffs(), _yCoeffs(), _u(), _v() {
+PolynomialTransform::PolynomialTransform(PolynomialTransform&& other) : _xCoeffs(), _yCoeffs() {
     this->swap(other);
 }
 
@@ -122,51 +178,20 @@ PolynomialTransform& PolynomialTransform::operator=(PolynomialTransform&& other)
 void PolynomialTransform::swap(PolynomialTransform& other) {
     _xCoeffs.swap(other._xCoeffs);
     _yCoeffs.swap(other._yCoeffs);
-    _u.swap(other._u);
-    _v.swap(other._v);
 }
 
 geom::AffineTransform PolynomialTransform::linearize(geom::Point2D const& in) const {
-    double xu = 0.0, xv = 0.0, yu = 0.0, yv = 0.0, x = 0.0, y = 0.0;
-    int const order = getOrder();
-    detail::computePowers(_u, in.getX());
-    detail::computePowers(_v, in.getY());
-    for (int p = 0; p <= order; ++p) {
-        for (int q = 0; q <= order; ++q) {
-            if (p > 0) {
-                xu += _xCoeffs(p, q) * p * _u[p - 1] * _v[q];
-                yu += _yCoeffs(p, q) * p * _u[p - 1] * _v[q];
-            }
-            if (q > 0) {
-                xv += _xCoeffs(p, q) * q * _u[p] * _v[q - 1];
-                yv += _yCoeffs(p, q) * q * _u[p] * _v[q - 1];
-            }
-            x += _xCoeffs(p, q) * _u[p] * _v[q];
-            y += _yCoeffs(p, q) * _u[p] * _v[q];
-        }
+    if (getOrder() <= MAX_STACK_ORDER) {
+        return linearizePolynomials<StackPowers>(_xCoeffs, _yCoeffs, in);
     }
-    geom::LinearTransform linear;
-    linear.getMatrix()(0, 0) = xu;
-    linear.getMatrix()(0, 1) = xv;
-    linear.getMatrix()(1, 0) = yu;
-    linear.getMatrix()(1, 1) = yv;
-    geom::Point2D origin(x, y);
-    return geom::AffineTransform(linear, origin - linear(in));
+    return linearizePolynomials<Eigen::VectorXd>(_xCoeffs, _yCoeffs, in);
 }
 
 geom::Point2D PolynomialTransform::operator()(geom::Point2D const& in) const {
-    int const order = getOrder();
-    detail::computePowers(_u, in.getX());
-    detail::computePowers(_v, in.getY());
-    double x = 0;
-    double y = 0;
-    for (int p = 0; p <= order; ++p) {
-        for (int q = 0; q <= order; ++q) {
-            x += _xCoeffs(p, q) * _u[p] * _v[q];
-            y += _yCoeffs(p, q) * _u[p] * _v[q];
-        }
+    if (getOrder() <= MAX_STACK_ORDER) {
+        return applyPolynomials<StackPowers>(_xCoeffs, _yCoeffs, in);
     }
-    return geom::Point2D(x, y);
+    return applyPolynomials<Eigen::VectorXd>(_xCoeffs, _yCoeffs, in);
 }
 
 ScaledPolynomialTransform ScaledPolynomialTransform::convert(PolynomialTransform const& poly) {
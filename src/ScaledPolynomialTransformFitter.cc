@@ -180,18 +180,20 @@ ScaledPolynomialTransformFitter::ScaledPolynomialTransformFitter(afw::table::Bas
           _vandermonde(data.size(), detail::computePackedSize(maxOrder)) {
     // Create a matrix that evaluates the max-order polynomials of all the (scaled) input positions;
     // we'll extract subsets of this later when fitting to a subset of the matches and a lower order.
+    Eigen::VectorXd u(maxOrder + 1);
+    Eigen::VectorXd v(maxOrder + 1);
     for (std::size_t i = 0; i < data.size(); ++i) {
         geom::Point2D input = getInputScaling()(_data[i].get(_keys.input));
         // x[k] == pow(x, k), y[k] == pow(y, k)
-        detail::computePowers(_transform._poly._u, input.getX());
-        detail::computePowers(_transform._poly._v, input.getY());
+        detail::computePowers(u, input.getX());
+        detail::computePowers(v, input.getY());
         // We pack coefficients in the following order:
         // (0,0), (0,1), (1,0), (0,2), (1,1), (2,0)
         // Note that this lets us choose the just first N(N+1)/2 columns to
         // evaluate an Nth order polynomial, even if N < maxOrder.
         for (int n = 0, j = 0; n <= maxOrder; ++n) {
             for (int p = 0, q = n; p <= n; ++p, --q, ++j) {
-                _vandermonde(i, j) = _transform._poly._u[p] * _transform._poly._v[q];
+                _vandermonde(i, j) = u[p] * v[q];
             }
         }
     }
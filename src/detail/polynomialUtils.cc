@@ -30,7 +30,7 @@ namespace meas {
 namespace astrom {
 namespace detail {
 
-void computePowers(Eigen::VectorXd& r, double x) {
+void computePowers(Eigen::Ref<Eigen::VectorXd> r, double x) {
     r[0] = 1.0;
     for (int i = 1; i < r.size(); ++i) {
         r[i] = r[i - 1] * x;
@@ -3,6 +3,7 @@
 #include <fstream>
 #include <iostream>
 #include <memory>
+#include <unordered_map>
 #include <utility>
 #include <vector>
 
@@ -12,7 +13,8 @@
 #include "boost/multi_index/ordered_index.hpp"
 #include "boost/multi_index/global_fun.hpp"
 
-#include "gsl/gsl_linalg.h"
+#include "Eigen/Core"
+#include "Eigen/LU"
 
 #include "lsst/sphgeom/Vector3d.h"
 #include "lsst/pex/exceptions.h"
@@ -22,6 +24,7 @@
 #include "lsst/geom/SpherePoint.h"
 #include "lsst/afw/geom/SkyWcs.h"
 #include "lsst/meas/astrom/matchOptimisticB.h"
+#include "lsst/meas/astrom/detail/polynomialUtils.h"
 
 namespace pexExcept = lsst::pex::exceptions;
 namespace afwTable = lsst::afw::table;
@@ -99,191 +102,349 @@ ProxyVector selectPoint(ProxyVector const &a, afwTable::Key<double> const &key,
     return ProxyVector(b.begin() + startInd, b.begin() + endInd);
 }
 
+/**
+Return the range of a list sorted by decreasing distance that holds the elements within e of a distance
+
+The range is padded slightly to allow for rounding, so callers must still test the distance of each
+element in it.
+
+@param[in] begin, end  range of the list, sorted by decreasing distance
+@param[in] getDistance  function returning the distance of an element
+@param[in] distance  distance to search for
+@param[in] e  tolerance on the distance
+*/
+template <typename Iterator, typename GetDistance>
+std::pair<Iterator, Iterator> findDistanceRange(Iterator begin, Iterator end, GetDistance getDistance,
+                                                double distance, double e) {
+    double const pad = 1.0e-9 * (std::fabs(distance) + e);
+    double const maxDistance = distance + e + pad;
+    double const minDistance = distance - e - pad;
+    auto rangeBegin = std::partition_point(
+            begin, end, [&](auto const &elem) { return getDistance(elem) >= maxDistance; });
+    auto rangeEnd = std::partition_point(rangeBegin, end,
+                                         [&](auto const &elem) { return getDistance(elem) > minDistance; });
+    return std::make_pair(rangeBegin, rangeEnd);
+}
+
+typedef OptimisticPatternMatcherB::PairIndexMap PairIndexMap;
+
+/**
+Index a list of pairs by the first object of each pair
+
+@param[in] a  list of pairs sorted by decreasing distance
+*/
+PairIndexMap makePairIndexMap(std::vector<ProxyPair> const &a) {
+    PairIndexMap pairIndexMap;
+    for (std::size_t i = 0; i < a.size(); ++i) {
+        pairIndexMap[a[i].first.record.get()].push_back(i);
+    }
+    return pairIndexMap;
+}
+
+/**
+Return the pairs matching a pair in distance and position angle, in the order of the list of pairs
+
+@param[in] a  list of pairs sorted by decreasing distance
+@param[in] p  pair to match
+@param[in] e  tolerance on the distance
+@param[in] e_dpa  tolerance on the position angle (rad)
+*/
 std::vector<ProxyPair> searchPair(std::vector<ProxyPair> const &a, ProxyPair const &p, double e,
                                   double e_dpa) {
     std::vector<ProxyPair> v;
 
-    for (size_t i = 0; i < a.size(); i++) {
-        double dd = std::fabs(a[i].distance - p.distance);
-        double dpa = absDeltaAngle(a[i].pa, p.pa);
+    auto range = findDistanceRange(a.begin(), a.end(), [](ProxyPair const &pair) { return pair.distance; },
+                                   p.distance, e);
+    for (auto i = range.first; i != range.second; ++i) {
+        double dd = std::fabs(i->distance - p.distance);
+        double dpa = absDeltaAngle(i->pa, p.pa);
         if (dd < e && dpa < e_dpa) {
-            v.push_back(a[i]);
+            v.push_back(*i);
         }
     }
 
     return v;
 }
 
-std::vector<ProxyPair>::iterator searchPair3(std::vector<ProxyPair> &a, ProxyPair const &p,
-                                             ProxyPair const &q, double e, double dpa, double e_dpa = 0.02) {
-    std::vector<ProxyPair>::iterator idx = a.end();
+/**
+Return the pair sharing its first object with q that best matches a pair in distance
+
+Of the pairs matching p in distance and, after rotating by dpa, in position angle, the pair closest in
+distance is returned, the first in the list if several are equally close.
+
+@param[in] a  list of pairs sorted by decreasing distance
+@param[in] pairIndexMap  index of a by the first object of each pair
+@param[in] p  pair to match
+@param[in] q  pair whose first object the match must share
+@param[in] e  tolerance on the distance
+@param[in] dpa  rotation between the source and reference pairs (rad)
+@param[in] e_dpa  tolerance on the position angle (rad)
+@return iterator to the matching pair in a; a.end() if there is none
+*/
+std::vector<ProxyPair>::const_iterator searchPair3(std::vector<ProxyPair> const &a,
+                                                   PairIndexMap const &pairIndexMap, ProxyPair const &p,
+                                                   ProxyPair const &q, double e, double dpa,
+                                                   double e_dpa = 0.02) {
+    std::vector<ProxyPair>::const_iterator idx = a.end();
     double dd_min = 1.E+10;
-    // double dpa_min = e_dpa;
 
-    for (auto i = a.begin(); i != a.end(); ++i) {
-        double dd = std::fabs(i->distance - p.distance);
-#if 1
-        if (dd < e && absDeltaAngle(p.pa, i->pa - dpa) < e_dpa && dd < dd_min && (i->first == q.first)) {
+    auto pairIndices = pairIndexMap.find(q.first.record.get());
+    if (pairIndices == pairIndexMap.end()) {
+        return idx;
+    }
+    auto range = findDistanceRange(pairIndices->second.begin(), pairIndices->second.end(),
+                                   [&a](std::size_t i) { return a[i].distance; }, p.distance, e);
+    for (auto i = range.first; i != range.second; ++i) {
+        auto const pairIter = a.begin() + *i;
+        double dd = std::fabs(pairIter->distance - p.distance);
+        if (dd < e && absDeltaAngle(p.pa, pairIter->pa - dpa) < e_dpa && dd < dd_min) {
             dd_min = dd;
-            idx = i;
+            idx = pairIter;
         }
-#else
-        if (dd < e && absDeltaAngle(p.pa, i->pa - dpa) < dpa_min) {
-            dpa_min = std::fabs(p.pa - i->pa - dpa);
-            idx = i;
-        }
-#endif
     }
 
     return idx;
 }
 
-void transform(int order, boost::shared_array<double> const &coeff, double x, double y, double *xn,
-               double *yn) {
-    int ncoeff = (order + 1) * (order + 2) / 2;
-    *xn = 0.0;
-    *yn = 0.0;
-    int n = 0;
-    for (int i = 0; i <= order; i++) {
-        for (int k = 0; k <= i; k++) {
-            int j = i - k;
-            *xn += coeff[n] * pow(x, j) * pow(y, k);
-            *yn += coeff[n + ncoeff] * pow(x, j) * pow(y, k);
-            n++;
+/**
+Return the design matrix of a 2-d polynomial at the positions of a list of proxies
+
+Row k holds the terms of the polynomial at the position of img[k], x^j y^m ordered as
+(j, m) = (0, 0), (1, 0), (0, 1), (2, 0), (1, 1), (0, 2), ...; this is the order of the coefficients
+fit by polyfit.
+
+@param[in] order  order of the polynomial
+@param[in] img  list of proxies; read: x, y
+*/
+Eigen::MatrixXd computeDesignMatrix(int order, ProxyVector const &img) {
+    int const ncoeff = (order + 1) * (order + 2) / 2;
+    Eigen::MatrixXd design(img.size(), ncoeff);
+    Eigen::VectorXd xPowers(order + 1);
+    Eigen::VectorXd yPowers(order + 1);
+    for (std::size_t k = 0; k < img.size(); k++) {
+        detail::computePowers(xPowers, img[k].getX());
+        detail::computePowers(yPowers, img[k].getY());
+        int n = 0;
+        for (int i = 0; i <= order; i++) {
+            for (int m = 0; m <= i; m++) {
+                design(k, n) = xPowers[i - m] * yPowers[m];
+                n++;
+            }
         }
     }
+    return design;
 }
 
-boost::shared_array<double> polyfit(int order, ProxyVector const &img, ProxyVector const &posRefCat) {
-    int ncoeff = (order + 1) * (order + 2) / 2;
-    std::unique_ptr<int[]> xorder(new int[ncoeff]);
-    std::unique_ptr<int[]> yorder(new int[ncoeff]);
-
-    int n = 0;
-    for (int i = 0; i <= order; i++) {
-        for (int k = 0; k <= i; k++) {
-            int j = i - k;
-            xorder[n] = j;
-            yorder[n] = k;
-            n++;
-        }
-    }
+/**
+Apply a 2-d polynomial transform fit by polyfit to the positions of a design matrix
+
+@param[in] coeff  polynomial coefficients of x, then of y, as returned by polyfit
+@param[in] design  design matrix of the positions, as returned by computeDesignMatrix for the order
+    of the coefficients
+@param[out] xn, yn  transformed positions
+*/
+void transform(boost::shared_array<double> const &coeff, Eigen::MatrixXd const &design, Eigen::VectorXd &xn,
+               Eigen::VectorXd &yn) {
+    auto const ncoeff = design.cols();
+    xn = design * Eigen::Map<Eigen::VectorXd const>(coeff.get(), ncoeff);
+    yn = design * Eigen::Map<Eigen::VectorXd const>(coeff.get() + ncoeff, ncoeff);
+}
+
+/**
+Fit a 2-d polynomial transform from the positions of a list of proxies to those of another
 
-    std::unique_ptr<int[]> flag(new int[img.size()]);
-    for (size_t k = 0; k < img.size(); k++) {
-        flag[k] = 1;
+@param[in] order  order of the polynomial
+@param[in] img  list of proxies to transform from; read: x, y
+@param[in] posRefCat  list of proxies to transform to, matched to img; read: x, y
+@return the polynomial coefficients of x, then of y, in the order of computeDesignMatrix
+*/
+boost::shared_array<double> polyfit(int order, ProxyVector const &img, ProxyVector const &posRefCat) {
+    int const ncoeff = (order + 1) * (order + 2) / 2;
+    Eigen::MatrixXd const design = computeDesignMatrix(order, img);
+    Eigen::VectorXd refX(img.size());
+    Eigen::VectorXd refY(img.size());
+    for (std::size_t k = 0; k < img.size(); k++) {
+        refX[k] = posRefCat[k].getX();
+        refY[k] = posRefCat[k].getY();
     }
 
-    std::unique_ptr<double[]> a_data(new double[ncoeff * ncoeff]);
-    std::unique_ptr<double[]> b_data(new double[ncoeff]);
-    std::unique_ptr<double[]> c_data(new double[ncoeff]);
+    // 1 for the points used in the fit, 0 for those rejected
+    Eigen::ArrayXd flag = Eigen::ArrayXd::Ones(img.size());
 
     boost::shared_array<double> coeff(new double[ncoeff * 2]);
+    Eigen::Map<Eigen::VectorXd> xCoeff(coeff.get(), ncoeff);
+    Eigen::Map<Eigen::VectorXd> yCoeff(coeff.get() + ncoeff, ncoeff);
 
     for (int loop = 0; loop < 1; loop++) {
-        for (int i = 0; i < ncoeff; i++) {
-            for (int j = 0; j < ncoeff; j++) {
-                a_data[i * ncoeff + j] = 0.0;
-                for (size_t k = 0; k < img.size(); k++) {
-                    if (flag[k] == 1) {
-                        a_data[i * ncoeff + j] +=
-                                pow(img[k].getX(), xorder[i]) * pow(img[k].getY(), yorder[i]) *
-                                pow(img[k].getX(), xorder[j]) * pow(img[k].getY(), yorder[j]);
-                    }
-                }
-            }
-            b_data[i] = c_data[i] = 0.0;
-            for (unsigned int k = 0; k < img.size(); k++) {
-                if (flag[k] == 1) {
-                    b_data[i] += pow(img[k].getX(), xorder[i]) * pow(img[k].getY(), yorder[i]) *
-                                 posRefCat[k].getX();
-                    c_data[i] += pow(img[k].getX(), xorder[i]) * pow(img[k].getY(), yorder[i]) *
-                                 posRefCat[k].getY();
-                }
-            }
-        }
-
-        gsl_matrix_view a = gsl_matrix_view_array(a_data.get(), ncoeff, ncoeff);
-        gsl_vector_view b = gsl_vector_view_array(b_data.get(), ncoeff);
-        gsl_vector_view c = gsl_vector_view_array(c_data.get(), ncoeff);
-
-        std::shared_ptr<gsl_vector> x(gsl_vector_alloc(ncoeff), gsl_vector_free);
-        std::shared_ptr<gsl_vector> y(gsl_vector_alloc(ncoeff), gsl_vector_free);
+        // Solve the normal equations of the points used
+        Eigen::MatrixXd const flaggedDesign = flag.matrix().asDiagonal() * design;
+        Eigen::PartialPivLU<Eigen::MatrixXd> const lu(flaggedDesign.transpose() * design);
+        xCoeff = lu.solve(flaggedDesign.transpose() * refX);
+        yCoeff = lu.solve(flaggedDesign.transpose() * refY);
+
+        Eigen::VectorXd x1, y1;
+        transform(coeff, design, x1, y1);
+        Eigen::ArrayXd const dx = (x1 - refX).array();
+        Eigen::ArrayXd const dy = (y1 - refY).array();
+        double const S = flag.sum();
+        double const Sx = (flag * dx).sum();
+        double const Sxx = (flag * dx.square()).sum();
+        double const Sy = (flag * dy).sum();
+        double const Syy = (flag * dy.square()).sum();
+        double x_sig = std::sqrt((Sxx - Sx * Sx / S) / S);
+        double y_sig = std::sqrt((Syy - Sy * Sy / S) / S);
 
-        int s;
+        flag = (dx.abs() > 2. * x_sig || dy.abs() > 2. * y_sig).select(0.0, flag);
+    }
 
-        std::shared_ptr<gsl_permutation> p(gsl_permutation_alloc(ncoeff), gsl_permutation_free);
+    return coeff;
+}
 
-        gsl_linalg_LU_decomp(&a.matrix, p.get(), &s);
-        gsl_linalg_LU_solve(&a.matrix, p.get(), &b.vector, x.get());
-        gsl_linalg_LU_solve(&a.matrix, p.get(), &c.vector, y.get());
+/**
+A uniform grid index of the pixel positions of reference object proxies, for finding the reference
+object nearest a position
 
-        for (int i = 0; i < ncoeff; i++) {
-            coeff[i] = x->data[i];
-            coeff[i + ncoeff] = y->data[i];
+The grid cells are at least as large as the matching allowance, so only the cells around the cell of a
+position need to be searched.
+*/
+class ProxyGrid {
+public:
+    /**
+    Construct the index
+
+    @param[in] posRefCat  list of reference object ProxyRecords; must outlive the index;
+        read: x, y
+    @param[in] matchingAllowancePix  maximum allowed distance between reference object and source (pixels)
+    */
+    ProxyGrid(ProxyVector const &posRefCat, double matchingAllowancePix)
+            : _posRefCat(posRefCat), _matchingAllowancePix(matchingAllowancePix) {
+        // Reference objects with non-finite positions never match, so they are left out.
+        std::vector<std::size_t> indices;
+        indices.reserve(posRefCat.size());
+        double xMax = 0.0;
+        double yMax = 0.0;
+        for (std::size_t i = 0; i < posRefCat.size(); ++i) {
+            double const x = posRefCat[i].getX();
+            double const y = posRefCat[i].getY();
+            if (!std::isfinite(x) || !std::isfinite(y)) {
+                continue;
+            }
+            if (indices.empty()) {
+                _xMin = xMax = x;
+                _yMin = yMax = y;
+            } else {
+                _xMin = std::min(_xMin, x);
+                xMax = std::max(xMax, x);
+                _yMin = std::min(_yMin, y);
+                yMax = std::max(yMax, y);
+            }
+            indices.push_back(i);
         }
 
-        double S, Sx, Sy, Sxx, Syy;
-        S = Sx = Sy = Sxx = Syy = 0.0;
-        for (size_t k = 0; k < img.size(); k++) {
-            if (flag[k] == 1) {
-                double x0 = img[k].getX();
-                double y0 = img[k].getY();
-                double x1, y1;
-                transform(order, coeff, x0, y0, &x1, &y1);
-                S += 1.;
-                Sx += (x1 - posRefCat[k].getX());
-                Sxx += (x1 - posRefCat[k].getX()) * (x1 - posRefCat[k].getX());
-                Sy += (y1 - posRefCat[k].getY());
-                Syy += (y1 - posRefCat[k].getY()) * (y1 - posRefCat[k].getY());
-            }
+        // Enlarge the cells if needed to keep the number of cells at most a few times the number of
+        // reference objects.
+        double const maxCells = 4.0 * indices.size() + 1.0;
+        auto countCells = [&](double cellSize) {
+            return (std::floor((xMax - _xMin) / cellSize) + 1.0) *
+                   (std::floor((yMax - _yMin) / cellSize) + 1.0);
+        };
+        _cellSize = matchingAllowancePix;
+        double const nCells = countCells(_cellSize);
+        if (nCells > maxCells) {
+            _cellSize *= std::sqrt(nCells / maxCells);
         }
-        double x_sig = std::sqrt((Sxx - Sx * Sx / S) / S);
-        double y_sig = std::sqrt((Syy - Sy * Sy / S) / S);
-        // std::cout << x_sig << " " << y_sig << std::endl;
-
-        for (size_t k = 0; k < img.size(); k++) {
-            double x0 = img[k].getX();
-            double y0 = img[k].getY();
-            double x1, y1;
-            transform(order, coeff, x0, y0, &x1, &y1);
-            if (std::fabs(x1 - posRefCat[k].getX()) > 2. * x_sig ||
-                std::fabs(y1 - posRefCat[k].getY()) > 2. * y_sig) {
-                flag[k] = 0;
+        while (countCells(_cellSize) > maxCells) {
+            _cellSize *= 1.1;
+        }
+        _nx = static_cast<int>(std::floor((xMax - _xMin) / _cellSize)) + 1;
+        _ny = static_cast<int>(std::floor((yMax - _yMin) / _cellSize)) + 1;
+
+        // Sort the reference objects by cell, keeping them in the order of posRefCat within each cell.
+        std::vector<std::size_t> cells;
+        cells.reserve(indices.size());
+        _cellStart.assign(static_cast<std::size_t>(_nx) * _ny + 1, 0);
+        for (auto i : indices) {
+            auto const cell = static_cast<std::size_t>(_getCell(posRefCat[i].getY(), _yMin, _ny)) * _nx +
+                              _getCell(posRefCat[i].getX(), _xMin, _nx);
+            cells.push_back(cell);
+            ++_cellStart[cell + 1];
+        }
+        for (std::size_t cell = 0; cell + 1 < _cellStart.size(); ++cell) {
+            _cellStart[cell + 1] += _cellStart[cell];
+        }
+        _cellIndices.resize(indices.size());
+        std::vector<std::size_t> cellEnd(_cellStart.begin(), _cellStart.end() - 1);
+        for (std::size_t k = 0; k < indices.size(); ++k) {
+            _cellIndices[cellEnd[cells[k]]++] = indices[k];
+        }
+    }
+
+    ProxyGrid(ProxyGrid const &) = delete;
+    ProxyGrid &operator=(ProxyGrid const &) = delete;
+
+    /**
+    Return the reference object nearest the given source
+
+    If several reference objects are equally near, the first in posRefCat is returned.
+
+    @param[in] x  source pixel position in x
+    @param[in] y  source pixel position in y
+    @return a pair of:
+    - posRefCat iterator; if no match then end()
+    - distance between reference object and source (in pixels); approx. matchingAllowancePix if no match
+    */
+    std::pair<ProxyVector::const_iterator, double> searchNearestPoint(double x, double y) const {
+        auto minDistSq = _matchingAllowancePix * _matchingAllowancePix;
+        auto foundIdx = _posRefCat.size();
+        if (!_cellIndices.empty() && std::isfinite(x) && std::isfinite(y)) {
+            // Search one more cell on each side than needed, so that rounding cannot leave out a
+            // reference object within the allowance.
+            int const xBeg = _getCell(x - _matchingAllowancePix, _xMin, _nx, -1);
+            int const xEnd = _getCell(x + _matchingAllowancePix, _xMin, _nx, 1);
+            int const yBeg = _getCell(y - _matchingAllowancePix, _yMin, _ny, -1);
+            int const yEnd = _getCell(y + _matchingAllowancePix, _yMin, _ny, 1);
+            for (int iy = yBeg; iy <= yEnd; ++iy) {
+                for (int ix = xBeg; ix <= xEnd; ++ix) {
+                    auto const cell = static_cast<std::size_t>(iy) * _nx + ix;
+                    for (auto k = _cellStart[cell]; k < _cellStart[cell + 1]; ++k) {
+                        auto const i = _cellIndices[k];
+                        auto const dx = _posRefCat[i].getX() - x;
+                        auto const dy = _posRefCat[i].getY() - y;
+                        auto const distSq = dx * dx + dy * dy;
+                        // Keep the first in posRefCat of equally near reference objects, as a
+                        // search through posRefCat in order would.
+                        if (distSq < minDistSq ||
+                            (distSq == minDistSq && foundIdx < _posRefCat.size() && i < foundIdx)) {
+                            foundIdx = i;
+                            minDistSq = distSq;
+                        }
+                    }
+                }
             }
         }
+        return std::make_pair(_posRefCat.begin() + foundIdx, std::sqrt(minDistSq));
     }
 
-    return coeff;
-}
+    /// Return the iterator to the end of posRefCat, returned when no reference object matches
+    ProxyVector::const_iterator end() const { return _posRefCat.end(); }
 
-/**
-Return the reference object nearest the given source
-
-@param[in] posRefCat  list of reference object ProxyRecords;
-    read: x, y
-@param[in] x  source pixel position in x
-@param[in] y  source pixel position in y
-@param[in] matchingAllowancePix  maximum allowed distance between reference object and source (pixels);
-@return a pair of:
-- posRefCat iterator; if no match then posRefCat.end()
-- distance between reference object and source (in pixels); approx. matchingAllowancePix if no match
-*/
-std::pair<ProxyVector::const_iterator, double> searchNearestPoint(ProxyVector const &posRefCat, double x,
-                                                                  double y, double matchingAllowancePix) {
-    auto minDistSq = matchingAllowancePix * matchingAllowancePix;
-    auto foundPtr = posRefCat.end();
-    for (auto posRefPtr = posRefCat.begin(); posRefPtr != posRefCat.end(); ++posRefPtr) {
-        auto const dx = posRefPtr->getX() - x;
-        auto const dy = posRefPtr->getY() - y;
-        auto const distSq = dx * dx + dy * dy;
-        if (distSq < minDistSq) {
-            foundPtr = posRefPtr;
-            minDistSq = distSq;
-        }
+private:
+    // Return the index of the cell holding a coordinate, moved by offset cells and clamped to the grid
+    int _getCell(double coord, double coordMin, int nCells, int offset = 0) const {
+        double const cell = std::floor((coord - coordMin) / _cellSize) + offset;
+        return static_cast<int>(std::min(std::max(cell, 0.0), nCells - 1.0));
     }
-    return std::make_pair(foundPtr, std::sqrt(minDistSq));
-}
+
+    ProxyVector const &_posRefCat;
+    double _matchingAllowancePix;
+    double _xMin = 0.0;
+    double _yMin = 0.0;
+    double _cellSize;
+    int _nx;
+    int _ny;
+    std::vector<std::size_t> _cellStart;    // start of each cell in _cellIndices, and the end
+    std::vector<std::size_t> _cellIndices;  // indices into _posRefCat, grouped by cell
+};
 
 /**
 Find nearest reference object to a source and add the match to a list
@@ -298,19 +459,15 @@ object). However, that raises the danger of false matches in the situation that
 the user provides a source catalog with many faint stars, some of which may be spurious.
 
 @param[in,out] proxyPairList  list of reference object, source matches
-@param[in] coeff  array of TAN WCS coefficients (I think)
-@param[in] posRefCat  list of position reference object proxies, sorted by decreasing brightness
+@param[in] posRefGrid  index of the position reference object proxies, sorted by decreasing brightness,
+    with the maximum allowed distance between reference object and source
 @param[in] source  source to match
-@param[in] matchingAllowancePix  maximum allowed distance between reference object and source (pixels)
+@param[in] x1, y1  source position transformed to the frame of the reference objects
 */
-void addNearestMatch(MultiIndexedProxyPairList &proxyPairList, boost::shared_array<double> coeff,
-                     ProxyVector const &posRefCat, RecordProxy const &source, double matchingAllowancePix) {
-    double x1, y1;
-    auto x0 = source.getX();
-    auto y0 = source.getY();
-    transform(1, coeff, x0, y0, &x1, &y1);
-    auto refObjDist = searchNearestPoint(posRefCat, x1, y1, matchingAllowancePix);
-    if (refObjDist.first == posRefCat.end()) {
+void addNearestMatch(MultiIndexedProxyPairList &proxyPairList, ProxyGrid const &posRefGrid,
+                     RecordProxy const &source, double x1, double y1) {
+    auto refObjDist = posRefGrid.searchNearestPoint(x1, y1);
+    if (refObjDist.first == posRefGrid.end()) {
         // no reference object sufficiently close; do nothing
         return;
     }
@@ -344,17 +501,21 @@ void addNearestMatch(MultiIndexedProxyPairList &proxyPairList, boost::shared_arr
 Perform a verification pass on a possible match
 
 @param[in] coeff  array of TAN WCS coefficients?
-@param[in] posRefCat  list of position reference object proxies, sorted by decreasing brightness
+@param[in] posRefGrid  index of the position reference object proxies, sorted by decreasing brightness,
+    with the maximum allowed distance between reference object and source
 @param[in] sourceCat  list of sources proxies, sorted by decreasing brightness
-@param[in] matchingAllowancePix  maximum allowed distance between reference object and source (pixels)
+@param[in] sourceDesign  design matrix of sourceCat for a first order polynomial, as returned by
+    computeDesignMatrix
 */
-afwTable::ReferenceMatchVector FinalVerify(boost::shared_array<double> coeff, ProxyVector const &posRefCat,
-                                           ProxyVector const &sourceCat, double matchingAllowancePix,
+afwTable::ReferenceMatchVector FinalVerify(boost::shared_array<double> coeff, ProxyGrid const &posRefGrid,
+                                           ProxyVector const &sourceCat, Eigen::MatrixXd const &sourceDesign,
                                            bool verbose) {
     MultiIndexedProxyPairList proxyPairList;
 
-    for (auto sourcePtr = sourceCat.begin(); sourcePtr != sourceCat.end(); ++sourcePtr) {
-        addNearestMatch(proxyPairList, coeff, posRefCat, *sourcePtr, matchingAllowancePix);
+    Eigen::VectorXd x1, y1;
+    transform(coeff, sourceDesign, x1, y1);
+    for (std::size_t k = 0; k < sourceCat.size(); ++k) {
+        addNearestMatch(proxyPairList, posRefGrid, sourceCat[k], x1[k], y1[k]);
     }
     int order = 1;
     if (proxyPairList.size() > 5) {
@@ -372,9 +533,9 @@ afwTable::ReferenceMatchVector FinalVerify(boost::shared_array<double> coeff, Pr
             coeff = polyfit(order, srcMat, catMat);
             proxyPairList.clear();
 
-            for (ProxyVector::const_iterator sourcePtr = sourceCat.begin(); sourcePtr != sourceCat.end();
-                 ++sourcePtr) {
-                addNearestMatch(proxyPairList, coeff, posRefCat, *sourcePtr, matchingAllowancePix);
+            transform(coeff, sourceDesign, x1, y1);
+            for (std::size_t k = 0; k < sourceCat.size(); ++k) {
+                addNearestMatch(proxyPairList, posRefGrid, sourceCat[k], x1[k], y1[k]);
             }
             if (proxyPairList.size() == prevNumMatches) {
                 break;
@@ -456,11 +617,15 @@ ProxyVector makeProxies(afwTable::SimpleCatalog const &posRefCat, afw::geom::Sky
     return r;
 }
 
-afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &posRefCat,
-                                                afwTable::SourceCatalog const &sourceCat,
-                                                MatchOptimisticBControl const &control,
-                                                afw::geom::SkyWcs const &wcs, int posRefBegInd,
-                                                bool verbose) {
+OptimisticPatternMatcherB::OptimisticPatternMatcherB(afwTable::SimpleCatalog const &posRefCat,
+                                                     afwTable::SourceCatalog const &sourceCat,
+                                                     MatchOptimisticBControl const &control,
+                                                     afw::geom::SkyWcs const &wcs, int posRefBegInd,
+                                                     bool verbose)
+        : _refFluxField(control.refFluxField),
+          _sourceFluxField(control.sourceFluxField),
+          _numBrightStars(control.numBrightStars),
+          _verbose(verbose) {
     control.validate();
     if (posRefCat.empty()) {
         throw LSST_EXCEPT(pexExcept::InvalidParameterError, "no entries in posRefCat");
@@ -474,7 +639,6 @@ afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &p
     if (static_cast<size_t>(posRefBegInd) >= posRefCat.size()) {
         throw LSST_EXCEPT(pexExcept::InvalidParameterError, "posRefBegInd too big");
     }
-    double const maxRotationRad = geom::degToRad(control.maxRotationDeg);
 
     // Create an undistorted Wcs to project everything with
     // We'll anchor it at the center of the area.
@@ -493,53 +657,72 @@ afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &p
     auto tanWcs =
             afw::geom::makeSkyWcs(geom::Point2D(srcCenter), geom::SpherePoint(refCenter), wcs.getCdMatrix());
 
-    ProxyVector posRefProxyCat = makeProxies(posRefCat, *tanWcs);
-    ProxyVector sourceProxyCat = makeProxies(sourceCat, wcs, *tanWcs);
+    _posRefProxyCat = makeProxies(posRefCat, *tanWcs);
+    _sourceProxyCat = makeProxies(sourceCat, wcs, *tanWcs);
 
     // sourceSubCat contains at most the numBrightStars brightest sources, sorted by decreasing flux
-    ProxyVector sourceSubCat =
-            selectPoint(sourceProxyCat, sourceCat.getSchema().find<double>(control.sourceFluxField).key,
+    _sourceSubCat =
+            selectPoint(_sourceProxyCat, sourceCat.getSchema().find<double>(control.sourceFluxField).key,
                         control.numBrightStars);
 
     // posRefSubCat skips the initial posRefBegInd brightest reference objects and contains
     // at most the next len(sourceSubCat) + 25 brightest reference objects, sorted by decreasing flux
-    ProxyVector posRefSubCat =
-            selectPoint(posRefProxyCat, posRefCat.getSchema().find<double>(control.refFluxField).key,
-                        sourceSubCat.size() + 25, posRefBegInd);
+    _posRefSubCat =
+            selectPoint(_posRefProxyCat, posRefCat.getSchema().find<double>(control.refFluxField).key,
+                        _sourceSubCat.size() + 25, posRefBegInd);
     if (verbose) {
-        std::cout << "Catalog sizes: " << sourceSubCat.size() << " " << posRefSubCat.size() << std::endl;
+        std::cout << "Catalog sizes: " << _sourceSubCat.size() << " " << _posRefSubCat.size() << std::endl;
     }
 
-    // Construct a list of pairs of position reference stars sorted by increasing separation
-    std::vector<ProxyPair> posRefPairList;
-    size_t const posRefCatSubSize = posRefSubCat.size();
+    // Construct a list of pairs of position reference stars sorted by decreasing separation
+    size_t const posRefCatSubSize = _posRefSubCat.size();
     for (size_t i = 0; i < posRefCatSubSize - 1; i++) {
         for (size_t j = i + 1; j < posRefCatSubSize; j++) {
-            posRefPairList.push_back(ProxyPair(posRefSubCat[i], posRefSubCat[j]));
+            _posRefPairList.push_back(ProxyPair(_posRefSubCat[i], _posRefSubCat[j]));
         }
     }
-    std::sort(posRefPairList.begin(), posRefPairList.end(), cmpPair);
+    std::sort(_posRefPairList.begin(), _posRefPairList.end(), cmpPair);
+    _posRefPairIndexMap = makePairIndexMap(_posRefPairList);
 
-    // Construct a list of pairs of sources sorted by increasing separation
-    std::vector<ProxyPair> sourcePairList;
-    size_t const sourceSubCatSize = sourceSubCat.size();
+    // Construct a list of pairs of sources sorted by decreasing separation
+    size_t const sourceSubCatSize = _sourceSubCat.size();
     for (size_t i = 0; i < sourceSubCatSize - 1; i++) {
         for (size_t j = i + 1; j < sourceSubCatSize; j++) {
-            sourcePairList.push_back(ProxyPair(sourceSubCat[i], sourceSubCat[j]));
+            _sourcePairList.push_back(ProxyPair(_sourceSubCat[i], _sourceSubCat[j]));
         }
     }
-    std::sort(sourcePairList.begin(), sourcePairList.end(), cmpPair);
+    std::sort(_sourcePairList.begin(), _sourcePairList.end(), cmpPair);
+}
+
+afwTable::ReferenceMatchVector OptimisticPatternMatcherB::match(
+        MatchOptimisticBControl const &control) const {
+    control.validate();
+    if (control.refFluxField != _refFluxField || control.sourceFluxField != _sourceFluxField ||
+        control.numBrightStars != _numBrightStars) {
+        throw LSST_EXCEPT(pexExcept::InvalidParameterError,
+                          "refFluxField, sourceFluxField and numBrightStars must be those the matcher "
+                          "was constructed with");
+    }
+    double const maxRotationRad = geom::degToRad(control.maxRotationDeg);
+    bool const verbose = _verbose;
+
+    // Index the reference object positions and compute the design matrices of the source positions
+    // once for all the verification passes
+    ProxyGrid const posRefSubGrid(_posRefSubCat, control.matchingAllowancePix);
+    ProxyGrid const posRefGrid(_posRefProxyCat, control.matchingAllowancePix);
+    Eigen::MatrixXd const sourceSubDesign = computeDesignMatrix(1, _sourceSubCat);
+    Eigen::MatrixXd const sourceDesign = computeDesignMatrix(1, _sourceProxyCat);
 
     afwTable::ReferenceMatchVector matPair;
     afwTable::ReferenceMatchVector matPairSave;
     std::vector<afwTable::ReferenceMatchVector> matPairCand;
 
     size_t const fullShapeSize = control.numPointsForShape - 1;  // Max size of shape array
-    for (size_t ii = 0; ii < sourcePairList.size(); ii++) {
-        ProxyPair p = sourcePairList[ii];
+    for (size_t ii = 0; ii < _sourcePairList.size(); ii++) {
+        ProxyPair p = _sourcePairList[ii];
 
         std::vector<ProxyPair> q =
-                searchPair(posRefPairList, p, control.matchingAllowancePix, maxRotationRad);
+                searchPair(_posRefPairList, p, control.matchingAllowancePix, maxRotationRad);
 
         // If candidate pairs are found
         if (q.size() != 0) {
@@ -563,14 +746,15 @@ afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &p
                     std::cout << "q dist: " << q[l].distance << " pa: " << q[l].pa << std::endl;
                 }
 
-                for (size_t k = 0; k < sourceSubCat.size(); k++) {
-                    if (p.first == sourceSubCat[k] || p.second == sourceSubCat[k]) continue;
+                for (size_t k = 0; k < _sourceSubCat.size(); k++) {
+                    if (p.first == _sourceSubCat[k] || p.second == _sourceSubCat[k]) continue;
 
-                    ProxyPair pp(p.first, sourceSubCat[k]);
+                    ProxyPair pp(p.first, _sourceSubCat[k]);
 
-                    std::vector<ProxyPair>::iterator r = searchPair3(
-                            posRefPairList, pp, q[l], control.matchingAllowancePix, dpa, maxRotationRad);
-                    if (r != posRefPairList.end()) {
+                    std::vector<ProxyPair>::const_iterator r =
+                            searchPair3(_posRefPairList, _posRefPairIndexMap, pp, q[l],
+                                        control.matchingAllowancePix, dpa, maxRotationRad);
+                    if (r != _posRefPairList.end()) {
                         srcMatPair.push_back(pp);
                         catMatPair.push_back(*r);
                         if (verbose) {
@@ -648,22 +832,20 @@ afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &p
                         }
                         continue;
                     } else {
-                        double x0, y0, x1, y1;
+                        Eigen::VectorXd x1, y1;
+                        transform(coeff, sourceSubDesign, x1, y1);
                         int num = 0;
                         srcMat.clear();
                         catMat.clear();
-                        for (size_t i = 0; i < sourceSubCat.size(); i++) {
-                            x0 = sourceSubCat[i].getX();
-                            y0 = sourceSubCat[i].getY();
-                            transform(1, coeff, x0, y0, &x1, &y1);
-                            auto refObjDist =
-                                    searchNearestPoint(posRefSubCat, x1, y1, control.matchingAllowancePix);
-                            if (refObjDist.first != posRefSubCat.end()) {
+                        for (size_t i = 0; i < _sourceSubCat.size(); i++) {
+                            auto refObjDist = posRefSubGrid.searchNearestPoint(x1[i], y1[i]);
+                            if (refObjDist.first != posRefSubGrid.end()) {
                                 num++;
-                                srcMat.push_back(sourceSubCat[i]);
+                                srcMat.push_back(_sourceSubCat[i]);
                                 catMat.push_back(*refObjDist.first);
                                 if (verbose) {
-                                    std::cout << "Match: " << x0 << "," << y0 << " --> " << x1 << "," << y1
+                                    std::cout << "Match: " << _sourceSubCat[i].getX() << ","
+                                              << _sourceSubCat[i].getY() << " --> " << x1[i] << "," << y1[i]
                                               << " <==> " << refObjDist.first->getX() << ","
                                               << refObjDist.first->getY() << std::endl;
                                 }
@@ -685,8 +867,7 @@ afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &p
                             std::cout << std::endl;
                         }
 
-                        matPair = FinalVerify(coeff, posRefProxyCat, sourceProxyCat,
-                                              control.matchingAllowancePix, verbose);
+                        matPair = FinalVerify(coeff, posRefGrid, _sourceProxyCat, sourceDesign, verbose);
                         if (verbose) {
                             std::cout << "Number of matches: " << matPair.size() << " vs "
                                       << control.minMatchedPairs << std::endl;
@@ -730,6 +911,15 @@ END:
     }
 }
 
+afwTable::ReferenceMatchVector matchOptimisticB(afwTable::SimpleCatalog const &posRefCat,
+                                                afwTable::SourceCatalog const &sourceCat,
+                                                MatchOptimisticBControl const &control,
+                                                afw::geom::SkyWcs const &wcs, int posRefBegInd,
+                                                bool verbose) {
+    OptimisticPatternMatcherB const matcher(posRefCat, sourceCat, control, wcs, posRefBegInd, verbose);
+    return matcher.match(control);
+}
+
 }  // namespace astrom
 }  // namespace meas
 }  // namespace lsst
@@ -34,7 +34,8 @@ import lsst.afw.image as afwImage
 import lsst.meas.base as measBase
 from lsst.daf.persistence import Butler
 from lsst.meas.algorithms import LoadIndexedReferenceObjectsTask
-from lsst.meas.astrom import AstrometryTask
+from lsst.meas.astrom import AstrometryTask, MatchSet
+from lsst.meas.astrom.astrometry import _computeMaxShift
 
 
 class TestAstrometricSolver(lsst.utils.tests.TestCase):
@@ -74,6 +75,19 @@ class TestAstrometricSolver(lsst.utils.tests.TestCase):
         """Test that the solver will record number of sources used to table
            if it is passed a schema on initialization.
         """
+        self.doTestUsedFlag(useMatchSet=False)
+
+    def testMatchSet(self):
+        """Test that the solver can hold the matches as a MatchSet.
+        """
+        results = self.doTestUsedFlag(useMatchSet=True)
+        self.assertIsInstance(results.matches, MatchSet)
+        self.assertEqual(len(results.matches.toMatches()), len(results.matches))
+
+    def doTestUsedFlag(self, useMatchSet):
+        """Solve for the WCS of sources at the reference positions and check
+        that the used flag is set once for each match.
+        """
         self.exposure.setWcs(self.tanWcs)
         loadRes = self.refObjLoader.loadPixelBox(bbox=self.bbox, wcs=self.tanWcs, filterName="r")
         refCat = loadRes.refCat
@@ -85,6 +99,7 @@ class TestAstrometricSolver(lsst.utils.tests.TestCase):
         config = AstrometryTask.ConfigClass()
         config.wcsFitter.order = 2
         config.wcsFitter.numRejIter = 0
+        config.useMatchSet = useMatchSet
         # schema must be passed to the solver task constructor
         solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader, schema=sourceSchema)
         sourceCat = afwTable.SourceCatalog(sourceSchema)
@@ -109,6 +124,231 @@ class TestAstrometricSolver(lsst.utils.tests.TestCase):
             if source.get('calib_astrometry_used'):
                 count += 1
         self.assertEqual(count, len(results.matches))
+        return results
+
+    def testStopWhenConverged(self):
+        """Test stopping the match and fit loop once the fit has converged
+        """
+        distortedWcs = afwGeom.makeModifiedWcs(pixelTransform=afwGeom.makeRadialTransform([0, 1.01, 1e-7]),
+                                               wcs=self.tanWcs, modifyActualPixels=False)
+        sourceCat = self.makeSourceCat(distortedWcs)
+        # an outlier close enough for the first, loosely toleranced, match
+        # but farther than the maximum match distance of later iterations
+        outlier = sourceCat[len(sourceCat)//2]
+        centroidKey = afwTable.Point2DKey(sourceCat.schema["slot_Centroid"])
+        outlier.set(centroidKey, outlier.get(centroidKey) + lsst.geom.Extent2D(0.5, 0))
+        config = AstrometryTask.ConfigClass()
+        config.wcsFitter.order = 3
+        config.wcsFitter.numRejIter = 0
+
+        def solve(config):
+            """Solve, returning the results, the fit WCS and the IDs of the
+            matched sources of each iteration.
+            """
+            solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+            matchAndFitWcs = solver._matchAndFitWcs
+            iterSourceIds = []
+
+            def recordingMatchAndFitWcs(*args, **kwargs):
+                res = matchAndFitWcs(*args, **kwargs)
+                iterSourceIds.append({match.second.getId() for match in res.matches})
+                return res
+            solver._matchAndFitWcs = recordingMatchAndFitWcs
+            self.exposure.setWcs(distortedWcs)
+            results = solver.run(sourceCat=sourceCat, exposure=self.exposure)
+            return results, self.exposure.getWcs(), iterSourceIds
+
+        _, _, iterSourceIds = solve(config)
+        self.assertEqual(len(iterSourceIds), config.maxIter)
+        self.assertIn(outlier.getId(), iterSourceIds[0])
+
+        # the initial WCS is exact, so the first fit barely moves it, but
+        # re-scoring its matches drops the outlier
+        config.stopWhenConverged = True
+        config.convergedMaxShiftPix = 0.1
+        _, _, strictIterSourceIds = solve(config)
+        self.assertGreater(len(strictIterSourceIds), 1)
+
+        config.convergedMaxMatchFraction = 0.2
+        convergedResults, convergedWcs, convergedIterSourceIds = solve(config)
+        self.assertEqual(len(convergedIterSourceIds), 1)
+        self.assertWcsAlmostEqualOverBBox(distortedWcs, convergedWcs, self.bbox,
+                                          maxDiffSky=0.01*lsst.geom.arcseconds, maxDiffPix=0.02)
+        convergedSourceIds = {match.second.getId() for match in convergedResults.matches}
+        self.assertNotIn(outlier.getId(), convergedSourceIds)
+        self.assertLess(convergedSourceIds, convergedIterSourceIds[0])
+
+        # a fit never moves positions by less than no shift at all
+        config.convergedMaxShiftPix = 0
+        _, _, noShiftIterSourceIds = solve(config)
+        self.assertEqual(len(noShiftIterSourceIds), config.maxIter)
+
+    def testRefineMatches(self):
+        """Test matching by nearest neighbour after the first iteration
+        """
+        distortedWcs = afwGeom.makeModifiedWcs(pixelTransform=afwGeom.makeRadialTransform([0, 1.01, 1e-7]),
+                                               wcs=self.tanWcs, modifyActualPixels=False)
+        sourceCat = self.makeSourceCat(distortedWcs)
+        config = AstrometryTask.ConfigClass()
+        config.wcsFitter.order = 3
+        config.wcsFitter.numRejIter = 0
+        solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+        self.exposure.setWcs(distortedWcs)
+        results = solver.run(sourceCat=sourceCat, exposure=self.exposure)
+
+        config.refineMatches = True
+        refineSolver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+        self.exposure.setWcs(distortedWcs)
+        refineResults = refineSolver.run(sourceCat=sourceCat, exposure=self.exposure)
+        self.assertWcsAlmostEqualOverBBox(distortedWcs, self.exposure.getWcs(), self.bbox,
+                                          maxDiffSky=0.01*lsst.geom.arcseconds, maxDiffPix=0.02)
+        # all good sources are matched, not only those the matcher finds usable
+        self.assertLessEqual({(m.first.getId(), m.second.getId()) for m in results.matches},
+                             {(m.first.getId(), m.second.getId()) for m in refineResults.matches})
+        self.assertEqual(len({m.first.getId() for m in refineResults.matches}),
+                         len(refineResults.matches))
+
+        # the refined matches are the same when held as a MatchSet
+        config.useMatchSet = True
+        matchSetSolver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+        self.exposure.setWcs(distortedWcs)
+        matchSetResults = matchSetSolver.run(sourceCat=sourceCat, exposure=self.exposure)
+        self.assertIsInstance(matchSetResults.matches, MatchSet)
+        self.assertEqual({(m.first.getId(), m.second.getId()) for m in matchSetResults.matches},
+                         {(m.first.getId(), m.second.getId()) for m in refineResults.matches})
+
+    def testComputeMaxShift(self):
+        """Test the maximum shift between two WCSs over a bounding box
+        """
+        self.assertLess(_computeMaxShift(self.tanWcs, self.tanWcs, self.bbox), 1e-8)
+        shiftedWcs = afwGeom.makeSkyWcs(crpix=self.tanWcs.getPixelOrigin() + lsst.geom.Extent2D(3, 4),
+                                        crval=self.tanWcs.getSkyOrigin(),
+                                        cdMatrix=self.tanWcs.getCdMatrix())
+        self.assertAlmostEqual(_computeMaxShift(self.tanWcs, shiftedWcs, self.bbox), 5, places=6)
+
+    def testSolveVisit(self):
+        """Test solving the exposures of a visit with one reference catalog
+        """
+        distortedWcs, bboxes, exposures, sourceCats = self.makeVisit()
+        config = AstrometryTask.ConfigClass()
+        config.wcsFitter.order = 3
+        config.wcsFitter.numRejIter = 0
+        solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+
+        results = solver.solveVisit(exposures, sourceCats)
+        self.assertEqual(len(results), len(bboxes))
+        for exposure, result in zip(exposures, results):
+            self.assertRefCentroidsMatchWcs(result.refCat, exposure.getWcs())
+        for bbox, exposure, detSourceCat, result in zip(bboxes, exposures, sourceCats, results):
+            self.assertWcsAlmostEqualOverBBox(distortedWcs, exposure.getWcs(), bbox,
+                                              maxDiffSky=0.01*lsst.geom.arcseconds, maxDiffPix=0.02)
+
+            # the reference objects are those solve would have used
+            exposure.setWcs(distortedWcs)
+            singleResult = solver.solve(exposure=exposure, sourceCat=detSourceCat)
+            self.assertEqual({refObj.getId() for refObj in result.refCat},
+                             {refObj.getId() for refObj in singleResult.refCat})
+            self.assertEqual(len(result.matches), len(singleResult.matches))
+
+        with self.assertRaises(RuntimeError):
+            solver.solveVisit(exposures, sourceCats[:1])
+        self.assertEqual(solver.solveVisit([], []), [])
+
+    def testSolveVisitInPool(self):
+        """Test solving the exposures of a visit in worker processes
+        """
+        sourceSchema = afwTable.SourceTable.makeMinimalSchema()
+        measBase.SingleFrameMeasurementTask(schema=sourceSchema)  # expand the schema
+        config = AstrometryTask.ConfigClass()
+        config.wcsFitter.order = 3
+        config.wcsFitter.numRejIter = 0
+        serialSolver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+        config.numVisitProcesses = 2
+        # schema must be passed to the solver task constructor
+        solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader, schema=sourceSchema)
+
+        distortedWcs, bboxes, exposures, sourceCats = self.makeVisit(sourceSchema)
+        serialResults = serialSolver.solveVisit(exposures, sourceCats)
+        serialWcsList = [exposure.getWcs() for exposure in exposures]
+        for exposure in exposures:
+            exposure.setWcs(distortedWcs)
+        results = solver.solveVisit(exposures, sourceCats)
+        self.assertEqual(len(results), len(bboxes))
+        for bbox, exposure, detSourceCat, serialWcs, serialResult, result in zip(
+                bboxes, exposures, sourceCats, serialWcsList, serialResults, results):
+            self.assertWcsAlmostEqualOverBBox(serialWcs, exposure.getWcs(), bbox,
+                                              maxDiffSky=1e-6*lsst.geom.arcseconds, maxDiffPix=1e-6)
+            self.assertEqual([(m.first.getId(), m.second.getId()) for m in result.matches],
+                             [(m.first.getId(), m.second.getId()) for m in serialResult.matches])
+            self.assertFloatsAlmostEqual(result.scatterOnSky.asArcseconds(),
+                                         serialResult.scatterOnSky.asArcseconds(), rtol=1e-10)
+            self.assertEqual(sum(src.get("calib_astrometry_used") for src in detSourceCat),
+                             len(result.matches))
+            # the coords of the sources were updated with the fit WCS
+            for src in detSourceCat:
+                self.assertSpherePointsAlmostEqual(src.getCoord(),
+                                                   exposure.getWcs().pixelToSky(src.getCentroid()))
+            self.assertRefCentroidsMatchWcs(result.refCat, exposure.getWcs())
+
+    def assertRefCentroidsMatchWcs(self, refCat, wcs):
+        """Check that the centroids of a reference catalog were computed with
+        a WCS.
+        """
+        self.assertGreater(len(refCat), 0)
+        centroidKey = afwTable.Point2DKey(refCat.schema["centroid"])
+        for refObj in refCat:
+            self.assertPairsAlmostEqual(refObj.get(centroidKey), wcs.skyToPixel(refObj.getCoord()),
+                                        maxDiff=1e-6)
+
+    def testSolveVisitInPoolFailure(self):
+        """Test that the failures of worker processes are reported with their
+        traceback
+        """
+        config = AstrometryTask.ConfigClass()
+        config.wcsFitter.order = 3
+        config.wcsFitter.numRejIter = 0
+        config.numVisitProcesses = 2
+        solver = AstrometryTask(config=config, refObjLoader=self.refObjLoader)
+
+        distortedWcs, bboxes, exposures, sourceCats = self.makeVisit()
+        sourceCats[1] = afwTable.SourceCatalog(sourceCats[1].schema)
+        with self.assertRaises(RuntimeError) as cm:
+            solver.solveVisit(exposures, sourceCats)
+        self.assertIn("Could not solve 1 of 2 exposures", str(cm.exception))
+        self.assertIn("Traceback", str(cm.exception))
+
+    def testSolveVisitInPoolConfig(self):
+        """Test that worker processes may not be combined with matcher threads
+        """
+        config = AstrometryTask.ConfigClass()
+        config.numVisitProcesses = 2
+        config.validate()
+        config.matcher.numPatternWorkers = 2
+        with self.assertRaises(ValueError):
+            config.validate()
+        config.numVisitProcesses = 1
+        config.validate()
+
+    def makeVisit(self, sourceSchema=None):
+        """Make a visit of two exposures covering the halves of self.bbox
+        """
+        distortedWcs = afwGeom.makeModifiedWcs(pixelTransform=afwGeom.makeRadialTransform([0, 1.01, 1e-7]),
+                                               wcs=self.tanWcs, modifyActualPixels=False)
+        sourceCat = self.makeSourceCat(distortedWcs, sourceSchema)
+        bboxes = [lsst.geom.Box2I(lsst.geom.Point2I(0, 0), lsst.geom.Extent2I(1501, 3001)),
+                  lsst.geom.Box2I(lsst.geom.Point2I(1501, 0), lsst.geom.Extent2I(1500, 3001))]
+        exposures = []
+        sourceCats = []
+        for bbox in bboxes:
+            exposure = afwImage.ExposureF(bbox)
+            exposure.setWcs(distortedWcs)
+            exposure.setFilter(afwImage.Filter("r", True))
+            exposures.append(exposure)
+            detSourceCat = afwTable.SourceCatalog(sourceCat.schema)
+            detSourceCat.extend([src for src in sourceCat
+                                 if lsst.geom.Box2D(bbox).contains(src.getCentroid())], deep=True)
+            sourceCats.append(detSourceCat)
+        return distortedWcs, bboxes, exposures, sourceCats
 
     def doTest(self, pixelsToTanPixels, order=3):
         """Test using pixelsToTanPixels to distort the source positions
@@ -190,7 +430,7 @@ class TestAstrometricSolver(lsst.utils.tests.TestCase):
         )
         self.assertLess(len(resultsNoFitRefSelect.matches), len(resultsNoFit.matches))
 
-    def makeSourceCat(self, distortedWcs):
+    def makeSourceCat(self, distortedWcs, sourceSchema=None):
         """Make a source catalog by reading the position reference stars and distorting the positions
         """
         loadRes = self.refObjLoader.loadPixelBox(bbox=self.bbox, wcs=distortedWcs, filterName="r")
@@ -198,8 +438,9 @@ class TestAstrometricSolver(lsst.utils.tests.TestCase):
         refCentroidKey = afwTable.Point2DKey(refCat.schema["centroid"])
         refFluxRKey = refCat.schema["r_flux"].asKey()
 
-        sourceSchema = afwTable.SourceTable.makeMinimalSchema()
-        measBase.SingleFrameMeasurementTask(schema=sourceSchema)  # expand the schema
+        if sourceSchema is None:
+            sourceSchema = afwTable.SourceTable.makeMinimalSchema()
+            measBase.SingleFrameMeasurementTask(schema=sourceSchema)  # expand the schema
         sourceCat = afwTable.SourceCatalog(sourceSchema)
         sourceCentroidKey = afwTable.Point2DKey(sourceSchema["slot_Centroid"])
         sourceInstFluxKey = sourceSchema["slot_ApFlux_instFlux"].asKey()
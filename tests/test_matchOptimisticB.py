@@ -66,6 +66,29 @@ class TestMatchOptimisticB(unittest.TestCase):
     def testQuadraticDistort(self):
         self.singleTestInstance(self.filename, distort.quadraticDistort)
 
+    def testToleranceWorkers(self):
+        """Test that trying the tolerances concurrently finds the matches of
+        the serial search
+        """
+        serialMatches = self.singleTestInstance(self.filename, distort.linearXDistort)
+        self.config.numToleranceWorkers = 4
+        self.matchOptimisticB = measAstrom.MatchOptimisticBTask(config=self.config)
+        matches = self.singleTestInstance(self.filename, distort.linearXDistort)
+        self.assertEqual([(m.first.getId(), m.second.getId()) for m in matches],
+                         [(m.first.getId(), m.second.getId()) for m in serialMatches])
+
+    def testManyBrightStars(self):
+        """Test matching with a few hundred bright stars, so the pair
+        searches, the reference grid and the polynomial fits work on large
+        pair lists
+        """
+        expectedMatches = self.singleTestInstance(self.filename, distort.linearXDistort)
+        self.config.numBrightStars = 300
+        self.matchOptimisticB = measAstrom.MatchOptimisticBTask(config=self.config)
+        matches = self.singleTestInstance(self.filename, distort.linearXDistort)
+        self.assertEqual([(m.first.getId(), m.second.getId()) for m in matches],
+                         [(m.first.getId(), m.second.getId()) for m in expectedMatches])
+
     def testLargeDistortion(self):
         # This transform is about as extreme as I can get:
         # using 0.0005 in the last value appears to produce numerical issues.
@@ -146,6 +169,7 @@ class TestMatchOptimisticB(unittest.TestCase):
                           (refObj.getId(), refCentroid, source.getId(), sourceCentroid, radius))
 
         self.assertLess(maxDistErr.asArcseconds(), 1e-7)
+        return matches
 
     def computePosRefCatalog(self, sourceCat):
         """Generate a position reference catalog from a source catalog
@@ -232,6 +256,31 @@ class TestMatchOptimisticB(unittest.TestCase):
                 -1,
             )
 
+    def testPatternMatcher(self):
+        """Test that OptimisticPatternMatcherB matches as matchOptimisticB
+        for several sets of tolerances
+        """
+        matchControl = matchOptimisticB.MatchOptimisticBControl()
+        matchControl.refFluxField = "r_flux"
+        matchControl.sourceFluxField = "slot_ApFlux_instFlux"
+
+        sourceCat = self.loadSourceCatalog(self.filename)
+        refCat = self.computePosRefCatalog(sourceCat)
+
+        matcher = matchOptimisticB.OptimisticPatternMatcherB(refCat, sourceCat, matchControl, self.wcs, 0)
+        for matchingAllowancePix, maxRotationDeg in [(10.0, 1.0), (5.0, 0.5), (20.0, 2.0)]:
+            matchControl.matchingAllowancePix = matchingAllowancePix
+            matchControl.maxRotationDeg = maxRotationDeg
+            matches = matcher.match(matchControl)
+            expectedMatches = matchOptimisticB.matchOptimisticB(refCat, sourceCat, matchControl, self.wcs, 0)
+            self.assertGreater(len(matches), 0)
+            self.assertEqual([(m.first.getId(), m.second.getId()) for m in matches],
+                             [(m.first.getId(), m.second.getId()) for m in expectedMatches])
+
+        matchControl.numBrightStars = 50
+        with self.assertRaises(pexExcept.InvalidParameterError):
+            matcher.match(matchControl)
+
     def testConfigPickle(self):
         """Test that we can pickle the Config
 
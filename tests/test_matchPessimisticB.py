@@ -21,6 +21,7 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+from concurrent.futures import ThreadPoolExecutor
 import math
 import os
 import unittest
@@ -250,6 +251,98 @@ class TestMatchPessimisticB(unittest.TestCase):
 
         self.assertEqual(len(matchRes.matches), matchPessConfig.maxRefObjects - 3)
 
+    def testMaxRefObjectsConfig(self):
+        """Test that large reference catalogs require the sparse pair index.
+        """
+        config = measAstrom.MatchPessimisticBTask.ConfigClass()
+        config.maxRefObjects = 2**16
+        config.validate()
+        config.maxRefObjects = 2**16 + 1
+        with self.assertRaises(ValueError):
+            config.validate()
+        config.useSparsePairIndex = True
+        config.validate()
+
+    def testMatcherCache(self):
+        """Test that pattern matchers are reused across matches of the same
+        reference catalog.
+        """
+        sourceCat = self.loadSourceCatalog(self.filename)
+        refCat = self.computePosRefCatalog(sourceCat)
+        distortedCat = distort.distortList(sourceCat, distort.linearXDistort)
+
+        self.config.matcherCacheSize = 1
+        matchPess = measAstrom.MatchPessimisticBTask(config=self.config)
+        matchPess.clearMatcherCache()
+        matchResults = []
+        for cat in [refCat, refCat, refCat[:-10]]:
+            matchResults.append(matchPess.matchObjectsToSources(
+                refCat=cat,
+                sourceCat=distortedCat,
+                wcs=self.distortedWcs,
+                sourceFluxField='slot_ApFlux_instFlux',
+                refFluxField="r_flux",
+            ))
+        self.assertEqual(len(matchResults[1].matches), len(matchResults[0].matches))
+        self.assertIs(matchResults[1].match_tolerance.PPMbObj,
+                      matchResults[0].match_tolerance.PPMbObj)
+        self.assertIsNot(matchResults[2].match_tolerance.PPMbObj,
+                         matchResults[0].match_tolerance.PPMbObj)
+
+        # a matcher reused by another task keeps the log of the task that
+        # made it; the other task passes its own log to each match
+        otherMatchPess = measAstrom.MatchPessimisticBTask(config=self.config, name="otherMatcher")
+        otherMatchRes = otherMatchPess.matchObjectsToSources(
+            refCat=refCat[:-10],
+            sourceCat=distortedCat,
+            wcs=self.distortedWcs,
+            sourceFluxField='slot_ApFlux_instFlux',
+            refFluxField="r_flux",
+        )
+        self.assertIs(otherMatchRes.match_tolerance.PPMbObj, matchResults[2].match_tolerance.PPMbObj)
+        self.assertIs(otherMatchRes.match_tolerance.PPMbObj.log, matchPess.log)
+
+        matchPess.clearMatcherCache()
+        matchRes = matchPess.matchObjectsToSources(
+            refCat=refCat,
+            sourceCat=distortedCat,
+            wcs=self.distortedWcs,
+            sourceFluxField='slot_ApFlux_instFlux',
+            refFluxField="r_flux",
+        )
+        self.assertIsNot(matchRes.match_tolerance.PPMbObj,
+                         matchResults[0].match_tolerance.PPMbObj)
+
+    def testMatcherCacheThreads(self):
+        """Test that tasks matching in several threads share the matcher cache
+        safely.
+        """
+        sourceCat = self.loadSourceCatalog(self.filename)
+        refCat = self.computePosRefCatalog(sourceCat)
+        distortedCat = distort.distortList(sourceCat, distort.linearXDistort)
+
+        self.config.matcherCacheSize = 1
+        matchPess = measAstrom.MatchPessimisticBTask(config=self.config)
+        matchPess.clearMatcherCache()
+        refCats = [refCat, refCat[:-10], refCat[:-20], refCat[:-30]]*2
+
+        def match(cat):
+            return matchPess.matchObjectsToSources(
+                refCat=cat,
+                sourceCat=distortedCat,
+                wcs=self.distortedWcs,
+                sourceFluxField='slot_ApFlux_instFlux',
+                refFluxField="r_flux",
+            )
+
+        serialResults = [match(cat) for cat in refCats]
+        with ThreadPoolExecutor(4) as executor:
+            threadResults = list(executor.map(match, refCats))
+        matchPess.clearMatcherCache()
+        for serialRes, threadRes in zip(serialResults, threadResults):
+            self.assertEqual([(m.first.getId(), m.second.getId()) for m in threadRes.matches],
+                             [(m.first.getId(), m.second.getId()) for m in serialRes.matches])
+
     def computePosRefCatalog(self, sourceCat):
         """Generate a position reference catalog from a source catalog
         """
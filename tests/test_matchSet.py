@@ -0,0 +1,263 @@
+# This file is part of meas_astrom.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+import unittest.mock
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.geom
+import lsst.afw.geom as afwGeom
+import lsst.afw.math as afwMath
+import lsst.afw.table as afwTable
+from lsst.meas.algorithms import LoadReferenceObjectsTask
+from lsst.meas.base import SingleFrameMeasurementTask
+from lsst.meas.astrom import (MatchSet, readCatalogColumn, findCatalogRows, setMatchDistance,
+                              denormalizeMatches, FitTanSipWcsTask, makeMatchStatistics,
+                              makeMatchStatisticsInPixels, makeMatchStatisticsInRadians)
+
+
+class MatchSetTestCase(lsst.utils.tests.TestCase):
+    """Test MatchSet against lists of ReferenceMatch.
+
+    The sources are offset from the reference objects by a small, smoothly
+    varying amount plus a few outliers in x, and the matches are made in a
+    shuffled order so the rows of the two catalogs differ.
+    """
+
+    def setUp(self):
+        crval = lsst.geom.SpherePoint(44, 45, lsst.geom.degrees)
+        crpix = lsst.geom.Point2D(500, 500)
+        scale = 0.2*lsst.geom.arcseconds
+        self.wcs = afwGeom.makeSkyWcs(crpix=crpix, crval=crval,
+                                      cdMatrix=afwGeom.makeCdMatrix(scale=scale))
+
+        refSchema = LoadReferenceObjectsTask.makeMinimalSchema(filterNameList=["r"])
+        self.refCat = afwTable.SimpleCatalog(refSchema)
+        srcSchema = afwTable.SourceTable.makeMinimalSchema()
+        SingleFrameMeasurementTask(schema=srcSchema)
+        self.usedKey = srcSchema.addField("used", type="Flag", doc="set if used in a match")
+        self.sourceCat = afwTable.SourceCatalog(srcSchema)
+        srcCentroidKey = afwTable.Point2DKey(srcSchema["slot_Centroid"])
+
+        rng = np.random.RandomState(12345)
+        numObj = 200
+        self.refCat.reserve(numObj)
+        self.sourceCat.reserve(numObj)
+        for i in range(numObj):
+            refObj = self.refCat.addNew()
+            refObj.setId(1000 + i)
+            x, y = rng.uniform(0, 1000, size=2)
+            refObj.setCoord(self.wcs.pixelToSky(lsst.geom.Point2D(x, y)))
+            src = self.sourceCat.addNew()
+            src.setId(5000 + i)
+            dx, dy = 0.5*rng.normal(size=2) + 1e-3*x
+            if i % 20 == 0:
+                dx -= 30
+            srcPos = lsst.geom.Point2D(x + dx, y + dy)
+            src.set(srcCentroidKey, srcPos)
+            src.setCoord(self.wcs.pixelToSky(srcPos))
+
+        order = rng.permutation(numObj)
+        self.matches = [afwTable.ReferenceMatch(self.refCat[int(i)], self.sourceCat[int(j)], 0.0)
+                        for i, j in zip(order, order)]
+        setMatchDistance(self.matches)
+
+    def tearDown(self):
+        del self.wcs
+        del self.refCat
+        del self.sourceCat
+        del self.matches
+
+    def assertMatchesEqual(self, matches1, matches2):
+        self.assertEqual(len(matches1), len(matches2))
+        for match1, match2 in zip(matches1, matches2):
+            self.assertEqual(match1.first.getId(), match2.first.getId())
+            self.assertEqual(match1.second.getId(), match2.second.getId())
+            self.assertAlmostEqual(match1.distance, match2.distance, delta=1e-14)
+
+    def testConversion(self):
+        """Test converting to and from lists of matches.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        self.assertEqual(len(matchSet), len(self.matches))
+        self.assertIs(matchSet.refCat, self.refCat)
+        self.assertIs(matchSet.sourceCat, self.sourceCat)
+        self.assertMatchesEqual(matchSet.toMatches(), self.matches)
+        self.assertMatchesEqual(list(matchSet), self.matches)
+        self.assertMatchesEqual([matchSet[i] for i in range(len(matchSet))], self.matches)
+        self.assertEqual(matchSet[-1].first.getId(), self.matches[-1].first.getId())
+        with self.assertRaises(IndexError):
+            matchSet[len(matchSet)]
+        refObj, src, distance = matchSet[3]
+        self.assertEqual(src.getId(), self.matches[3].second.getId())
+        self.assertFloatsAlmostEqual(matchSet.sourceX,
+                                     np.array([m.second.getX() for m in self.matches]), rtol=0)
+        self.assertFloatsAlmostEqual(matchSet.refDec,
+                                     np.array([m.first.getCoord().getDec().asRadians()
+                                               for m in self.matches]), rtol=0)
+
+        # Without catalogs the records of the matches are shared
+        matchSetNoCat = MatchSet.fromMatches(self.matches)
+        self.assertEqual(len(matchSetNoCat.refCat), len(self.matches))
+        self.assertMatchesEqual(matchSetNoCat.toMatches(), self.matches)
+        self.assertIs(MatchSet.fromMatches(matchSet), matchSet)
+
+        otherCat = afwTable.SimpleCatalog(self.refCat.schema)
+        otherCat.addNew().setId(1)
+        with self.assertRaises(RuntimeError):
+            MatchSet.fromMatches(self.matches, refCat=otherCat, sourceCat=self.sourceCat)
+
+    def testIds(self):
+        """Test reading the IDs of the matches and finding rows by ID.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        refIds, sourceIds = matchSet.getIds()
+        np.testing.assert_array_equal(refIds, [m.first.getId() for m in self.matches])
+        np.testing.assert_array_equal(sourceIds, [m.second.getId() for m in self.matches])
+        # a subset of a catalog is read record by record
+        subCat = self.sourceCat[::2]
+        self.assertFalse(subCat.isContiguous())
+        idKey = self.sourceCat.schema["id"].asKey()
+        np.testing.assert_array_equal(readCatalogColumn(subCat, idKey, dtype=np.int64),
+                                      readCatalogColumn(self.sourceCat, idKey, dtype=np.int64)[::2])
+        np.testing.assert_array_equal(findCatalogRows(self.sourceCat, [rec.getId() for rec in subCat]),
+                                      np.arange(0, len(self.sourceCat), 2))
+
+    def testDuplicateIds(self):
+        """Test that rows are not found by ID in catalogs with repeated IDs.
+        """
+        self.refCat[7].setId(self.refCat[3].getId())
+        with self.assertRaises(RuntimeError):
+            MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        with self.assertRaises(RuntimeError):
+            MatchSet.fromIds(self.refCat, self.sourceCat, [self.refCat[0].getId()],
+                             [self.sourceCat[0].getId()])
+
+    def testSubset(self):
+        """Test selecting matches.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        good = np.arange(len(matchSet)) % 3 != 0
+        subset = matchSet.subset(good)
+        self.assertMatchesEqual(subset.toMatches(), [m for m, g in zip(self.matches, good) if g])
+        self.assertFloatsAlmostEqual(subset.sourceY, matchSet.sourceY[good], rtol=0)
+        self.assertMatchesEqual(matchSet[5:9].toMatches(), self.matches[5:9])
+
+    def testDistances(self):
+        """Test that setMatchDistance agrees for lists and match sets.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        matchSet.distances[:] = 0
+        setMatchDistance(matchSet)
+        self.assertFloatsAlmostEqual(matchSet.distances, np.array([m.distance for m in self.matches]),
+                                     atol=1e-14, rtol=0)
+
+    def testStatistics(self):
+        """Test that the match statistics agree for lists and match sets.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        flags = afwMath.MEAN | afwMath.STDEV | afwMath.MEDIAN
+        for prop in (afwMath.MEAN, afwMath.STDEV, afwMath.MEDIAN):
+            self.assertAlmostEqual(matchSet.makeMatchStatistics(flags).getValue(prop),
+                                   makeMatchStatistics(self.matches, flags).getValue(prop), delta=1e-14)
+            self.assertAlmostEqual(
+                matchSet.makeMatchStatisticsInPixels(self.wcs, flags).getValue(prop),
+                makeMatchStatisticsInPixels(self.wcs, self.matches, flags).getValue(prop), delta=1e-8)
+            self.assertAlmostEqual(
+                matchSet.makeMatchStatisticsInRadians(self.wcs, flags).getValue(prop),
+                makeMatchStatisticsInRadians(self.wcs, self.matches, flags).getValue(prop), delta=1e-14)
+        with self.assertRaises(RuntimeError):
+            matchSet.subset(slice(0, 0)).makeMatchStatistics(flags)
+
+    def testSourceFlag(self):
+        """Test flagging the sources of the matches.
+        """
+        matchSet = MatchSet.fromMatches(self.matches[:10], refCat=self.refCat, sourceCat=self.sourceCat)
+        matchSet.setSourceFlag(self.usedKey)
+        flagged = {src.getId() for src in self.sourceCat if src.get(self.usedKey)}
+        self.assertEqual(flagged, {m.second.getId() for m in self.matches[:10]})
+
+    def testDenormalizeMatches(self):
+        """Test that denormalizeMatches agrees for lists and match sets.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        catalog = denormalizeMatches(self.matches)
+        catalogFromSet = denormalizeMatches(matchSet)
+        self.assertEqual(catalog.schema, catalogFromSet.schema)
+        for name in ("ref_id", "src_id", "distance", "ref_coord_ra"):
+            self.assertFloatsEqual(catalog[name], catalogFromSet[name])
+
+    def testFitTanSipWcs(self):
+        """Test that FitTanSipWcsTask agrees for lists and match sets.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        config = FitTanSipWcsTask.ConfigClass()
+        config.numRejIter = 2
+        fitter = FitTanSipWcsTask(config=config)
+
+        initWcs = fitter.initialWcs(self.matches, self.wcs)
+        initWcsFromSet = fitter.initialWcs(matchSet, self.wcs)
+        self.assertPairsAlmostEqual(initWcs.getPixelOrigin(), initWcsFromSet.getPixelOrigin(), maxDiff=1e-9)
+        self.assertSpherePointsAlmostEqual(initWcs.getSkyOrigin(), initWcsFromSet.getSkyOrigin(),
+                                           maxSep=1e-6*lsst.geom.arcseconds)
+
+        rejected = np.zeros(len(self.matches), dtype=bool)
+        rejected = fitter.rejectMatches(self.matches, self.wcs, rejected)
+        self.assertGreater(rejected.sum(), 0)
+        np.testing.assert_array_equal(fitter.rejectMatches(matchSet, self.wcs, np.zeros_like(rejected)),
+                                      rejected)
+
+        res = fitter.fitWcs(self.matches, self.wcs, refCat=self.refCat, sourceCat=self.sourceCat)
+        resFromSet = fitter.fitWcs(matchSet, self.wcs, refCat=self.refCat, sourceCat=self.sourceCat)
+        self.assertWcsAlmostEqualOverBBox(res.wcs, resFromSet.wcs,
+                                          lsst.geom.Box2I(lsst.geom.Point2I(0, 0),
+                                                          lsst.geom.Extent2I(1000, 1000)),
+                                          maxDiffSky=1e-6*lsst.geom.arcseconds, maxDiffPix=1e-6)
+        self.assertFloatsAlmostEqual(matchSet.distances, np.array([m.distance for m in self.matches]),
+                                     atol=1e-14, rtol=0)
+
+    def testFitTanSipWcsMakesMatchesOnce(self):
+        """Test that FitTanSipWcsTask makes the match records of a match set
+        once per fit, not once per rejection iteration.
+        """
+        matchSet = MatchSet.fromMatches(self.matches, refCat=self.refCat, sourceCat=self.sourceCat)
+        config = FitTanSipWcsTask.ConfigClass()
+        config.numRejIter = 3
+        fitter = FitTanSipWcsTask(config=config)
+        with unittest.mock.patch.object(MatchSet, "toMatches", autospec=True,
+                                        side_effect=MatchSet.toMatches) as toMatches:
+            fitter.fitWcs(matchSet, self.wcs, refCat=self.refCat, sourceCat=self.sourceCat)
+        self.assertEqual(toMatches.call_count, 1)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -21,12 +21,15 @@
 #
 
 from copy import copy
+import os
+import tempfile
 import unittest
+import unittest.mock
 
 import numpy as np
 
 from lsst.meas.astrom.pessimistic_pattern_matcher_b_3D \
-    import PessimisticPatternMatcherB
+    import PessimisticPatternMatcherB, _evict_index_cache
 from lsst.log import Log
 
 __deg_to_rad__ = np.pi/180
@@ -62,6 +65,23 @@ class TestPessimisticPatternMatcherB(unittest.TestCase):
         self.source_obj_array = copy(self.reference_obj_array)
         self.log = Log()
 
+    def _makeRotatedMatchKwargs(self, ppmb, **kwargs):
+        """Return the arguments of a match of the sources rotated by 45
+        arcseconds about the z axis, updated with ``kwargs``.
+        """
+        theta_rotation = ppmb._create_spherical_rotation_matrix(
+            np.array([0, 0, 1]), np.cos(np.radians(45.0 / 3600.)),
+            np.sin(np.radians(45.0 / 3600.)))
+        source_obj_array = self.source_obj_array.copy()
+        source_obj_array[:, :3] = np.dot(
+            theta_rotation, source_obj_array[:, :3].transpose()).transpose()
+        match_kwargs = dict(
+            source_array=source_obj_array, n_check=9, n_match=6, n_agree=2,
+            max_n_patterns=100, max_shift=60., max_rotation=5.0, max_dist=5.,
+            min_matches=30, pattern_skip_array=None)
+        match_kwargs.update(kwargs)
+        return match_kwargs
+
     def testConstructPattern(self):
         """ Test that a specified pattern can be found in the reference
         data and that the explicit ids match.
@@ -106,6 +126,338 @@ class TestPessimisticPatternMatcherB(unittest.TestCase):
         self.assertEqual(pattern_list[4], 32)
         self.assertEqual(pattern_list[5], 64)
 
+    def testCompiledPatternSearch(self):
+        """ Test that the compiled pattern search finds the same patterns and
+        matches as the Python implementation.
+        """
+        py_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log)
+        for max_pair_dist_rad in [None, 1.5 * __deg_to_rad__]:
+            compiled_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                max_pair_dist_rad=max_pair_dist_rad,
+                use_compiled_search=True)
+
+            for pattern_ids in [np.arange(9), [2, 4, 8, 16, 32, 64]]:
+                args = (self.source_obj_array[pattern_ids, :3], 6,
+                        np.cos(np.radians(60. / 3600.)),
+                        np.cos(np.radians(1.0)) ** 2, np.radians(5. / 3600.))
+                py_struct = \
+                    py_ppmb._construct_pattern_and_shift_rot_matrix(*args)
+                compiled_struct = \
+                    compiled_ppmb._construct_pattern_and_shift_rot_matrix(
+                        *args)
+                self.assertEqual(compiled_struct.ref_candidates,
+                                 py_struct.ref_candidates)
+                self.assertEqual(compiled_struct.src_candidates,
+                                 py_struct.src_candidates)
+                np.testing.assert_allclose(compiled_struct.shift_rot_matrix,
+                                           py_struct.shift_rot_matrix,
+                                           atol=1e-12)
+
+            match_kwargs = self._makeRotatedMatchKwargs(py_ppmb)
+            py_struct = py_ppmb.match(**match_kwargs)
+            compiled_struct = compiled_ppmb.match(**match_kwargs)
+            self.assertEqual(compiled_struct.pattern_idx,
+                             py_struct.pattern_idx)
+            np.testing.assert_array_equal(compiled_struct.match_ids,
+                                          py_struct.match_ids)
+
+    def testPatternPrefilter(self):
+        """ Test that the pattern prefilter only rejects patterns the search
+        cannot match and leaves the match unchanged.
+        """
+        ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log)
+        prefilter_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log,
+            use_pattern_prefilter=True)
+
+        max_dist_rad = np.radians(5. / 3600.)
+        for pattern_ids in [np.arange(9), [2, 4, 8, 16, 32, 64]]:
+            args = (self.source_obj_array[pattern_ids, :3], 6,
+                    np.cos(np.radians(60. / 3600.)),
+                    np.cos(np.radians(1.0)) ** 2, max_dist_rad)
+            struct = ppmb._construct_pattern_and_shift_rot_matrix(*args)
+            prefilter_struct = \
+                prefilter_ppmb._construct_pattern_and_shift_rot_matrix(*args)
+            self.assertEqual(prefilter_struct.ref_candidates,
+                             struct.ref_candidates)
+            self.assertEqual(prefilter_struct.src_candidates,
+                             struct.src_candidates)
+
+        # A pattern with spokes longer than any reference pair is rejected.
+        src_dist_array = np.full(8, 2 * ppmb._dist_array[-1] + 1e-2)
+        self.assertFalse(prefilter_ppmb._test_pattern_prefilter(
+            src_dist_array, 6, max_dist_rad))
+
+        # Patterns of sources unrelated to the references, with a tight
+        # tolerance and a loose shift, have candidate first spokes but are
+        # rejected on the occupancy of their other spokes.
+        tight_dist_rad = np.radians(0.2 / 3600.)
+        rng = np.random.RandomState(54321)
+        unrelated_array = np.empty((200, 3))
+        cos_theta_array = rng.uniform(
+            np.cos(np.pi/2 + 0.5*__deg_to_rad__),
+            np.cos(np.pi/2 - 0.5*__deg_to_rad__), size=len(unrelated_array))
+        sin_theta_array = np.sqrt(1 - cos_theta_array**2)
+        phi_array = rng.uniform(-0.5, 0.5, size=len(unrelated_array)) * \
+            __deg_to_rad__
+        unrelated_array[:, 0] = sin_theta_array*np.cos(phi_array)
+        unrelated_array[:, 1] = sin_theta_array*np.sin(phi_array)
+        unrelated_array[:, 2] = cos_theta_array
+        n_rejected = 0
+        for pattern_idx in range(len(unrelated_array) - 9):
+            pattern_array = unrelated_array[pattern_idx:pattern_idx + 9]
+            src_dist_array = np.sqrt(np.sum(
+                (pattern_array[1:] - pattern_array[0]) ** 2, axis=1))
+            start_idx, end_idx = np.searchsorted(
+                ppmb._dist_array,
+                [src_dist_array[0] - tight_dist_rad,
+                 src_dist_array[0] + tight_dist_rad])
+            if start_idx >= end_idx:
+                continue
+            plausible = prefilter_ppmb._test_pattern_prefilter(
+                src_dist_array, 6, tight_dist_rad)
+            struct = ppmb._construct_pattern_and_shift_rot_matrix(
+                pattern_array, 6, np.cos(np.radians(1.)),
+                np.cos(np.radians(1.0)) ** 2, tight_dist_rad)
+            if not plausible:
+                self.assertFalse(struct.ref_candidates)
+                n_rejected += 1
+        self.assertGreater(n_rejected, 10)
+        # The occupancy bins follow the tolerance.
+        self.assertEqual(prefilter_ppmb._spoke_occupancy[0], tight_dist_rad)
+
+        match_kwargs = self._makeRotatedMatchKwargs(ppmb)
+        match_struct = ppmb.match(**match_kwargs)
+        prefilter_struct = prefilter_ppmb.match(**match_kwargs)
+        self.assertEqual(prefilter_struct.pattern_idx,
+                         match_struct.pattern_idx)
+        np.testing.assert_array_equal(prefilter_struct.match_ids,
+                                      match_struct.match_ids)
+
+    def testWarmStart(self):
+        """ Test that skipping the candidates recorded as failing the shift
+        and rotation tests leaves the matches of repeated, softened calls
+        unchanged.
+        """
+        ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log)
+        warm_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log)
+        for max_dist in [0.5, 1., 2., 4.]:
+            match_kwargs = self._makeRotatedMatchKwargs(ppmb, max_dist=max_dist)
+            match_struct = ppmb.match(**match_kwargs)
+            warm_struct = warm_ppmb.match(warm_start=True, **match_kwargs)
+            self.assertEqual(warm_struct.pattern_idx, match_struct.pattern_idx)
+            np.testing.assert_array_equal(warm_struct.match_ids,
+                                          match_struct.match_ids)
+        rejected_candidates = warm_ppmb._warm_start_state[1]
+        self.assertGreater(
+            sum(len(candidates)
+                for candidates in rejected_candidates.values()), 0)
+
+        # Changing the shift tolerance resets the records.
+        match_kwargs["max_shift"] = 30.
+        warm_ppmb.match(warm_start=True, **match_kwargs)
+        self.assertIsNot(warm_ppmb._warm_start_state[1], rejected_candidates)
+
+    def testParallelPatterns(self):
+        """ Test that constructing patterns concurrently matches the same
+        pattern as the serial search.
+        """
+        for use_compiled_search in [False, True]:
+            ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                use_compiled_search=use_compiled_search)
+            for pattern_skip_array in [None, np.array([0, 1, 2, 5])]:
+                match_kwargs = self._makeRotatedMatchKwargs(
+                    ppmb, pattern_skip_array=pattern_skip_array)
+                serial_struct = ppmb.match(**match_kwargs)
+                parallel_struct = ppmb.match(n_workers=3, **match_kwargs)
+                self.assertEqual(parallel_struct.pattern_idx,
+                                 serial_struct.pattern_idx)
+                np.testing.assert_array_equal(parallel_struct.match_ids,
+                                              serial_struct.match_ids)
+                np.testing.assert_array_equal(parallel_struct.distances_rad,
+                                              serial_struct.distances_rad)
+
+    def testSparsePairIndex(self):
+        """ Test that a radius bounded reference pair index stores the same
+        pairs as the dense index and produces identical matches.
+        """
+        dense_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log)
+
+        max_pair_dist_rad = 0.25 * __deg_to_rad__
+        sparse_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log,
+            max_pair_dist_rad=max_pair_dist_rad)
+        n_pairs = np.sum(dense_ppmb._dist_array <= max_pair_dist_rad)
+        self.assertEqual(len(sparse_ppmb._dist_array), n_pairs)
+        np.testing.assert_array_equal(sparse_ppmb._dist_array,
+                                      dense_ppmb._dist_array[:n_pairs])
+        np.testing.assert_array_equal(sparse_ppmb._id_array,
+                                      dense_ppmb._id_array[:n_pairs])
+        for ref_id in [0, 17, 999]:
+            sparse_dists, sparse_ids = sparse_ppmb._get_reference_pairs(ref_id)
+            dense_dists, dense_ids = dense_ppmb._get_reference_pairs(ref_id)
+            n_ref_pairs = np.sum(dense_dists <= max_pair_dist_rad)
+            np.testing.assert_array_equal(sparse_dists,
+                                          dense_dists[:n_ref_pairs])
+            np.testing.assert_array_equal(sparse_ids, dense_ids[:n_ref_pairs])
+
+        # Twice the largest distance from the field center bounds the
+        # length of any source spoke.
+        sparse_ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=self.log,
+            max_pair_dist_rad=2 * 0.75 * __deg_to_rad__)
+        dense_struct = dense_ppmb.match(
+            source_array=self.source_obj_array, n_check=9, n_match=6,
+            n_agree=2, max_n_patterns=100, max_shift=60., max_rotation=5.0,
+            max_dist=5., min_matches=30, pattern_skip_array=None)
+        sparse_struct = sparse_ppmb.match(
+            source_array=self.source_obj_array, n_check=9, n_match=6,
+            n_agree=2, max_n_patterns=100, max_shift=60., max_rotation=5.0,
+            max_dist=5., min_matches=30, pattern_skip_array=None)
+        self.assertEqual(sparse_struct.pattern_idx, dense_struct.pattern_idx)
+        np.testing.assert_array_equal(sparse_struct.match_ids,
+                                      dense_struct.match_ids)
+        np.testing.assert_array_equal(sparse_struct.distances_rad,
+                                      dense_struct.distances_rad)
+
+    def testLargeCatalogIds(self):
+        """ Test that catalogs of more than 2 ** 16 objects use 32 bit ids
+        and match into the objects beyond the 16 bit range.
+        """
+        n_points = 2 ** 16 + 1000
+        cos_theta_array = np.random.uniform(
+            np.cos(np.pi/2 + 0.5*__deg_to_rad__),
+            np.cos(np.pi/2 - 0.5*__deg_to_rad__), size=n_points)
+        sin_theta_array = np.sqrt(1 - cos_theta_array**2)
+        phi_array = np.random.uniform(-0.5, 0.5, size=n_points)*__deg_to_rad__
+        reference_array = np.empty((n_points, 3))
+        reference_array[:, 0] = sin_theta_array*np.cos(phi_array)
+        reference_array[:, 1] = sin_theta_array*np.sin(phi_array)
+        reference_array[:, 2] = cos_theta_array
+
+        ppmb = PessimisticPatternMatcherB(
+            reference_array=reference_array,
+            log=self.log,
+            max_pair_dist_rad=5. / 3600. * __deg_to_rad__)
+        self.assertEqual(ppmb._id_array.dtype, np.uint32)
+        self.assertEqual(ppmb._pair_indptr_array[-1],
+                         2 * len(ppmb._id_array))
+
+        source_array = reference_array[-2000:]
+        match_struct = ppmb._match_sources(source_array, np.identity(3))
+        np.testing.assert_array_equal(match_struct.match_ids[:, 0],
+                                      np.arange(2000))
+        np.testing.assert_array_equal(match_struct.match_ids[:, 1],
+                                      np.arange(n_points - 2000, n_points))
+
+    def testIndexCache(self):
+        """ Test that a reference pair index saved to a cache directory is
+        loaded unchanged and that old indexes are evicted.
+        """
+        with tempfile.TemporaryDirectory() as index_cache_dir:
+            built_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                index_cache_dir=index_cache_dir)
+            self.assertEqual(len(os.listdir(index_cache_dir)), 1)
+
+            loaded_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                index_cache_dir=index_cache_dir)
+            self.assertIsInstance(loaded_ppmb._pair_dist_array, np.memmap)
+            self.assertIsNone(loaded_ppmb._pair_indptr_array)
+            for array_name in ["_dist_array", "_id_array", "_pair_id_array",
+                               "_pair_dist_array"]:
+                np.testing.assert_array_equal(
+                    getattr(loaded_ppmb, array_name),
+                    getattr(built_ppmb, array_name))
+
+            match_struct = loaded_ppmb.match(
+                source_array=self.source_obj_array, n_check=9, n_match=6,
+                n_agree=2, max_n_patterns=100, max_shift=60.,
+                max_rotation=5.0, max_dist=5., min_matches=30,
+                pattern_skip_array=None)
+            self.assertEqual(len(match_struct.match_ids),
+                             len(self.reference_obj_array))
+
+            # A second index larger than the cache size removes the first
+            # but is itself kept.
+            sparse_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                max_pair_dist_rad=0.25 * __deg_to_rad__,
+                index_cache_dir=index_cache_dir,
+                max_index_cache_bytes=1)
+            self.assertEqual(os.listdir(index_cache_dir),
+                             [sparse_ppmb._get_index_key()])
+
+    def testIndexCacheMissingArray(self):
+        """ Test that a cached index with a missing array is rebuilt and that
+        abandoned partial indexes are removed.
+        """
+        with tempfile.TemporaryDirectory() as index_cache_dir:
+            built_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                max_pair_dist_rad=0.25 * __deg_to_rad__,
+                index_cache_dir=index_cache_dir)
+            index_key = built_ppmb._get_index_key()
+            os.remove(os.path.join(index_cache_dir, index_key,
+                                   "_pair_dist_array.npy"))
+
+            rebuilt_ppmb = PessimisticPatternMatcherB(
+                reference_array=self.reference_obj_array[:, :3],
+                log=self.log,
+                max_pair_dist_rad=0.25 * __deg_to_rad__,
+                index_cache_dir=index_cache_dir)
+            self.assertNotIsInstance(rebuilt_ppmb._pair_dist_array, np.memmap)
+            np.testing.assert_array_equal(rebuilt_ppmb._pair_dist_array,
+                                          built_ppmb._pair_dist_array)
+
+            # A partial index left by a killed process is removed once it is
+            # old, while a recent one is kept but counted.
+            stale_dir = os.path.join(index_cache_dir, "stale.tmp1")
+            recent_dir = os.path.join(index_cache_dir, "recent.tmp2")
+            for tmp_dir in (stale_dir, recent_dir):
+                os.makedirs(tmp_dir)
+                np.save(os.path.join(tmp_dir, "_dist_array.npy"),
+                        np.zeros(1000))
+            os.utime(stale_dir, (0, 0))
+            _evict_index_cache(index_cache_dir, max_index_cache_bytes=1)
+            self.assertEqual(os.listdir(index_cache_dir), ["recent.tmp2"])
+
+    def testMatchLog(self):
+        """ Test that a match writes to the log passed to it rather than to
+        the log of the matcher.
+        """
+        ppmb = PessimisticPatternMatcherB(
+            reference_array=self.reference_obj_array[:, :3],
+            log=unittest.mock.Mock())
+        match_log = unittest.mock.Mock()
+        match_kwargs = self._makeRotatedMatchKwargs(ppmb, log=match_log)
+        match_struct = ppmb.match(**match_kwargs)
+        self.assertGreater(len(match_struct.match_ids), 0)
+        self.assertTrue(match_log.debug.called)
+        self.assertFalse(ppmb.log.method_calls)
+
     def testMatchPerfect(self):
         """ Input objects that have no shift or rotation to the matcher
         and test that we return a match.
@@ -0,0 +1,102 @@
+/*
+ * LSST Data Management System
+ * Copyright 2016 LSST/AURA
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <http://www.lsstcorp.org/LegalNotices/>.
+ */
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE testPolynomialTransform
+
+// The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <thread>
+#include <vector>
+
+#include "ndarray.h"
+#include "lsst/geom/AffineTransform.h"
+#include "lsst/geom/Point.h"
+#include "lsst/meas/astrom/PolynomialTransform.h"
+
+namespace geom = lsst::geom;
+namespace astrom = lsst::meas::astrom;
+
+namespace {
+
+astrom::PolynomialTransform makeTransform(int order) {
+    ndarray::Array<double, 2, 2> xCoeffs = ndarray::allocate(order + 1, order + 1);
+    ndarray::Array<double, 2, 2> yCoeffs = ndarray::allocate(order + 1, order + 1);
+    xCoeffs.deep() = 0;
+    yCoeffs.deep() = 0;
+    for (int p = 0; p <= order; ++p) {
+        for (int q = 0; p + q <= order; ++q) {
+            xCoeffs[p][q] = 1.0 / (1 + p + 2 * q);
+            yCoeffs[p][q] = -1.0 / (2 + 2 * p + q);
+        }
+    }
+    return astrom::PolynomialTransform(xCoeffs, yCoeffs);
+}
+
+/*
+ * Evaluate a transform and its linearization at a set of points from several
+ * threads at once and check that each thread gets the serial results.
+ */
+void checkConcurrentEvaluation(astrom::PolynomialTransform const& transform) {
+    int const numPoints = 2000;
+    int const numThreads = 4;
+    std::vector<geom::Point2D> points;
+    std::vector<geom::Point2D> expectedPoints;
+    std::vector<geom::AffineTransform> expectedLinear;
+    for (int i = 0; i < numPoints; ++i) {
+        points.emplace_back(-0.9 + 1.8 * i / numPoints, 0.7 - 1.3 * i / numPoints);
+        expectedPoints.push_back(transform(points.back()));
+        expectedLinear.push_back(transform.linearize(points.back()));
+    }
+
+    std::vector<int> numMismatches(numThreads, 0);
+    std::vector<std::thread> threads;
+    for (int t = 0; t < numThreads; ++t) {
+        threads.emplace_back([&, t]() {
+            for (int repeat = 0; repeat < 20; ++repeat) {
+                for (int i = 0; i < numPoints; ++i) {
+                    if (transform(points[i]) != expectedPoints[i]) {
+                        ++numMismatches[t];
+                    }
+                    if (transform.linearize(points[i]).getParameterVector() !=
+                        expectedLinear[i].getParameterVector()) {
+                        ++numMismatches[t];
+                    }
+                }
+            }
+        });
+    }
+    for (auto& thread : threads) {
+        thread.join();
+    }
+    for (int t = 0; t < numThreads; ++t) {
+        BOOST_CHECK_EQUAL(numMismatches[t], 0);
+    }
+}
+
+}  // namespace
+
+BOOST_AUTO_TEST_CASE(concurrentEvaluation) { checkConcurrentEvaluation(makeTransform(5)); }
+
+// Orders above those with stack workspaces use heap workspaces.
+BOOST_AUTO_TEST_CASE(concurrentEvaluationHighOrder) { checkConcurrentEvaluation(makeTransform(20)); }